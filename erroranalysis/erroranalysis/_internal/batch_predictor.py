@@ -0,0 +1,130 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+class BatchPredictor(object):
+    """Calls a prediction function on row chunks of a dataset.
+
+    Each chunk is predicted separately, optionally on a pool of threads
+    or processes, and the chunk predictions are concatenated in order.
+    At most two chunks per worker are in flight at any time, so the
+    memory used by the model is bounded by the chunk size instead of
+    the size of the dataset.
+
+    :param chunk_size: The number of rows to predict at once, or None
+        to predict the whole dataset in a single call.
+    :type chunk_size: int
+    :param num_workers: The number of workers predicting chunks in
+        parallel.
+    :type num_workers: int
+    :param use_processes: Whether to predict on a pool of processes
+        instead of threads.  The prediction function and the dataset must
+        be picklable, and are sent once to each worker process, which is
+        then only sent the row ranges of the chunks to predict.
+        Processes avoid contention on the global interpreter lock for
+        pure python models.
+    :type use_processes: bool
+    """
+
+    def __init__(self, chunk_size=None, num_workers=1, use_processes=False):
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError("Chunk size must be a positive integer")
+        if num_workers < 1:
+            raise ValueError("Number of workers must be a positive integer")
+        self._chunk_size = chunk_size
+        self._num_workers = num_workers
+        self._use_processes = use_processes
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @property
+    def num_workers(self):
+        return self._num_workers
+
+    @property
+    def use_processes(self):
+        return self._use_processes
+
+    def predict(self, predict_function, dataset):
+        """Predicts the dataset chunk by chunk.
+
+        :param predict_function: The prediction function, for example
+            the predict or predict_proba method of a model.
+        :type predict_function: function
+        :param dataset: The dataset to predict.
+        :type dataset: numpy.ndarray or pandas.DataFrame or list[][] or
+            scipy.sparse.csr_matrix
+        :return: The concatenated predictions.
+        :rtype: numpy.ndarray
+        """
+        num_rows = dataset.shape[0] if hasattr(dataset, 'shape') \
+            else len(dataset)
+        if self._chunk_size is None or num_rows <= self._chunk_size:
+            return predict_function(dataset)
+        starts = range(0, num_rows, self._chunk_size)
+        if self._num_workers == 1:
+            predictions = [predict_function(self._get_chunk(dataset, start))
+                           for start in starts]
+        else:
+            predictions = self._predict_parallel(predict_function, dataset,
+                                                 starts)
+        return np.concatenate([np.asarray(prediction)
+                               for prediction in predictions])
+
+    def _predict_parallel(self, predict_function, dataset, starts):
+        if self._use_processes:
+            # the model and dataset are loaded once per worker process
+            executor = ProcessPoolExecutor(
+                max_workers=self._num_workers,
+                initializer=_init_worker,
+                initargs=(predict_function, dataset))
+        else:
+            executor = ThreadPoolExecutor(max_workers=self._num_workers)
+        max_in_flight = 2 * self._num_workers
+        predictions = []
+        with executor:
+            futures = deque()
+            for start in starts:
+                if len(futures) == max_in_flight:
+                    predictions.append(futures.popleft().result())
+                if self._use_processes:
+                    future = executor.submit(_predict_worker_rows, start,
+                                             start + self._chunk_size)
+                else:
+                    future = executor.submit(
+                        predict_function, self._get_chunk(dataset, start))
+                futures.append(future)
+            while futures:
+                predictions.append(futures.popleft().result())
+        return predictions
+
+    def _get_chunk(self, dataset, start):
+        return _get_rows(dataset, start, start + self._chunk_size)
+
+
+# The prediction function and dataset of a worker process
+_worker_state = {}
+
+
+def _init_worker(predict_function, dataset):
+    _worker_state['predict_function'] = predict_function
+    _worker_state['dataset'] = dataset
+
+
+def _predict_worker_rows(start, end):
+    dataset = _worker_state['dataset']
+    return _worker_state['predict_function'](_get_rows(dataset, start, end))
+
+
+def _get_rows(dataset, start, end):
+    if isinstance(dataset, (pd.DataFrame, pd.Series)):
+        return dataset.iloc[start:end]
+    return dataset[start:end]
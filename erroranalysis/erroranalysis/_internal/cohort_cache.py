@@ -0,0 +1,100 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 64
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class CohortCache(object):
+    """Least recently used cache from cohort signatures to row indexes.
+
+    The cache is bounded both by the number of cohorts and by the total
+    number of bytes of the cached row indexes.  The least recently used
+    cohorts are evicted first when either bound is exceeded.
+
+    :param max_entries: The maximum number of cached cohorts.
+    :type max_entries: int
+    :param max_bytes: The maximum total size in bytes of the cached
+        row indexes.
+    :type max_bytes: int
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, signature):
+        return signature in self._entries
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, signature):
+        """Returns the cached row indexes for the cohort signature.
+
+        :param signature: The canonical signature of the cohort.
+        :type signature: str
+        :return: The cached row indexes or None if the cohort
+            is not cached.
+        :rtype: numpy.ndarray
+        """
+        row_indexes = self._entries.get(signature)
+        if row_indexes is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries.move_to_end(signature)
+        return row_indexes
+
+    def put(self, signature, row_indexes):
+        """Caches the row indexes of the cohort.
+
+        The row indexes are made read-only since they are shared
+        between requests.
+
+        :param signature: The canonical signature of the cohort.
+        :type signature: str
+        :param row_indexes: The row indexes of the cohort.
+        :type row_indexes: numpy.ndarray
+        """
+        self._remove(signature)
+        if row_indexes.nbytes > self._max_bytes:
+            return
+        row_indexes.flags.writeable = False
+        self._entries[signature] = row_indexes
+        self._nbytes += row_indexes.nbytes
+        while (len(self._entries) > self._max_entries or
+               self._nbytes > self._max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= evicted.nbytes
+
+    def clear(self):
+        """Invalidates all cached cohorts and resets the counters."""
+        self._entries.clear()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def _remove(self, signature):
+        row_indexes = self._entries.pop(signature, None)
+        if row_indexes is not None:
+            self._nbytes -= row_indexes.nbytes
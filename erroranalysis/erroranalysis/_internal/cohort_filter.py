@@ -1,8 +1,10 @@
 # Copyright (c) Microsoft Corporation
 # Licensed under the MIT License.
 
+import json
 import numpy as np
 import pandas as pd
+from functools import lru_cache
 from erroranalysis._internal.constants import (PRED_Y,
                                                TRUE_Y,
                                                ROW_INDEX,
@@ -15,6 +17,11 @@ METHOD_EQUAL = 'equal'
 METHOD_GREATER = 'greater'
 METHOD_LESS_AND_EQUAL = 'less and equal'
 METHOD_RANGE = 'in the range of'
+FILTERS = 'filters'
+COMPOSITE_FILTERS = 'compositeFilters'
+OPERATION = 'operation'
+OPERATION_AND = 'and'
+COMPILED_FILTER_CACHE_SIZE = 256
 
 
 def filter_from_cohort(df, filters, composite_filters,
@@ -37,72 +44,237 @@ def filter_from_cohort(df, filters, composite_filters,
     return df
 
 
+def filter_indexes_from_cohort(data, filters, composite_filters,
+                               categorical_features, categories,
+                               parent_indexes=None):
+    """Returns the row indexes of the cohort defined by the filters.
+
+    :param data: The dataset indexable by column name.
+    :type data: ColumnStore or pandas.DataFrame
+    :param filters: The filters from the dashboard.
+    :type filters: list[dict]
+    :param composite_filters: The composite filters from the dashboard.
+    :type composite_filters: list[dict]
+    :param categorical_features: The categorical feature names.
+    :type categorical_features: list[str]
+    :param categories: The categories for each categorical feature.
+    :type categories: list[list]
+    :param parent_indexes: The row indexes of a parent cohort to refine.
+        If specified, the filters are only evaluated over the rows of the
+        parent cohort of the column store.
+    :type parent_indexes: numpy.ndarray
+    :return: The sorted row indexes of the cohort.
+    :rtype: numpy.ndarray
+    """
+    if parent_indexes is not None:
+        data = data.subset(parent_indexes)
+    mask = np.ones(len(data), dtype=bool)
+    for cohort_filters in [filters, composite_filters]:
+        if cohort_filters:
+            mask &= compile_filters(cohort_filters).evaluate(
+                data, categorical_features, categories)
+    if parent_indexes is not None:
+        return parent_indexes[mask]
+    return np.flatnonzero(mask)
+
+
 def apply_recursive_filter(df, filters, categorical_features, categories):
     if filters:
-        return df.query(build_query(filters, categorical_features, categories))
+        mask = compile_filters(filters).evaluate(df,
+                                                 categorical_features,
+                                                 categories)
+        return df[mask]
     else:
         return df
 
 
-def build_query(filters, categorical_features, categories):
-    queries = []
-    for filter in filters:
-        if METHOD in filter:
-            method = filter[METHOD]
-            arg0 = str(filter['arg'][0])
-            colname = filter['column']
-            if method == METHOD_GREATER:
-                queries.append("`" + colname + "` > " + arg0)
-            elif method == METHOD_LESS_AND_EQUAL:
-                queries.append("`" + colname + "` <= " + arg0)
-            elif method == METHOD_RANGE:
-                arg1 = str(filter['arg'][1])
-                queries.append("`" + colname + "` >= " + arg0 +
-                               ' & `' + colname + "` <= " + arg1)
-            elif method == METHOD_INCLUDES or method == METHOD_EXCLUDES:
-                query = build_cat_bounds_query(filter, colname, method,
-                                               categorical_features,
-                                               categories)
-                queries.append(query)
-            elif method == METHOD_EQUAL:
-                is_categorical = False
-                if categorical_features:
-                    is_categorical = colname in categorical_features
-                if is_categorical:
-                    cat_idx = categorical_features.index(colname)
-                    arg0i = filter['arg'][0]
-                    arg_cat = str(categories[cat_idx][arg0i])
-                    queries.append("`{}` == '{}'".format(colname, arg_cat))
-                else:
-                    queries.append("`" + colname + "` == " + arg0)
-            else:
-                raise ValueError(
-                    "Unsupported method type: {}".format(method))
+def get_filter_signature(filters):
+    """Returns the canonical signature of the given filters.
+
+    Two filter lists that only differ in the ordering of the keys
+    of their filter dictionaries have the same signature.
+
+    :param filters: The filters or composite filters from the dashboard.
+    :type filters: list[dict]
+    :return: The canonical json signature of the filters.
+    :rtype: str
+    """
+    return json.dumps(filters or [], sort_keys=True, default=_to_json)
+
+
+def get_cohort_signature(filters, composite_filters):
+    """Returns the canonical signature of the cohort defined by the filters.
+
+    :param filters: The filters from the dashboard.
+    :type filters: list[dict]
+    :param composite_filters: The composite filters from the dashboard.
+    :type composite_filters: list[dict]
+    :return: The canonical json signature of the cohort.
+    :rtype: str
+    """
+    return json.dumps([filters or [], composite_filters or []],
+                      sort_keys=True, default=_to_json)
+
+
+def _to_json(value):
+    # Note: numpy arguments keep their type, so compiled predicates
+    # compare against numbers instead of their string representation
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+def compile_filters(filters):
+    """Compiles the filters into a predicate that computes a boolean mask.
+
+    Compiled filters are memoized by their canonical signature, so the
+    same filters sent repeatedly by the dashboard are only compiled once.
+
+    :param filters: The filters or composite filters from the dashboard.
+    :type filters: list[dict]
+    :return: The compiled filters.
+    :rtype: CompiledFilter
+    """
+    return _compile_signature(get_filter_signature(filters))
+
+
+@lru_cache(maxsize=COMPILED_FILTER_CACHE_SIZE)
+def _compile_signature(signature):
+    filters = json.loads(signature)
+    return CompiledFilter([_compile_filter(filter) for filter in filters],
+                          OPERATION_AND)
+
+
+def _compile_filter(filter):
+    if METHOD in filter:
+        method = filter[METHOD]
+        if method not in _SUPPORTED_METHODS:
+            raise ValueError(
+                "Unsupported method type: {}".format(method))
+        return ColumnPredicate(filter['column'], method, filter['arg'])
+    children = [_compile_filter(composite_filter)
+                for composite_filter in filter[COMPOSITE_FILTERS]]
+    return CompiledFilter(children, filter[OPERATION])
+
+
+class ColumnPredicate(object):
+    """A single compiled predicate over one column of the dataset.
+
+    :param column: The name of the column the predicate applies to.
+    :type column: str
+    :param method: The filter method, for example 'greater'.
+    :type method: str
+    :param args: The arguments of the filter method.
+    :type args: list
+    """
+
+    def __init__(self, column, method, args):
+        self.column = column
+        self.method = method
+        self.args = args
+
+    def evaluate(self, data, categorical_features, categories):
+        """Computes the boolean mask of the rows matching the predicate.
+
+        :param data: The dataset indexable by column name.
+        :type data: ColumnStore or pandas.DataFrame
+        :param categorical_features: The categorical feature names.
+        :type categorical_features: list[str]
+        :param categories: The categories for each categorical feature.
+        :type categories: list[list]
+        :return: The boolean mask of the matching rows.
+        :rtype: numpy.ndarray
+        """
+        method = self.method
+        args = self.args
+        if method in _RANGE_METHODS:
+            mask = self._range_mask(data)
+            if mask is not None:
+                return mask
+        values = np.asarray(data[self.column])
+        if method == METHOD_GREATER:
+            return values > args[0]
+        elif method == METHOD_LESS_AND_EQUAL:
+            return values <= args[0]
+        elif method == METHOD_RANGE:
+            return (values >= args[0]) & (values <= args[1])
+        if method == METHOD_EQUAL:
+            args = args[:1]
+        is_categorical = bool(categorical_features) and \
+            self.column in categorical_features
+        if is_categorical:
+            mask = self._category_mask(data, values, categorical_features,
+                                       categories, args)
         else:
-            cqueries = []
-            for composite_filter in filter['compositeFilters']:
-                cqueries.append(build_query([composite_filter],
-                                            categorical_features,
-                                            categories))
-            if filter['operation'] == 'and':
-                queries.append('(' + ') & ('.join(cqueries) + ')')
-            else:
-                queries.append('(' + ') | ('.join(cqueries) + ')')
-    return '(' + ') & ('.join(queries) + ')'
-
-
-def build_cat_bounds_query(filter, colname, method,
-                           categorical_features, categories):
-    bounds = []
-    if method == METHOD_EXCLUDES:
-        operator = " != "
-    else:
-        operator = " == "
-    for arg in filter['arg']:
-        cat_idx = categorical_features.index(colname)
-        arg_cat = "'{}'".format(str(categories[cat_idx][arg]))
-        bounds.append("`{}`{}{}".format(colname, operator, arg_cat))
-    if method == METHOD_EXCLUDES:
-        return ' & '.join(bounds)
-    else:
-        return ' | '.join(bounds)
+            mask = np.isin(values, args)
+        if method == METHOD_EXCLUDES:
+            return ~mask
+        return mask
+
+    def _range_mask(self, data):
+        range_mask = getattr(data, 'range_mask', None)
+        if range_mask is None:
+            return None
+        if self.method == METHOD_GREATER:
+            return range_mask(self.column, lower=self.args[0],
+                              lower_inclusive=False)
+        elif self.method == METHOD_LESS_AND_EQUAL:
+            return range_mask(self.column, upper=self.args[0])
+        return range_mask(self.column, lower=self.args[0],
+                          upper=self.args[1])
+
+    def _category_mask(self, data, values, categorical_features,
+                       categories, codes):
+        category_mask = getattr(data, 'category_mask', None)
+        if category_mask is not None:
+            mask = category_mask(self.column, codes)
+            if mask is not None:
+                return mask
+        cat_idx = categorical_features.index(self.column)
+        selected = [categories[cat_idx][code] for code in codes]
+        return np.isin(values, selected)
+
+
+class CompiledFilter(object):
+    """A compiled and or or combination of predicates.
+
+    :param children: The compiled predicates to combine.
+    :type children: list[ColumnPredicate or CompiledFilter]
+    :param operation: The combining operation, either 'and' or 'or'.
+    :type operation: str
+    """
+
+    def __init__(self, children, operation):
+        self.children = children
+        self.operation = operation
+
+    def evaluate(self, data, categorical_features, categories):
+        """Computes the boolean mask of the rows matching the filter.
+
+        :param data: The dataset indexable by column name.
+        :type data: ColumnStore or pandas.DataFrame
+        :param categorical_features: The categorical feature names.
+        :type categorical_features: list[str]
+        :param categories: The categories for each categorical feature.
+        :type categories: list[list]
+        :return: The boolean mask of the matching rows.
+        :rtype: numpy.ndarray
+        """
+        if self.operation == OPERATION_AND:
+            mask = np.ones(len(data), dtype=bool)
+            for child in self.children:
+                mask &= child.evaluate(data, categorical_features,
+                                       categories)
+        else:
+            mask = np.zeros(len(data), dtype=bool)
+            for child in self.children:
+                mask |= child.evaluate(data, categorical_features,
+                                       categories)
+        return mask
+
+
+_RANGE_METHODS = {METHOD_GREATER, METHOD_LESS_AND_EQUAL, METHOD_RANGE}
+_SUPPORTED_METHODS = {METHOD_EQUAL, METHOD_GREATER, METHOD_LESS_AND_EQUAL,
+                      METHOD_RANGE, METHOD_INCLUDES, METHOD_EXCLUDES}
@@ -0,0 +1,138 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+import numpy as np
+
+
+def _row_id_dtype(num_rows):
+    if num_rows < np.iinfo(np.int32).max:
+        return np.int32
+    return np.int64
+
+
+class CategoryIndex(object):
+    """Row ids of a categorical column grouped by category code.
+
+    The row ids are stored in a single array sorted by category code,
+    with an offsets array delimiting the rows of each category, so the
+    rows of any set of categories can be selected without scanning the
+    column.
+
+    :param codes: The ordinal encoded values of the categorical column,
+        with negative or NaN codes for missing values.
+    :type codes: numpy.ndarray
+    """
+
+    def __init__(self, codes):
+        codes = np.asarray(codes)
+        self._num_rows = len(codes)
+        if codes.dtype.kind == 'f':
+            valid = ~np.isnan(codes) & (codes >= 0)
+        else:
+            valid = codes >= 0
+        row_ids = np.flatnonzero(valid)
+        valid_codes = codes[valid].astype(np.int64)
+        order = np.argsort(valid_codes, kind='stable')
+        row_id_dtype = _row_id_dtype(self._num_rows)
+        self._row_ids = row_ids[order].astype(row_id_dtype)
+        counts = np.bincount(valid_codes)
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    @property
+    def num_categories(self):
+        return len(self._offsets) - 1
+
+    def rows(self, code):
+        """Returns the sorted row ids having the given category code.
+
+        :param code: The category code.
+        :type code: int
+        :return: The row ids of the category.
+        :rtype: numpy.ndarray
+        """
+        code = int(code)
+        if code < 0 or code >= self.num_categories:
+            return self._row_ids[:0]
+        return self._row_ids[self._offsets[code]:self._offsets[code + 1]]
+
+    def mask(self, codes):
+        """Returns the boolean mask of the rows in any of the categories.
+
+        :param codes: The category codes to select.
+        :type codes: list[int]
+        :return: The boolean mask of the selected rows.
+        :rtype: numpy.ndarray
+        """
+        mask = np.zeros(self._num_rows, dtype=bool)
+        for code in codes:
+            mask[self.rows(code)] = True
+        return mask
+
+
+class SortedIndex(object):
+    """Row ids of a numeric column sorted by value.
+
+    Range predicates are resolved with a binary search into a contiguous
+    slice of the sorted row ids instead of a scan over the column.
+
+    :param values: The values of the numeric column.
+    :type values: numpy.ndarray
+    """
+
+    def __init__(self, values):
+        values = np.asarray(values)
+        self._num_rows = len(values)
+        order = np.argsort(values, kind='stable')
+        self._row_ids = order.astype(_row_id_dtype(self._num_rows))
+        self._sorted_values = values[order]
+        # NaN values are sorted last and never match a range predicate
+        if values.dtype.kind == 'f':
+            self._num_valid = self._num_rows - \
+                int(np.count_nonzero(np.isnan(values)))
+        else:
+            self._num_valid = self._num_rows
+
+    def rows(self, lower=None, upper=None,
+             lower_inclusive=True, upper_inclusive=True):
+        """Returns the row ids with values in the given range.
+
+        :param lower: The lower bound of the range, or None if unbounded.
+        :type lower: float
+        :param upper: The upper bound of the range, or None if unbounded.
+        :type upper: float
+        :param lower_inclusive: Whether the lower bound is inclusive.
+        :type lower_inclusive: bool
+        :param upper_inclusive: Whether the upper bound is inclusive.
+        :type upper_inclusive: bool
+        :return: The row ids in the range, in order of their values.
+        :rtype: numpy.ndarray
+        """
+        sorted_values = self._sorted_values[:self._num_valid]
+        start = 0
+        end = self._num_valid
+        if lower is not None:
+            side = 'left' if lower_inclusive else 'right'
+            start = np.searchsorted(sorted_values, lower, side=side)
+        if upper is not None:
+            side = 'right' if upper_inclusive else 'left'
+            end = np.searchsorted(sorted_values, upper, side=side)
+        return self._row_ids[start:max(start, end)]
+
+    def mask(self, lower=None, upper=None,
+             lower_inclusive=True, upper_inclusive=True):
+        """Returns the boolean mask of the rows with values in the range.
+
+        :param lower: The lower bound of the range, or None if unbounded.
+        :type lower: float
+        :param upper: The upper bound of the range, or None if unbounded.
+        :type upper: float
+        :param lower_inclusive: Whether the lower bound is inclusive.
+        :type lower_inclusive: bool
+        :param upper_inclusive: Whether the upper bound is inclusive.
+        :type upper_inclusive: bool
+        :return: The boolean mask of the rows in the range.
+        :rtype: numpy.ndarray
+        """
+        mask = np.zeros(self._num_rows, dtype=bool)
+        mask[self.rows(lower, upper, lower_inclusive, upper_inclusive)] = True
+        return mask
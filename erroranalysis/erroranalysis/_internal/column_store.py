@@ -0,0 +1,519 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import OrdinalEncoder
+from erroranalysis._internal.column_index import CategoryIndex, SortedIndex
+
+MISSING_CODE = -1
+MANIFEST_FILE = 'column_store.json'
+COLUMN_FILE = 'column_{}.npy'
+CODES_FILE = 'codes_{}.npy'
+FEATURE_NAMES = 'feature_names'
+NUM_ROWS = 'num_rows'
+COLUMNS = 'columns'
+ENCODED_COLUMNS = 'encoded_columns'
+CATEGORIES = 'categories'
+FINGERPRINT = 'fingerprint'
+
+
+class ColumnStore(object):
+    """Read-only columnar view over the dataset of an error analyzer.
+
+    Each feature is stored as a one dimensional typed numpy array, which
+    is a view over the original dataset whenever pandas or numpy allow
+    it.  Numeric features of object arrays, as in mixed type numpy
+    datasets, are converted to typed arrays once.
+    Cohorts are represented as integer row index arrays over the store,
+    so computations only gather the rows and columns they need instead
+    of copying the full dataset.
+
+    :param dataset: The dataset of the error analyzer.
+    :type dataset: numpy.ndarray or list[][] or pandas.DataFrame
+    :param feature_names: The feature names, in column order.
+    :type feature_names: list[str]
+    :param encoded_columns: The ordinal encoded values of the
+        categorical features, keyed by feature name, with negative codes
+        for missing values.  A category index is built for each of them
+        on first use to resolve categorical filters.
+    :type encoded_columns: dict
+    :param index_numeric: Whether to build a sorted index for each
+        numeric feature on first use, to resolve range filters by binary
+        search.
+    :type index_numeric: bool
+    :param columns: The values of some of the features keyed by feature
+        name, for example memory-mapped from a saved store, used instead
+        of the columns of the dataset.
+    :type columns: dict
+    :param categories: The categories of some of the encoded columns
+        keyed by feature name.  The raw values of these features are
+        decoded from their codes whenever they are read, instead of
+        being kept in memory.
+    :type categories: dict
+    """
+
+    def __init__(self, dataset, feature_names, encoded_columns=None,
+                 index_numeric=False, columns=None, categories=None):
+        if not isinstance(dataset, pd.DataFrame):
+            dataset = np.asarray(dataset)
+        self._dataset = dataset
+        self._feature_names = feature_names
+        self._encoded_columns = {}
+        if encoded_columns:
+            for name, column in encoded_columns.items():
+                self._encoded_columns[name] = _read_only(column)
+        self._columns = {}
+        self._category_values = {}
+        for index, name in enumerate(feature_names):
+            if columns and name in columns:
+                column = columns[name]
+            elif categories and categories.get(name) is not None and \
+                    name in self._encoded_columns:
+                # the missing value is the last category of features
+                # with missing values, which is where the -1 codes point
+                values = np.empty(len(categories[name]), dtype=object)
+                values[:] = categories[name]
+                self._category_values[name] = values
+                continue
+            else:
+                column = _dataset_column(dataset, index)
+            if name not in self._encoded_columns:
+                column = _typed_column(column)
+            self._columns[name] = _read_only(column)
+        self._index_numeric = index_numeric
+        self._category_indexes = {}
+        self._sorted_indexes = {}
+
+    def __len__(self):
+        return self._dataset.shape[0]
+
+    def __getitem__(self, name):
+        values = self._category_values.get(name)
+        if values is not None:
+            return _read_only(values[self._encoded_columns[name]])
+        return self._columns[name]
+
+    @property
+    def feature_names(self):
+        return self._feature_names
+
+    def encoded_column(self, name):
+        """Returns the ordinal encoded values of a categorical column.
+
+        :param name: The name of the column.
+        :type name: str
+        :return: The encoded values, or the raw values if the column
+            is not categorical.
+        :rtype: numpy.ndarray
+        """
+        column = self._encoded_columns.get(name)
+        if column is None:
+            return self._columns[name]
+        return column
+
+    def take_column(self, name, row_indexes):
+        """Gathers the given rows of a column.
+
+        The raw values of a decoded categorical column are only decoded
+        for the given rows.
+
+        :param name: The name of the column.
+        :type name: str
+        :param row_indexes: The row indexes of the cohort.
+        :type row_indexes: numpy.ndarray
+        :return: The values of the cohort rows.
+        :rtype: numpy.ndarray
+        """
+        values = self._category_values.get(name)
+        if values is None or self.is_full(row_indexes):
+            return self.take(self[name], row_indexes)
+        return values[self._encoded_columns[name][row_indexes]]
+
+    def category_mask(self, name, codes):
+        """Returns the mask of the rows in any of the given categories.
+
+        :param name: The name of the categorical column.
+        :type name: str
+        :param codes: The category codes to select.
+        :type codes: list[int]
+        :return: The boolean mask of the selected rows or None if the
+            column has no category index.
+        :rtype: numpy.ndarray
+        """
+        category_index = self._category_indexes.get(name)
+        if category_index is None:
+            codes_column = self._encoded_columns.get(name)
+            if codes_column is None:
+                return None
+            category_index = CategoryIndex(codes_column)
+            self._category_indexes[name] = category_index
+        return category_index.mask(codes)
+
+    def range_mask(self, name, lower=None, upper=None,
+                   lower_inclusive=True, upper_inclusive=True):
+        """Returns the mask of the rows with values in the given range.
+
+        :param name: The name of the numeric column.
+        :type name: str
+        :param lower: The lower bound of the range, or None if unbounded.
+        :type lower: float
+        :param upper: The upper bound of the range, or None if unbounded.
+        :type upper: float
+        :param lower_inclusive: Whether the lower bound is inclusive.
+        :type lower_inclusive: bool
+        :param upper_inclusive: Whether the upper bound is inclusive.
+        :type upper_inclusive: bool
+        :return: The boolean mask of the rows in the range or None if
+            the column has no sorted index.
+        :rtype: numpy.ndarray
+        """
+        sorted_index = self._sorted_indexes.get(name)
+        if sorted_index is None:
+            column = self._columns.get(name)
+            if not self._index_numeric or column is None or \
+                    column.dtype.kind not in 'biuf' or \
+                    name in self._encoded_columns:
+                return None
+            sorted_index = SortedIndex(column)
+            self._sorted_indexes[name] = sorted_index
+        return sorted_index.mask(lower, upper,
+                                 lower_inclusive, upper_inclusive)
+
+    def save(self, directory, categories=None, fingerprint=None):
+        """Saves the columns of the store as numpy files.
+
+        The typed columns and the codes of the categorical features are
+        saved in the directory, to be memory-mapped by load_column_store
+        so that processes serving the same dataset share their pages.
+        Columns of object dtype other than the categorical features are
+        not saved, and are taken from the dataset when loading.  Every
+        file is written to a unique temporary file first and renamed,
+        with the manifest written last, so readers never see a partial
+        store and concurrent writers never write to the same file.  The
+        manifest holds the fingerprint of the dataset, so that a store
+        saved from other data is not loaded.
+
+        :param directory: The directory to save the store to.
+        :type directory: str
+        :param categories: The categories of the categorical features,
+            keyed by feature name.
+        :type categories: dict
+        :param fingerprint: The fingerprint of the dataset of the store,
+            computed by fingerprint_dataset if None.
+        :type fingerprint: list[list[str]]
+        """
+        if fingerprint is None:
+            fingerprint = fingerprint_dataset(self._dataset,
+                                              self._feature_names)
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        try:
+            # readers must not pair the old manifest with the new files
+            os.remove(manifest_path)
+        except FileNotFoundError:
+            pass
+        categories = categories or {}
+        columns = []
+        encoded_columns = []
+        for index, name in enumerate(self._feature_names):
+            if name in self._encoded_columns:
+                _save_array(os.path.join(directory, CODES_FILE.format(index)),
+                            self._encoded_columns[name])
+                encoded_columns.append(index)
+            elif self._columns[name].dtype != object:
+                _save_array(os.path.join(directory,
+                                         COLUMN_FILE.format(index)),
+                            self._columns[name])
+                columns.append(index)
+        manifest = {FEATURE_NAMES: list(self._feature_names),
+                    NUM_ROWS: len(self),
+                    COLUMNS: columns,
+                    ENCODED_COLUMNS: encoded_columns,
+                    CATEGORIES: [categories.get(self._feature_names[index])
+                                 for index in encoded_columns],
+                    FINGERPRINT: fingerprint}
+        _replace_file(manifest_path,
+                      lambda manifest_file: manifest_file.write(
+                          json.dumps(manifest).encode('utf-8')))
+
+    def subset(self, row_indexes):
+        """Returns a view of the store restricted to the given rows.
+
+        :param row_indexes: The row indexes of the cohort.
+        :type row_indexes: numpy.ndarray
+        :return: The view over the cohort rows, indexable by column name.
+        :rtype: CohortView
+        """
+        return CohortView(self, row_indexes)
+
+    def is_full(self, row_indexes):
+        """Returns whether the row indexes select every row of the store.
+
+        :param row_indexes: The sorted, unique row indexes of a cohort.
+        :type row_indexes: numpy.ndarray
+        :return: True if the cohort contains every row.
+        :rtype: bool
+        """
+        return len(row_indexes) == len(self)
+
+    def take(self, values, row_indexes):
+        """Gathers the given rows of an array aligned with the store.
+
+        :param values: The values aligned with the rows of the store,
+            for example the true or predicted labels.
+        :type values: numpy.ndarray or list or pandas.Series
+        :param row_indexes: The row indexes of the cohort.
+        :type row_indexes: numpy.ndarray
+        :return: The values of the cohort rows.
+        :rtype: numpy.ndarray
+        """
+        values = np.asarray(values)
+        if self.is_full(row_indexes):
+            return values
+        return values[row_indexes]
+
+    def take_rows(self, row_indexes):
+        """Gathers the given rows of the dataset in its original format.
+
+        This is the input to use when calling the model.
+
+        :param row_indexes: The row indexes of the cohort.
+        :type row_indexes: numpy.ndarray
+        :return: The dataset rows of the cohort.
+        :rtype: numpy.ndarray or pandas.DataFrame
+        """
+        if self.is_full(row_indexes):
+            return self._dataset
+        if isinstance(self._dataset, pd.DataFrame):
+            return self._dataset.iloc[row_indexes]
+        return self._dataset[row_indexes]
+
+    def gather(self, names, row_indexes, encoded=False):
+        """Gathers the given columns of the given rows into a 2D array.
+
+        :param names: The names of the columns to gather.
+        :type names: list[str]
+        :param row_indexes: The row indexes of the cohort.
+        :type row_indexes: numpy.ndarray
+        :param encoded: Whether to gather the ordinal encoded values
+            instead of the raw values of categorical features.
+        :type encoded: bool
+        :return: The array of the selected rows and columns.
+        :rtype: numpy.ndarray
+        """
+        columns = []
+        for name in names:
+            if encoded:
+                columns.append(self.take(self.encoded_column(name),
+                                         row_indexes))
+            else:
+                columns.append(self.take_column(name, row_indexes))
+        is_numeric = all(column.dtype.kind in 'biuf' for column in columns)
+        if is_numeric and columns:
+            dtype = np.result_type(*columns)
+        else:
+            dtype = object
+        gathered = np.empty((len(row_indexes), len(columns)), dtype=dtype)
+        for index, column in enumerate(columns):
+            gathered[:, index] = column
+        return gathered
+
+
+class CohortView(object):
+    """View over the rows of a cohort of a column store.
+
+    Columns are gathered for the cohort rows on first access, so
+    filters evaluated over the view cost time proportional to the
+    size of the cohort instead of the size of the dataset.
+
+    :param column_store: The column store of the analyzer.
+    :type column_store: ColumnStore
+    :param row_indexes: The row indexes of the cohort.
+    :type row_indexes: numpy.ndarray
+    """
+
+    def __init__(self, column_store, row_indexes):
+        self._column_store = column_store
+        self._row_indexes = row_indexes
+        self._columns = {}
+
+    def __len__(self):
+        return len(self._row_indexes)
+
+    def __getitem__(self, name):
+        column = self._columns.get(name)
+        if column is None:
+            column = self._column_store.take_column(name,
+                                                    self._row_indexes)
+            self._columns[name] = column
+        return column
+
+
+def is_column_store_saved(directory, fingerprint=None):
+    """Returns whether a column store was saved in the directory.
+
+    :param directory: The directory of the saved store.
+    :type directory: str
+    :param fingerprint: The fingerprint of the dataset the store must
+        have been saved from, or None to accept any saved store.
+    :type fingerprint: list[list[str]]
+    :return: True if the directory holds a complete saved store.
+    :rtype: bool
+    """
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        return False
+    if fingerprint is None:
+        return True
+    try:
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        # the manifest was removed or replaced while being read
+        return False
+    return manifest.get(FINGERPRINT) == fingerprint
+
+
+def fingerprint_dataset(dataset, feature_names):
+    """Computes the fingerprint of the content of a dataset.
+
+    The fingerprint holds the dtype and a hash of the values of each
+    column, to detect a saved column store of other data with the same
+    feature names and number of rows.
+
+    :param dataset: The dataset of the column store.
+    :type dataset: numpy.ndarray or list[][] or pandas.DataFrame
+    :param feature_names: The feature names, in column order.
+    :type feature_names: list[str]
+    :return: The dtype and hash of each column.
+    :rtype: list[list[str]]
+    """
+    if not isinstance(dataset, pd.DataFrame):
+        dataset = np.asarray(dataset)
+    fingerprint = []
+    for index in range(len(feature_names)):
+        column = _dataset_column(dataset, index)
+        hashes = pd.util.hash_array(column)
+        fingerprint.append([str(column.dtype),
+                            hashlib.sha1(hashes.tobytes()).hexdigest()])
+    return fingerprint
+
+
+def load_column_store(directory, dataset, feature_names,
+                      index_numeric=False, fingerprint=None):
+    """Loads a saved column store with its columns memory-mapped.
+
+    Only the codes of the categorical features are memory-mapped, their
+    raw values are decoded from the codes when they are read.  The
+    dataset is only read for the columns that were not saved and used
+    as the input of the model.
+
+    :param directory: The directory of the saved store.
+    :type directory: str
+    :param dataset: The dataset the store was saved from.
+    :type dataset: numpy.ndarray or list[][] or pandas.DataFrame
+    :param feature_names: The feature names, in column order.
+    :type feature_names: list[str]
+    :param index_numeric: Whether to build a sorted index for each
+        numeric feature on first use.
+    :type index_numeric: bool
+    :param fingerprint: The fingerprint of the dataset, computed by
+        fingerprint_dataset if None.
+    :type fingerprint: list[list[str]]
+    :return: The column store and the categories of the categorical
+        features, keyed by feature name.
+    :rtype: tuple[ColumnStore, dict]
+    """
+    with open(os.path.join(directory, MANIFEST_FILE)) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest[FEATURE_NAMES] != list(feature_names):
+        raise ValueError("The feature names of the saved column store "
+                         "do not match the feature names of the dataset")
+    if manifest[NUM_ROWS] != len(dataset):
+        raise ValueError("The number of rows of the saved column store "
+                         "does not match the number of rows of the dataset")
+    if fingerprint is None:
+        fingerprint = fingerprint_dataset(dataset, feature_names)
+    if manifest.get(FINGERPRINT) != fingerprint:
+        raise ValueError("The saved column store was saved from "
+                         "a different dataset")
+    columns = {}
+    for index in manifest[COLUMNS]:
+        columns[feature_names[index]] = np.load(
+            os.path.join(directory, COLUMN_FILE.format(index)),
+            mmap_mode='r')
+    encoded_columns = {}
+    categories = {}
+    for index, category_values in zip(manifest[ENCODED_COLUMNS],
+                                      manifest[CATEGORIES]):
+        name = feature_names[index]
+        codes = np.load(os.path.join(directory, CODES_FILE.format(index)),
+                        mmap_mode='r')
+        encoded_columns[name] = codes
+        categories[name] = category_values
+    column_store = ColumnStore(dataset, feature_names, encoded_columns,
+                               index_numeric=index_numeric, columns=columns,
+                               categories=categories)
+    return column_store, categories
+
+
+def encode_categorical(values):
+    """Ordinal encodes the values of a categorical feature.
+
+    The categories are sorted as by the scikit-learn OrdinalEncoder,
+    with the missing value last if the feature has missing values.
+
+    :param values: The values of the categorical feature.
+    :type values: numpy.ndarray
+    :return: The int32 code of each value, -1 for missing values, and
+        the categories of the feature.
+    :rtype: tuple[numpy.ndarray, list]
+    """
+    encoder = OrdinalEncoder()
+    encoded = encoder.fit_transform(np.asarray(values).reshape(-1, 1))[:, 0]
+    codes = np.where(np.isnan(encoded), MISSING_CODE, encoded)
+    return codes.astype(np.int32), encoder.categories_[0].tolist()
+
+
+def _typed_column(column):
+    if column.dtype != object:
+        return column
+    typed = np.array(column.tolist())
+    if typed.dtype.kind in 'biuf' and typed.shape == column.shape:
+        return typed
+    return column
+
+
+def _dataset_column(dataset, index):
+    if isinstance(dataset, pd.DataFrame):
+        return dataset.iloc[:, index].to_numpy()
+    return dataset[:, index]
+
+
+def _save_array(path, array):
+    _replace_file(path, lambda array_file: np.save(
+        array_file, np.ascontiguousarray(array)))
+
+
+def _replace_file(path, write):
+    # write to a temporary file unique to this writer, then rename it
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                         suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            write(temp_file)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _read_only(column):
+    column = column.view()
+    column.flags.writeable = False
+    return column
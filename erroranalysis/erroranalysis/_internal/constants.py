@@ -51,6 +51,30 @@ class Metrics(str, Enum):
     ERROR_RATE = 'error_rate'
 
 
+class BinningStrategy(str, Enum):
+    """Provide the strategies for binning numeric heat map features.
+
+    The 'cohort' strategy splits the range of each cohort into equal
+    width bins.  The 'equal_width' and 'quantile' strategies compute the
+    bins once over the whole dataset and reuse them for every cohort.
+    """
+    COHORT = 'cohort'
+    EQUAL_WIDTH = 'equal_width'
+    QUANTILE = 'quantile'
+
+
+class TreeBuilder(str, Enum):
+    """Provide the learners of the surrogate error tree.
+
+    The 'lightgbm' learner fits a single lightgbm estimator.  The
+    'histogram' learner grows the tree with numpy from feature bins
+    computed once per analyzer, which avoids the lightgbm setup cost
+    on every request.
+    """
+    LIGHTGBM = 'lightgbm'
+    HISTOGRAM = 'histogram'
+
+
 metric_to_display_name = {
     Metrics.MEAN_ABSOLUTE_ERROR: 'Mean absolute error',
     Metrics.MEAN_SQUARED_ERROR: 'Mean squared error',
@@ -4,16 +4,27 @@
 import pandas as pd
 import numpy as np
 from abc import ABC, abstractmethod
-from sklearn.compose import ColumnTransformer
-from sklearn.preprocessing import OrdinalEncoder
-from sklearn.feature_selection import (
-    mutual_info_classif, mutual_info_regression)
+from concurrent.futures import ThreadPoolExecutor
 from erroranalysis._internal.matrix_filter import (
+    BIN_THRESHOLD, fit_feature_binning,
     compute_matrix as _compute_matrix)
 from erroranalysis._internal.surrogate_error_tree import (
-    compute_error_tree as _compute_error_tree)
+    DEFAULT_MAX_DEPTH, DEFAULT_NUM_LEAVES, fit_cohort_error_tree,
+    fit_error_tree, iter_cohort_error_tree)
 from erroranalysis._internal.error_report import ErrorReport
-from erroranalysis._internal.constants import ModelTask, Metrics
+from erroranalysis._internal.cohort_filter import (
+    COMPOSITE_FILTERS, FILTERS, filter_indexes_from_cohort,
+    get_cohort_signature)
+from erroranalysis._internal.batch_predictor import BatchPredictor
+from erroranalysis._internal.cohort_cache import CohortCache
+from erroranalysis._internal.column_store import (
+    ColumnStore, encode_categorical, fingerprint_dataset,
+    is_column_store_saved, load_column_store)
+from erroranalysis._internal.error_tree_cache import ErrorTreeCache
+from erroranalysis._internal.constants import (
+    BinningStrategy, ModelTask, Metrics, TreeBuilder)
+from erroranalysis._internal.histogram_tree import fit_feature_bins
+from erroranalysis._internal.importances import ImportancesEstimator
 from erroranalysis._internal.version_checker import check_pandas_version
 
 
@@ -24,16 +35,32 @@ class BaseAnalyzer(ABC):
                  feature_names,
                  categorical_features,
                  model_task,
-                 metric):
-        self._dataset = self._make_pandas_copy(dataset)
+                 metric,
+                 index_numeric_features=False,
+                 bin_strategy=BinningStrategy.COHORT,
+                 num_bins=BIN_THRESHOLD,
+                 bin_edges=None,
+                 tree_builder=TreeBuilder.LIGHTGBM,
+                 importances_estimator=None,
+                 column_store_path=None):
+        # Note: the dataset is only copied and encoded on first use, so
+        # that constructing an analyzer does not depend on the data size
+        self._input_dataset = dataset
+        self._dataset = None
         self._true_y = true_y
         self._categorical_features = categorical_features
         if isinstance(feature_names, np.ndarray):
             feature_names = feature_names.tolist()
         self._feature_names = feature_names
-        self._categories = []
+        self._categories = None
         self._categorical_indexes = []
-        self._category_dictionary = {}
+        if categorical_features:
+            self._categorical_indexes = [feature_names.index(feature)
+                                         for feature in categorical_features]
+        self._category_dictionary = None
+        self._index_numeric_features = index_numeric_features
+        self._column_store_path = column_store_path
+        self._column_store = None
         self._model_task = model_task
         if model_task == ModelTask.CLASSIFICATION:
             if metric is None:
@@ -42,29 +69,30 @@ class BaseAnalyzer(ABC):
             if metric is None:
                 metric = Metrics.MEAN_SQUARED_ERROR
         self._metric = metric
-        if self._categorical_features:
-            self._categorical_indexes = [feature_names.index(feature)
-                                         for feature
-                                         in self._categorical_features]
-            ordinal_enc = OrdinalEncoder()
-            ct = ColumnTransformer([('ord', ordinal_enc,
-                                     self._categorical_indexes)],
-                                   remainder='drop')
-            self._string_ind_data = ct.fit_transform(self._dataset)
-            transformer_categories = ct.transformers_[0][1].categories_
-            for category_arr, category_index in zip(transformer_categories,
-                                                    self._categorical_indexes):
-                category_values = category_arr.tolist()
-                self._categories.append(category_values)
-                self._category_dictionary[category_index] = category_values
+        self._bin_strategy = BinningStrategy(bin_strategy)
+        self._num_bins = num_bins
+        self._bin_edges = bin_edges
+        self._feature_binnings = {}
+        self._tree_builder = TreeBuilder(tree_builder)
+        self._tree_bins = {}
+        if importances_estimator is None:
+            importances_estimator = ImportancesEstimator()
+        self._importances_estimator = importances_estimator
+        self._importances_cache = {}
+        self._cohort_cache = CohortCache()
+        self._error_tree_cache = ErrorTreeCache()
         check_pandas_version(self.feature_names)
 
     @property
     def categories(self):
+        if self._categories is None:
+            self._build_column_store()
         return self._categories
 
     @property
     def category_dictionary(self):
+        if self._category_dictionary is None:
+            self._build_column_store()
         return self._category_dictionary
 
     @property
@@ -77,15 +105,56 @@ class BaseAnalyzer(ABC):
 
     @property
     def dataset(self):
+        if self._dataset is None:
+            if self._column_store_path is None:
+                self._dataset = self._make_pandas_copy(self._input_dataset)
+            else:
+                # the columns are read from the saved store, so the
+                # dataset is only the input of the model and not copied
+                self._dataset = self._input_dataset
         return self._dataset
 
+    @property
+    def column_store_path(self):
+        return self._column_store_path
+
+    @property
+    def column_store(self):
+        """The column store over the dataset, built on first use.
+
+        :return: The column store of the analyzer.
+        :rtype: ColumnStore
+        """
+        if self._column_store is None:
+            self._build_column_store()
+        return self._column_store
+
+    @property
+    def cohort_cache(self):
+        return self._cohort_cache
+
+    @property
+    def error_tree_cache(self):
+        return self._error_tree_cache
+
     @property
     def feature_names(self):
         return self._feature_names
 
     @property
     def string_indexed_data(self):
-        return self._string_ind_data
+        """The int32 codes of the categorical features, one per column.
+
+        Missing values are encoded as -1.
+
+        :return: The codes of the categorical features.
+        :rtype: numpy.ndarray
+        """
+        if not self._categorical_features:
+            return None
+        return np.column_stack([
+            self.column_store.encoded_column(feature)
+            for feature in self._categorical_features])
 
     @property
     def true_y(self):
@@ -99,21 +168,379 @@ class BaseAnalyzer(ABC):
     def metric(self):
         return self._metric
 
-    def compute_matrix(self, features, filters, composite_filters):
-        return _compute_matrix(self, features, filters, composite_filters)
+    @property
+    def bin_strategy(self):
+        return self._bin_strategy
+
+    @property
+    def num_bins(self):
+        return self._num_bins
+
+    @property
+    def bin_edges(self):
+        return self._bin_edges
+
+    @property
+    def tree_builder(self):
+        return self._tree_builder
+
+    @property
+    def importances_estimator(self):
+        return self._importances_estimator
+
+    def get_tree_bins(self, feature):
+        """Returns the histogram bins of a feature for the tree learner.
+
+        The bins are computed once over the whole dataset on first use
+        and shared by the trees of every cohort.
+
+        :param feature: The name of the feature.
+        :type feature: str
+        :return: The bins of the feature.
+        :rtype: FeatureBins
+        """
+        bins = self._tree_bins.get(feature)
+        if bins is None:
+            is_categorical = self._categorical_features is not None and \
+                feature in self._categorical_features
+            values = self.column_store.encoded_column(feature)
+            bins = fit_feature_bins(values, is_categorical)
+            self._tree_bins[feature] = bins
+        return bins
+
+    def get_feature_binning(self, feature):
+        """Returns the heat map binning of a feature shared by all cohorts.
+
+        The binning is fitted over the whole dataset on first use and
+        cached, so every cohort is binned with the same edges.
+
+        :param feature: The name of the feature.
+        :type feature: str
+        :return: The binning of the feature, or None if the binning is
+            fitted on each cohort instead.
+        :rtype: FeatureBinning
+        """
+        is_global = self._bin_strategy != BinningStrategy.COHORT or \
+            (self._bin_edges is not None and feature in self._bin_edges)
+        if not is_global:
+            return None
+        binning = self._feature_binnings.get(feature)
+        if binning is None:
+            binning = fit_feature_binning(self, feature)
+            self._feature_binnings[feature] = binning
+        return binning
+
+    def compute_cohort_indexes(self, filters, composite_filters):
+        """Computes the row indexes of the cohort defined by the filters.
+
+        The row indexes are cached by the canonical signature of the
+        filters, so repeated requests for the same cohort skip filtering.
+        When the filters extend the filters of a cached cohort, only the
+        added filters are evaluated over the rows of the cached cohort.
+
+        :param filters: The filters from the dashboard.
+        :type filters: list[dict]
+        :param composite_filters: The composite filters from the dashboard.
+        :type composite_filters: list[dict]
+        :return: The sorted row indexes of the cohort.
+        :rtype: numpy.ndarray
+        """
+        signature = get_cohort_signature(filters, composite_filters)
+        row_indexes = self._cohort_cache.get(signature)
+        if row_indexes is None:
+            parent_indexes, filters, composite_filters = \
+                self._find_parent_cohort(filters, composite_filters)
+            row_indexes = filter_indexes_from_cohort(
+                self.column_store,
+                filters,
+                composite_filters,
+                self.categorical_features,
+                self.categories,
+                parent_indexes=parent_indexes)
+            self._cohort_cache.put(signature, row_indexes)
+        return row_indexes
+
+    def _find_parent_cohort(self, filters, composite_filters):
+        # Find the smallest cached cohort whose filters and composite
+        # filters are prefixes of the given ones, and return it with
+        # the filters remaining to be evaluated on top of it
+        filters = filters or []
+        composite_filters = composite_filters or []
+        candidates = []
+        for index in range(len(filters)):
+            candidates.append((filters[:index], composite_filters,
+                               filters[index:], []))
+        for index in range(len(composite_filters)):
+            candidates.append((filters, composite_filters[:index],
+                               [], composite_filters[index:]))
+        parent = (None, filters, composite_filters)
+        for (parent_filters, parent_composite_filters,
+             remaining_filters, remaining_composite_filters) in candidates:
+            signature = get_cohort_signature(parent_filters,
+                                             parent_composite_filters)
+            if signature not in self._cohort_cache:
+                continue
+            parent_indexes = self._cohort_cache.get(signature)
+            if self.column_store.is_full(parent_indexes):
+                # Refining the full dataset would not use the indexes
+                continue
+            if parent[0] is None or len(parent_indexes) < len(parent[0]):
+                parent = (parent_indexes, remaining_filters,
+                          remaining_composite_filters)
+        return parent
+
+    def clear_cohort_cache(self):
+        """Invalidates the cached row indexes of all cohorts."""
+        self._cohort_cache.clear()
+
+    def clear_error_tree_cache(self):
+        """Invalidates the cached surrogate error trees."""
+        self._error_tree_cache.clear()
+
+    def clear_importances_cache(self):
+        """Invalidates the cached feature importances."""
+        self._importances_cache.clear()
+
+    def compute_matrix(self, features, filters, composite_filters,
+                       chunk_size=None):
+        """Computes the heat map of the error for one or two features.
+
+        :param features: The one or two features of the heat map.
+        :type features: list[str]
+        :param filters: The filters from the dashboard.
+        :type filters: list[dict]
+        :param composite_filters: The composite filters from the dashboard.
+        :type composite_filters: list[dict]
+        :param chunk_size: The number of cohort rows to process at once,
+            or None to process the whole cohort at once.  Chunking bounds
+            the memory used for predictions and metrics on large datasets,
+            for example when the dataset is a memory-mapped array.
+        :type chunk_size: int
+        :return: The json heat map.
+        :rtype: dict
+        """
+        return _compute_matrix(self, features, filters, composite_filters,
+                               chunk_size=chunk_size)
 
     def compute_error_tree(self,
                            features,
                            filters,
                            composite_filters,
                            max_depth=None,
-                           num_leaves=None):
-        return _compute_error_tree(self,
-                                   features,
-                                   filters,
-                                   composite_filters,
-                                   max_depth=max_depth,
-                                   num_leaves=num_leaves)
+                           num_leaves=None,
+                           metric=None):
+        """Computes the json surrogate error tree of the cohort.
+
+        :param features: The features to train the surrogate tree on.
+        :type features: list[str]
+        :param filters: The filters from the dashboard.
+        :type filters: list[dict]
+        :param composite_filters: The composite filters from the dashboard.
+        :type composite_filters: list[dict]
+        :param max_depth: The maximum depth of the surrogate tree.
+        :type max_depth: int
+        :param num_leaves: The number of leaves of the surrogate tree.
+        :type num_leaves: int
+        :param metric: The metric to compute at each node, by default
+            the metric of the analyzer.
+        :type metric: str
+        :return: The json nodes of the tree.
+        :rtype: list[dict]
+        """
+        if metric is None:
+            metric = self.metric
+        error_tree = self.get_error_tree(features,
+                                         filters,
+                                         composite_filters,
+                                         max_depth=max_depth,
+                                         num_leaves=num_leaves)
+        return error_tree.to_json(metric)
+
+    def compute_error_tree_levels(self,
+                                  features,
+                                  filters,
+                                  composite_filters,
+                                  max_depth=None,
+                                  num_leaves=None,
+                                  metric=None,
+                                  max_nodes=None):
+        """Yields the json surrogate error tree of the cohort by level.
+
+        This is the progressive version of compute_error_tree: the nodes
+        are yielded in chunks of a single depth from the root down, so
+        a client can render the first splits of the tree while the
+        remaining chunks are sent.  The surrogate is fitted when the
+        first chunk is requested, and with the histogram tree builder
+        each level is yielded as soon as it is grown.  The fitted tree
+        is cached once the last chunk is yielded.
+
+        :param features: The features to train the surrogate tree on.
+        :type features: list[str]
+        :param filters: The filters from the dashboard.
+        :type filters: list[dict]
+        :param composite_filters: The composite filters from the dashboard.
+        :type composite_filters: list[dict]
+        :param max_depth: The maximum depth of the surrogate tree.
+        :type max_depth: int
+        :param num_leaves: The number of leaves of the surrogate tree.
+        :type num_leaves: int
+        :param metric: The metric to compute at each node, by default
+            the metric of the analyzer.
+        :type metric: str
+        :param max_nodes: The maximum number of nodes of a chunk, or None
+            to yield each level in a single chunk.
+        :type max_nodes: int
+        :return: The chunks of json nodes of the tree.
+        :rtype: Iterator[list[dict]]
+        """
+        if metric is None:
+            metric = self.metric
+        if max_depth is None:
+            max_depth = DEFAULT_MAX_DEPTH
+        if num_leaves is None:
+            num_leaves = DEFAULT_NUM_LEAVES
+        key = (get_cohort_signature(filters, composite_filters),
+               tuple(features), max_depth, num_leaves)
+        error_tree = self._error_tree_cache.get(key)
+        if error_tree is not None:
+            yield from error_tree.iter_json(metric, max_nodes=max_nodes)
+            return
+        row_indexes = self.compute_cohort_indexes(filters, composite_filters)
+        error_tree = yield from iter_cohort_error_tree(self,
+                                                       features,
+                                                       row_indexes,
+                                                       metric,
+                                                       max_depth=max_depth,
+                                                       num_leaves=num_leaves,
+                                                       max_nodes=max_nodes)
+        self._error_tree_cache.put(key, error_tree)
+
+    def get_error_tree(self,
+                       features,
+                       filters,
+                       composite_filters,
+                       max_depth=None,
+                       num_leaves=None):
+        """Returns the surrogate error tree of the cohort.
+
+        The fitted trees are cached by cohort signature, features and
+        hyperparameters, so repeated requests skip fitting the surrogate.
+
+        :param features: The features to train the surrogate tree on.
+        :type features: list[str]
+        :param filters: The filters from the dashboard.
+        :type filters: list[dict]
+        :param composite_filters: The composite filters from the dashboard.
+        :type composite_filters: list[dict]
+        :param max_depth: The maximum depth of the surrogate tree.
+        :type max_depth: int
+        :param num_leaves: The number of leaves of the surrogate tree.
+        :type num_leaves: int
+        :return: The surrogate error tree.
+        :rtype: ErrorTree
+        """
+        if max_depth is None:
+            max_depth = DEFAULT_MAX_DEPTH
+        if num_leaves is None:
+            num_leaves = DEFAULT_NUM_LEAVES
+        key = (get_cohort_signature(filters, composite_filters),
+               tuple(features), max_depth, num_leaves)
+        error_tree = self._error_tree_cache.get(key)
+        if error_tree is None:
+            error_tree = fit_error_tree(self,
+                                        features,
+                                        filters,
+                                        composite_filters,
+                                        max_depth=max_depth,
+                                        num_leaves=num_leaves)
+            self._error_tree_cache.put(key, error_tree)
+        return error_tree
+
+    def compute_error_trees(self,
+                            cohorts,
+                            features,
+                            max_depth=None,
+                            num_leaves=None,
+                            metric=None,
+                            num_workers=1):
+        """Computes the json surrogate error trees of many cohorts.
+
+        The predictions of the dataset and the row indexes of the cohorts
+        are computed once up front, then the surrogates of the cohorts
+        without a cached tree are fitted in parallel on a pool of
+        threads.  Cohorts with the same filters share a single tree.
+
+        :param cohorts: The cohorts, each a dictionary with the filters
+            and composite filters from the dashboard under the 'filters'
+            and 'compositeFilters' keys.
+        :type cohorts: list[dict]
+        :param features: The features to train the surrogate trees on.
+        :type features: list[str]
+        :param max_depth: The maximum depth of the surrogate trees.
+        :type max_depth: int
+        :param num_leaves: The number of leaves of the surrogate trees.
+        :type num_leaves: int
+        :param metric: The metric to compute at each node, by default
+            the metric of the analyzer.
+        :type metric: str
+        :param num_workers: The number of surrogate trees fitted in
+            parallel.
+        :type num_workers: int
+        :return: The json nodes of the tree of each cohort.
+        :rtype: list[list[dict]]
+        """
+        if num_workers < 1:
+            raise ValueError("Number of workers must be a positive integer")
+        if metric is None:
+            metric = self.metric
+        if max_depth is None:
+            max_depth = DEFAULT_MAX_DEPTH
+        if num_leaves is None:
+            num_leaves = DEFAULT_NUM_LEAVES
+        keys = []
+        error_trees = {}
+        cohort_indexes = {}
+        for cohort in cohorts:
+            filters = cohort.get(FILTERS)
+            composite_filters = cohort.get(COMPOSITE_FILTERS)
+            key = (get_cohort_signature(filters, composite_filters),
+                   tuple(features), max_depth, num_leaves)
+            keys.append(key)
+            if key in error_trees or key in cohort_indexes:
+                continue
+            error_tree = self._error_tree_cache.get(key)
+            if error_tree is None:
+                cohort_indexes[key] = self.compute_cohort_indexes(
+                    filters, composite_filters)
+            else:
+                error_trees[key] = error_tree
+        if cohort_indexes:
+            # compute the shared state before the workers read it
+            self.get_cohort_pred_y(next(iter(cohort_indexes.values())))
+            if self._tree_builder == TreeBuilder.HISTOGRAM:
+                for feature in features:
+                    self.get_tree_bins(feature)
+            # Note: each lightgbm surrogate is single threaded when the
+            # surrogates are fitted in parallel, to avoid oversubscription
+            n_jobs = 1 if num_workers > 1 else None
+
+            def fit(row_indexes):
+                return fit_cohort_error_tree(self,
+                                             features,
+                                             row_indexes,
+                                             max_depth=max_depth,
+                                             num_leaves=num_leaves,
+                                             n_jobs=n_jobs)
+            if num_workers == 1:
+                fitted = [fit(row_indexes)
+                          for row_indexes in cohort_indexes.values()]
+            else:
+                with ThreadPoolExecutor(max_workers=num_workers) as pool:
+                    fitted = list(pool.map(fit, cohort_indexes.values()))
+            for key, error_tree in zip(cohort_indexes, fitted):
+                self._error_tree_cache.put(key, error_tree)
+                error_trees[key] = error_tree
+        return [error_trees[key].to_json(metric) for key in keys]
 
     def create_error_report(self,
                             filter_features=None,
@@ -133,22 +560,120 @@ class BaseAnalyzer(ABC):
                            tree_features=self.feature_names,
                            matrix_features=filter_features)
 
-    def compute_importances(self):
-        input_data = self.dataset
-        diff = self.get_diff()
-        if isinstance(self.dataset, pd.DataFrame):
-            input_data = input_data.to_numpy()
-        if self.categorical_features:
-            # Inplace replacement of columns
-            indexes = self.categorical_indexes
-            string_ind_data = self.string_indexed_data
-            for idx, c_i in enumerate(indexes):
-                input_data[:, c_i] = string_ind_data[:, idx]
-        if self._model_task == ModelTask.CLASSIFICATION:
-            # compute the feature importances using mutual information
-            return mutual_info_classif(input_data, diff).tolist()
-        else:
-            return mutual_info_regression(input_data, diff).tolist()
+    def compute_importances(self, filters=None, composite_filters=None):
+        """Computes the importance of each feature for the errors.
+
+        The importances are the mutual information between each feature
+        and the errors on the rows of the cohort, estimated by the
+        importances estimator of the analyzer, and are cached per cohort
+        and metric.
+
+        :param filters: The filters from the dashboard, or None for the
+            whole dataset.
+        :type filters: list[dict]
+        :param composite_filters: The composite filters from the
+            dashboard, or None for the whole dataset.
+        :type composite_filters: list[dict]
+        :return: The importance of each feature.
+        :rtype: list[float]
+        """
+        importances = np.zeros(len(self.feature_names))
+        for feature, importance in self.iter_importances(filters,
+                                                         composite_filters):
+            importances[feature] = importance
+        return importances.tolist()
+
+    def iter_importances(self, filters=None, composite_filters=None):
+        """Yields the importance of each feature as soon as it is computed.
+
+        This is the incremental version of compute_importances.  The
+        features may be yielded out of order when the importances
+        estimator has several workers.  Cached importances are yielded
+        at once.
+
+        :param filters: The filters from the dashboard, or None for the
+            whole dataset.
+        :type filters: list[dict]
+        :param composite_filters: The composite filters from the
+            dashboard, or None for the whole dataset.
+        :type composite_filters: list[dict]
+        :return: The index and importance of each feature.
+        :rtype: Iterator[tuple[int, float]]
+        """
+        key = (get_cohort_signature(filters, composite_filters),
+               self._metric)
+        importances = self._importances_cache.get(key)
+        if importances is not None:
+            yield from enumerate(importances)
+            return
+        row_indexes = self.compute_cohort_indexes(filters, composite_filters)
+        diff = self.column_store.take(self.get_diff(), row_indexes)
+        input_data = self.column_store.gather(self.feature_names,
+                                              row_indexes,
+                                              encoded=True)
+        # compute the feature importances using mutual information
+        importances = [0.0] * len(self.feature_names)
+        for feature, importance in self._importances_estimator.iter_estimate(
+                input_data, diff, self._model_task):
+            importances[feature] = importance
+            yield feature, importance
+        self._importances_cache[key] = importances
+
+    def _build_column_store(self):
+        dataset = self.dataset
+        path = self._column_store_path
+        fingerprint = None
+        if path is not None:
+            fingerprint = fingerprint_dataset(dataset, self._feature_names)
+        if path is None or not is_column_store_saved(path, fingerprint):
+            # a store saved from other data is rebuilt and overwritten
+            column_store, categories = self._encode_column_store(dataset)
+            if path is not None:
+                column_store.save(path, categories, fingerprint)
+        if path is not None:
+            # Note: the saved store is memory-mapped even by the process
+            # that saved it, so that every process shares the same pages
+            column_store, categories = load_column_store(
+                path,
+                dataset,
+                self._feature_names,
+                index_numeric=self._index_numeric_features,
+                fingerprint=fingerprint)
+        categorical_features = self._categorical_features or []
+        if set(categories) != set(categorical_features):
+            raise ValueError("The categorical features of the saved column "
+                             "store do not match the categorical features")
+        categories = [categories[feature]
+                      for feature in categorical_features]
+        category_dictionary = dict(zip(self._categorical_indexes,
+                                       categories))
+        # Note: the store is published last, so that concurrent requests
+        # racing to build it at worst build it twice
+        self._categories = categories
+        self._category_dictionary = category_dictionary
+        self._column_store = column_store
+
+    def _encode_column_store(self, dataset):
+        categories = {}
+        encoded_columns = {}
+        if self._categorical_features:
+            if isinstance(dataset, pd.DataFrame):
+                columns = dataset.iloc[:, self._categorical_indexes]
+                columns = [column.to_numpy()
+                           for _, column in columns.items()]
+            else:
+                columns = np.asarray(dataset)[
+                    :, self._categorical_indexes].T
+            for feature, column in zip(self._categorical_features, columns):
+                codes, category_values = encode_categorical(column)
+                categories[feature] = category_values
+                encoded_columns[feature] = codes
+        column_store = ColumnStore(
+            dataset,
+            self._feature_names,
+            encoded_columns,
+            index_numeric=self._index_numeric_features)
+        return column_store, categories
 
     def _make_pandas_copy(self, dataset):
         if isinstance(dataset, pd.DataFrame):
@@ -159,6 +684,17 @@ class BaseAnalyzer(ABC):
     def get_diff(self):
         pass
 
+    @abstractmethod
+    def get_cohort_pred_y(self, row_indexes):
+        """Returns the predicted labels for the rows of a cohort.
+
+        :param row_indexes: The row indexes of the cohort.
+        :type row_indexes: numpy.ndarray
+        :return: The predicted labels of the cohort.
+        :rtype: numpy.ndarray
+        """
+        pass
+
 
 class ModelAnalyzer(BaseAnalyzer):
     def __init__(self,
@@ -168,8 +704,20 @@ class ModelAnalyzer(BaseAnalyzer):
                  feature_names,
                  categorical_features,
                  model_task=ModelTask.UNKNOWN,
-                 metric=None):
+                 metric=None,
+                 index_numeric_features=False,
+                 bin_strategy=BinningStrategy.COHORT,
+                 num_bins=BIN_THRESHOLD,
+                 bin_edges=None,
+                 tree_builder=TreeBuilder.LIGHTGBM,
+                 importances_estimator=None,
+                 predictor=None,
+                 column_store_path=None):
         self._model = model
+        self._pred_y = None
+        if predictor is None:
+            predictor = BatchPredictor()
+        self._predictor = predictor
         if model_task == ModelTask.UNKNOWN:
             # Try to automatically infer the model task
             predict_proba_flag = hasattr(model, 'predict_proba')
@@ -177,22 +725,69 @@ class ModelAnalyzer(BaseAnalyzer):
                 model_task = ModelTask.CLASSIFICATION
             else:
                 model_task = ModelTask.REGRESSION
-        super(ModelAnalyzer, self).__init__(dataset,
-                                            true_y,
-                                            feature_names,
-                                            categorical_features,
-                                            model_task,
-                                            metric)
+        super(ModelAnalyzer, self).__init__(
+            dataset,
+            true_y,
+            feature_names,
+            categorical_features,
+            model_task,
+            metric,
+            index_numeric_features=index_numeric_features,
+            bin_strategy=bin_strategy,
+            num_bins=num_bins,
+            bin_edges=bin_edges,
+            tree_builder=tree_builder,
+            importances_estimator=importances_estimator,
+            column_store_path=column_store_path)
 
     @property
     def model(self):
         return self._model
 
+    @model.setter
+    def model(self, model):
+        self._model = model
+        self.clear_predictions()
+
+    @property
+    def predictor(self):
+        return self._predictor
+
+    @property
+    def pred_y(self):
+        """Returns the predictions of the model for the full dataset.
+
+        The model is called once, on first use, and the predictions are
+        cached so that cohort requests only gather them by row index.
+
+        :return: The predicted labels of the full dataset.
+        :rtype: numpy.ndarray
+        """
+        if self._pred_y is None:
+            pred_y = np.asarray(self._predictor.predict(self.model.predict,
+                                                        self.dataset))
+            pred_y.flags.writeable = False
+            self._pred_y = pred_y
+        return self._pred_y
+
+    def clear_predictions(self):
+        """Invalidates the cached predictions of the model.
+
+        The cached error trees and feature importances, computed from the
+        previous predictions, are invalidated too.
+        """
+        self._pred_y = None
+        self.clear_error_tree_cache()
+        self.clear_importances_cache()
+
     def get_diff(self):
         if self._model_task == ModelTask.CLASSIFICATION:
-            return self.model.predict(self.dataset) != self.true_y
+            return self.pred_y != self.true_y
         else:
-            return self.model.predict(self.dataset) - self.true_y
+            return self.pred_y - self.true_y
+
+    def get_cohort_pred_y(self, row_indexes):
+        return self.column_store.take(self.pred_y, row_indexes)
 
 
 class PredictionsAnalyzer(BaseAnalyzer):
@@ -203,17 +798,32 @@ class PredictionsAnalyzer(BaseAnalyzer):
                  feature_names,
                  categorical_features,
                  model_task=ModelTask.CLASSIFICATION,
-                 metric=None):
+                 metric=None,
+                 index_numeric_features=False,
+                 bin_strategy=BinningStrategy.COHORT,
+                 num_bins=BIN_THRESHOLD,
+                 bin_edges=None,
+                 tree_builder=TreeBuilder.LIGHTGBM,
+                 importances_estimator=None,
+                 column_store_path=None):
         self._pred_y = pred_y
         if model_task == ModelTask.UNKNOWN:
             raise ValueError(
                 "ModelTask cannot be 'unknown' when passing predictions")
-        super(PredictionsAnalyzer, self).__init__(dataset,
-                                                  true_y,
-                                                  feature_names,
-                                                  categorical_features,
-                                                  model_task,
-                                                  metric)
+        super(PredictionsAnalyzer, self).__init__(
+            dataset,
+            true_y,
+            feature_names,
+            categorical_features,
+            model_task,
+            metric,
+            index_numeric_features=index_numeric_features,
+            bin_strategy=bin_strategy,
+            num_bins=num_bins,
+            bin_edges=bin_edges,
+            tree_builder=tree_builder,
+            importances_estimator=importances_estimator,
+            column_store_path=column_store_path)
 
     @property
     def pred_y(self):
@@ -221,3 +831,6 @@ class PredictionsAnalyzer(BaseAnalyzer):
 
     def get_diff(self):
         return self.pred_y != self.true_y
+
+    def get_cohort_pred_y(self, row_indexes):
+        return self.column_store.take(self.pred_y, row_indexes)
@@ -0,0 +1,78 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 32
+
+
+class ErrorTreeCache(object):
+    """Least recently used cache of fitted surrogate error trees.
+
+    The trees are keyed by the cohort signature, the features and the
+    hyperparameters of the surrogate model.  A tree only holds the
+    dumped lightgbm structure and a few statistics per node, so the
+    cache is bounded by its number of trees.
+
+    :param max_entries: The maximum number of cached trees.
+    :type max_entries: int
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def get(self, key):
+        """Returns the cached error tree for the key.
+
+        :param key: The cohort signature, features, maximum depth and
+            number of leaves of the tree.
+        :type key: tuple
+        :return: The cached error tree or None if it is not cached.
+        :rtype: ErrorTree
+        """
+        error_tree = self._entries.get(key)
+        if error_tree is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries.move_to_end(key)
+        return error_tree
+
+    def put(self, key, error_tree):
+        """Caches the error tree.
+
+        :param key: The cohort signature, features, maximum depth and
+            number of leaves of the tree.
+        :type key: tuple
+        :param error_tree: The fitted error tree.
+        :type error_tree: ErrorTree
+        """
+        self._entries.pop(key, None)
+        if self._max_entries < 1:
+            return
+        self._entries[key] = error_tree
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Invalidates all cached trees and resets the counters."""
+        self._entries.clear()
+        self._hits = 0
+        self._misses = 0
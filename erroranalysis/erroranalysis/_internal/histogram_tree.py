@@ -0,0 +1,285 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+import numpy as np
+from erroranalysis._internal.tree_arrays import NO_NODE, create_tree_arrays
+
+TREE_MAX_BINS = 255
+MIN_CHILD_SAMPLES = 20
+# Note: gains below this tolerance are rounding errors of a zero gain
+MIN_GAIN = 1e-12
+
+
+class FeatureBins(object):
+    """Histogram bins of a feature for the error tree learner.
+
+    Numeric values are mapped to the first bin whose threshold is
+    greater or equal to the value, and categorical values to the bin of
+    their ordinal encoding.  Missing values fall into an extra bin after
+    the last one, which always goes to the right child of a split.
+
+    :param codes: The bin of each row of the dataset.
+    :type codes: numpy.ndarray
+    :param thresholds: The upper bound of each numeric bin, or the
+        encoded category of each categorical bin.
+    :type thresholds: numpy.ndarray
+    :param is_categorical: Whether the feature is categorical.
+    :type is_categorical: bool
+    """
+
+    def __init__(self, codes, thresholds, is_categorical):
+        self.codes = codes
+        self.thresholds = thresholds
+        self.is_categorical = is_categorical
+
+    @property
+    def num_bins(self):
+        return len(self.thresholds)
+
+
+def fit_feature_bins(values, is_categorical, max_bins=TREE_MAX_BINS):
+    """Bins the values of a feature for the error tree learner.
+
+    Numeric features with more than max_bins unique values are split
+    into bins holding similar numbers of rows.
+
+    :param values: The values of the feature, ordinal encoded for
+        categorical features with negative codes for missing values.
+    :type values: numpy.ndarray
+    :param is_categorical: Whether the feature is categorical.
+    :type is_categorical: bool
+    :param max_bins: The maximum number of bins of numeric features.
+    :type max_bins: int
+    :return: The bins of the feature.
+    :rtype: FeatureBins
+    """
+    values = np.asarray(values, dtype=float)
+    is_missing = np.isnan(values)
+    if is_categorical:
+        # Note: negative codes are missing, as in lightgbm
+        is_missing |= values < 0
+        num_bins = int(np.max(values[~is_missing], initial=-1)) + 1
+        thresholds = np.arange(num_bins, dtype=float)
+        codes = np.where(is_missing, num_bins, values)
+        return FeatureBins(codes.astype(np.int32), thresholds, True)
+    thresholds = np.unique(values[~is_missing])
+    if len(thresholds) > max_bins:
+        quantiles = np.linspace(0, 1, max_bins + 1)[1:]
+        thresholds = np.unique(np.quantile(values[~is_missing], quantiles))
+    # Note: NaN values are sorted after every threshold, into the extra bin
+    codes = np.searchsorted(thresholds, values, side='left')
+    return FeatureBins(codes.astype(np.int32), thresholds, False)
+
+
+def build_histogram_tree(feature_bins, row_indexes, target, max_depth,
+                         num_leaves, min_child_samples=MIN_CHILD_SAMPLES):
+    """Grows a single regression tree on the target from histograms.
+
+    See iter_histogram_tree for how the tree is grown.
+
+    :param feature_bins: The bins of each feature of the tree.
+    :type feature_bins: list[FeatureBins]
+    :param row_indexes: The row indexes of the cohort.
+    :type row_indexes: numpy.ndarray
+    :param target: The target of each row of the cohort, for example
+        whether the prediction is wrong.
+    :type target: numpy.ndarray
+    :param max_depth: The maximum depth of the tree, or a non positive
+        value for no limit.
+    :type max_depth: int
+    :param num_leaves: The maximum number of leaves of the tree.
+    :type num_leaves: int
+    :param min_child_samples: The minimum number of rows of a leaf.
+    :type min_child_samples: int
+    :return: The tree arrays and the leaf index of each row.
+    :rtype: tuple[TreeArrays, numpy.ndarray]
+    """
+    for _, tree_arrays, leaf_index in iter_histogram_tree(
+            feature_bins, row_indexes, target, max_depth, num_leaves,
+            min_child_samples=min_child_samples):
+        pass
+    return tree_arrays, leaf_index
+
+
+def iter_histogram_tree(feature_bins, row_indexes, target, max_depth,
+                        num_leaves, min_child_samples=MIN_CHILD_SAMPLES):
+    """Grows a single regression tree on the target level by level.
+
+    The leaves of each depth are split in decreasing order of the
+    reduction of the squared error, until the tree has num_leaves
+    leaves, and the tree grown so far is yielded once the splits of a
+    depth are made, so the top of the tree can be used before the
+    deeper levels are grown.  When num_leaves does not limit the tree,
+    for example with the default depth of 3 and 31 leaves, this makes
+    the splits of a gradient boosted tree on the target, since the
+    hessians of the squared and logistic losses are constant at the
+    first iteration.  The histograms of the larger child of each split
+    are derived by subtracting the smaller child from the parent.
+
+    The nodes are numbered in the order they are created, so the id of
+    a node is final as soon as it is yielded.
+
+    :param feature_bins: The bins of each feature of the tree.
+    :type feature_bins: list[FeatureBins]
+    :param row_indexes: The row indexes of the cohort.
+    :type row_indexes: numpy.ndarray
+    :param target: The target of each row of the cohort, for example
+        whether the prediction is wrong.
+    :type target: numpy.ndarray
+    :param max_depth: The maximum depth of the tree, or a non positive
+        value for no limit.
+    :type max_depth: int
+    :param num_leaves: The maximum number of leaves of the tree.
+    :type num_leaves: int
+    :param min_child_samples: The minimum number of rows of a leaf.
+    :type min_child_samples: int
+    :return: The depth whose nodes are final, with the tree arrays and
+        the leaf index of each row of the tree grown so far.  The leaf
+        index is updated in place as the tree grows.
+    :rtype: Iterator[tuple[int, TreeArrays, numpy.ndarray]]
+    """
+    target = np.asarray(target, dtype=float)
+    if len(row_indexes) == len(target) and \
+            all(len(bins.codes) == len(target) for bins in feature_bins):
+        # the cohort is the whole dataset, the codes need no gather
+        codes = [bins.codes for bins in feature_bins]
+    else:
+        codes = [bins.codes[row_indexes] for bins in feature_bins]
+    leaf_index = np.zeros(len(target), dtype=np.int32)
+    # the nodes in the order they are created, the root first
+    nodes = {'split_index': [], 'leaf_index': [], 'feature': [],
+             'threshold': [], 'left_categories': [], 'left': [],
+             'right': []}
+    _append_leaf(nodes, 0)
+    root = _Leaf(0, np.arange(len(target)), 0)
+    root.histograms = _histograms(codes, feature_bins, target, root.rows)
+    _find_best_split(root, feature_bins, min_child_samples)
+    level = [root]
+    depth = 0
+    num_splits = 0
+    while True:
+        can_split = max_depth <= 0 or depth + 1 < max_depth
+        candidates = sorted([leaf for leaf in level if leaf.split is not None],
+                            key=lambda candidate: -candidate.split[0])
+        children = []
+        for leaf in candidates:
+            if num_splits + 1 >= num_leaves:
+                break
+            _, feature, goes_left, threshold = leaf.split
+            is_left = goes_left[codes[feature][leaf.rows]]
+            num_nodes = len(nodes['left'])
+            left = _Leaf(num_nodes, leaf.rows[is_left], depth + 1)
+            right = _Leaf(num_nodes + 1, leaf.rows[~is_left], depth + 1)
+            # the right child gets a new leaf index, as in lightgbm
+            right.index = num_splits + 1
+            left.index = leaf.index
+            leaf_index[right.rows] = right.index
+            if can_split:
+                small, large = (left, right) \
+                    if len(left.rows) <= len(right.rows) else (right, left)
+                small.histograms = _histograms(codes, feature_bins, target,
+                                               small.rows)
+                large.histograms = [
+                    (count - small_count, total - small_total)
+                    for (count, total), (small_count, small_total)
+                    in zip(leaf.histograms, small.histograms)]
+            _append_leaf(nodes, left.index)
+            _append_leaf(nodes, right.index)
+            nodes['split_index'][leaf.node] = num_splits
+            nodes['leaf_index'][leaf.node] = NO_NODE
+            nodes['feature'][leaf.node] = feature
+            if feature_bins[feature].is_categorical:
+                nodes['left_categories'][leaf.node] = threshold
+            else:
+                nodes['threshold'][leaf.node] = threshold
+            nodes['left'][leaf.node] = left.node
+            nodes['right'][leaf.node] = right.node
+            num_splits += 1
+            children.extend([left, right])
+        for leaf in level:
+            leaf.histograms = None
+        yield depth, create_tree_arrays(
+            node_id=np.arange(len(nodes['left'])), **nodes), leaf_index
+        if not children:
+            return
+        if can_split:
+            for child in children:
+                _find_best_split(child, feature_bins, min_child_samples)
+        level = children
+        depth += 1
+
+
+def _append_leaf(nodes, leaf_index):
+    nodes['split_index'].append(NO_NODE)
+    nodes['leaf_index'].append(leaf_index)
+    nodes['feature'].append(NO_NODE)
+    nodes['threshold'].append(np.nan)
+    nodes['left_categories'].append(None)
+    nodes['left'].append(NO_NODE)
+    nodes['right'].append(NO_NODE)
+
+
+class _Leaf(object):
+    def __init__(self, node, rows, depth):
+        self.node = node
+        self.rows = rows
+        self.depth = depth
+        self.index = 0
+        self.histograms = None
+        self.split = None
+
+
+def _histograms(codes, feature_bins, target, rows):
+    # the count and target sum of each bin, the extra bin is missing
+    histograms = []
+    leaf_target = target[rows]
+    for feature_codes, bins in zip(codes, feature_bins):
+        leaf_codes = feature_codes[rows]
+        minlength = bins.num_bins + 1
+        histograms.append((np.bincount(leaf_codes, minlength=minlength),
+                           np.bincount(leaf_codes, weights=leaf_target,
+                                       minlength=minlength)))
+    return histograms
+
+
+def _find_best_split(leaf, feature_bins, min_child_samples):
+    # Find the split of the leaf with the largest reduction of the
+    # squared error, as (gain, feature, bins going left, threshold)
+    num_rows = len(leaf.rows)
+    if num_rows < 2 * min_child_samples:
+        return
+    best = None
+    for feature, (bins, (count, total)) in enumerate(zip(
+            feature_bins, leaf.histograms)):
+        # the missing bin is never sent to the left child
+        order = np.arange(bins.num_bins)
+        if bins.is_categorical:
+            non_empty = order[count[:-1] > 0]
+            order = non_empty[np.argsort(total[non_empty] /
+                                         count[non_empty], kind='stable')]
+        left_count = np.cumsum(count[order])
+        left_total = np.cumsum(total[order])
+        right_count = num_rows - left_count
+        right_total = total.sum() - left_total
+        valid = (left_count >= min_child_samples) & \
+            (right_count >= min_child_samples)
+        if not valid.any():
+            continue
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gain = left_total ** 2 / left_count + \
+                right_total ** 2 / right_count - \
+                total.sum() ** 2 / num_rows
+        gain = np.where(valid, gain, -np.inf)
+        position = int(np.argmax(gain))
+        if gain[position] <= MIN_GAIN or \
+                (best is not None and gain[position] <= best[0]):
+            continue
+        goes_left = np.zeros(bins.num_bins + 1, dtype=bool)
+        goes_left[order[:position + 1]] = True
+        if bins.is_categorical:
+            threshold = np.sort(
+                bins.thresholds[order[:position + 1]]).astype(int)
+        else:
+            threshold = float(bins.thresholds[order[position]])
+        best = (float(gain[position]), feature, goes_left, threshold)
+    leaf.split = best
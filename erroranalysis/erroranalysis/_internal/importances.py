@@ -0,0 +1,186 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+from concurrent.futures import (
+    ProcessPoolExecutor, ThreadPoolExecutor, as_completed)
+
+import numpy as np
+from sklearn.feature_selection import (
+    mutual_info_classif, mutual_info_regression)
+
+from erroranalysis._internal.constants import ModelTask
+
+# Note: the regression errors are stratified by their deciles
+NUM_REGRESSION_STRATA = 10
+
+
+class ImportancesEstimator(object):
+    """Estimates the mutual information between features and errors.
+
+    The rows may be subsampled, stratified on the errors so that the
+    error rate or the distribution of the errors of the sample matches
+    the dataset.  The mutual information of the features is estimated in
+    parallel on a pool of threads or processes.  Each feature is
+    estimated separately, so for a given random state the importances do
+    not depend on the number of workers.
+
+    :param sample_size: The maximum number of rows to estimate the
+        mutual information on, or None to use every row.
+    :type sample_size: int
+    :param random_state: The seed of the subsampling and of the noise
+        added to continuous features by the estimator.
+    :type random_state: int
+    :param num_workers: The number of workers estimating features in
+        parallel.
+    :type num_workers: int
+    :param use_processes: Whether to estimate on a pool of processes
+        instead of threads.
+    :type use_processes: bool
+    """
+
+    def __init__(self, sample_size=None, random_state=None, num_workers=1,
+                 use_processes=False):
+        if sample_size is not None and sample_size < 1:
+            raise ValueError("Sample size must be a positive integer")
+        if num_workers < 1:
+            raise ValueError("Number of workers must be a positive integer")
+        self._sample_size = sample_size
+        self._random_state = random_state
+        self._num_workers = num_workers
+        self._use_processes = use_processes
+
+    @property
+    def sample_size(self):
+        return self._sample_size
+
+    @property
+    def random_state(self):
+        return self._random_state
+
+    @property
+    def num_workers(self):
+        return self._num_workers
+
+    @property
+    def use_processes(self):
+        return self._use_processes
+
+    def estimate(self, input_data, diff, model_task):
+        """Estimates the mutual information of each feature and the errors.
+
+        :param input_data: The encoded features of the rows.
+        :type input_data: numpy.ndarray
+        :param diff: Whether each prediction is wrong for classification,
+            or the error of each prediction for regression.
+        :type diff: numpy.ndarray
+        :param model_task: The model task, classification or regression.
+        :type model_task: str
+        :return: The mutual information of each feature.
+        :rtype: list[float]
+        """
+        importances = np.zeros(input_data.shape[1])
+        for feature, importance in self.iter_estimate(input_data, diff,
+                                                      model_task):
+            importances[feature] = importance
+        return importances.tolist()
+
+    def iter_estimate(self, input_data, diff, model_task):
+        """Yields the mutual information of each feature as it completes.
+
+        With several workers the features are yielded in the order they
+        complete, not in the order of the columns.
+
+        :param input_data: The encoded features of the rows.
+        :type input_data: numpy.ndarray
+        :param diff: Whether each prediction is wrong for classification,
+            or the error of each prediction for regression.
+        :type diff: numpy.ndarray
+        :param model_task: The model task, classification or regression.
+        :type model_task: str
+        :return: The index and mutual information of each feature.
+        :rtype: Iterator[tuple[int, float]]
+        """
+        is_classification = model_task == ModelTask.CLASSIFICATION
+        diff = np.asarray(diff)
+        if self._sample_size is not None and \
+                self._sample_size < len(diff):
+            if is_classification:
+                strata = diff
+            else:
+                edges = np.quantile(diff, np.linspace(
+                    0, 1, NUM_REGRESSION_STRATA + 1)[1:-1])
+                strata = np.searchsorted(edges, diff)
+            sample = stratified_sample(strata, self._sample_size,
+                                       self._random_state)
+            input_data = input_data[sample]
+            diff = diff[sample]
+        num_features = input_data.shape[1]
+        if self._num_workers == 1 or num_features <= 1:
+            for feature in range(num_features):
+                yield feature, _mutual_info(input_data[:, feature], diff,
+                                            is_classification,
+                                            self._random_state)
+            return
+        num_workers = min(self._num_workers, num_features)
+        if self._use_processes:
+            executor = ProcessPoolExecutor(max_workers=num_workers)
+        else:
+            executor = ThreadPoolExecutor(max_workers=num_workers)
+        with executor:
+            futures = {executor.submit(_mutual_info,
+                                       input_data[:, feature],
+                                       diff,
+                                       is_classification,
+                                       self._random_state): feature
+                       for feature in range(num_features)}
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+
+def stratified_sample(strata, sample_size, random_state=None):
+    """Samples rows uniformly within each stratum.
+
+    Every stratum gets a number of rows proportional to its size,
+    rounded so that the sample has exactly sample_size rows.
+
+    :param strata: The stratum of each row.
+    :type strata: numpy.ndarray
+    :param sample_size: The number of rows to sample.
+    :type sample_size: int
+    :param random_state: The seed of the sampling.
+    :type random_state: int
+    :return: The sorted indexes of the sampled rows.
+    :rtype: numpy.ndarray
+    """
+    num_rows = len(strata)
+    if sample_size >= num_rows:
+        return np.arange(num_rows)
+    _, stratum, counts = np.unique(strata, return_inverse=True,
+                                   return_counts=True)
+    quota = counts * sample_size / num_rows
+    allocation = np.floor(quota).astype(int)
+    # the largest remainders get the rows left by the rounding down
+    remainder = sample_size - allocation.sum()
+    allocation[np.argsort(allocation - quota, kind='stable')[:remainder]] += 1
+    rng = np.random.RandomState(random_state)
+    shuffled = rng.permutation(num_rows)
+    by_stratum = shuffled[np.argsort(stratum[shuffled], kind='stable')]
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    rank = np.arange(num_rows) - starts
+    keep = rank < np.repeat(allocation, counts)
+    return np.sort(by_stratum[keep])
+
+
+def _mutual_info(values, diff, is_classification, random_state):
+    # Note: the features are estimated one at a time so the noise drawn
+    # for each feature does not depend on how the features are scheduled
+    if is_classification:
+        mutual_info = mutual_info_classif
+    else:
+        mutual_info = mutual_info_regression
+    return float(mutual_info(values.reshape(-1, 1), diff,
+                             random_state=random_state)[0])
@@ -3,16 +3,10 @@
 
 import numpy as np
 import pandas as pd
-import math
-from erroranalysis._internal.cohort_filter import filter_from_cohort
-from erroranalysis._internal.constants import (PRED_Y,
-                                               TRUE_Y,
-                                               ROW_INDEX,
-                                               DIFF,
-                                               ModelTask,
-                                               Metrics,
+from erroranalysis._internal.constants import (BinningStrategy, Metrics,
                                                metric_to_display_name)
-from erroranalysis._internal.metrics import metric_to_func
+from erroranalysis._internal.metrics import (
+    compute_metric_statistics, group_median)
 
 
 BIN_THRESHOLD = 8
@@ -34,301 +28,299 @@ def compute_json_matrix(analyzer, features, filters, composite_filters):
     compute_matrix(analyzer, features, filters, composite_filters)
 
 
-def compute_matrix(analyzer, features, filters, composite_filters):
+def compute_matrix(analyzer, features, filters, composite_filters,
+                   chunk_size=None):
     if features[0] is None and features[1] is None:
         raise ValueError(
             "One or two features must be specified to compute the heat map")
-    is_model_analyzer = hasattr(analyzer, 'model')
-    if is_model_analyzer:
-        filtered_df = filter_from_cohort(analyzer.dataset,
-                                         filters,
-                                         composite_filters,
-                                         analyzer.feature_names,
-                                         analyzer.true_y,
-                                         analyzer.categorical_features,
-                                         analyzer.categories)
-    else:
-        filtered_df = filter_from_cohort(analyzer.dataset,
-                                         filters,
-                                         composite_filters,
-                                         analyzer.feature_names,
-                                         analyzer.true_y,
-                                         analyzer.categorical_features,
-                                         analyzer.categories,
-                                         analyzer.pred_y)
-    true_y = filtered_df[TRUE_Y]
-    dropped_cols = [TRUE_Y, ROW_INDEX]
-    if not is_model_analyzer:
-        pred_y = filtered_df[PRED_Y]
-        dropped_cols.append(PRED_Y)
-    input_data = filtered_df.drop(columns=dropped_cols)
-    is_pandas = isinstance(analyzer.dataset, pd.DataFrame)
+    row_indexes = analyzer.compute_cohort_indexes(filters, composite_filters)
     metric = analyzer.metric
-    if is_pandas:
-        true_y = true_y.to_numpy()
-    else:
-        input_data = input_data.to_numpy()
-    if is_model_analyzer:
-        pred_y = analyzer.model.predict(input_data)
-    if is_model_analyzer:
-        if analyzer.model_task == ModelTask.CLASSIFICATION:
-            diff = analyzer.model.predict(input_data) != true_y
-        else:
-            diff = analyzer.model.predict(input_data) - true_y
+    dataset_sub_names = [feature for feature in features
+                         if feature is not None]
+    if len(dataset_sub_names) != 2:
+        # Note: as in the dashboard, the heat map is 2D for exactly two
+        # features and otherwise only maps the first feature
+        dataset_sub_names = dataset_sub_names[:1]
+    if chunk_size is None:
+        chunks = [row_indexes]
     else:
-        if analyzer.model_task == ModelTask.CLASSIFICATION:
-            diff = pred_y != true_y
-        else:
-            diff = pred_y - true_y
-    if not isinstance(diff, np.ndarray):
-        diff = np.array(diff)
-    if not isinstance(pred_y, np.ndarray):
-        pred_y = np.array(pred_y)
-    if not isinstance(true_y, np.ndarray):
-        true_y = np.array(true_y)
-    indexes = []
-    for feature in features:
-        if feature is None:
-            continue
-        indexes.append(analyzer.feature_names.index(feature))
-    if is_pandas:
-        input_data = input_data.to_numpy()
-    dataset_sub_features = input_data[:, indexes]
-    dataset_sub_names = np.array(analyzer.feature_names)[np.array(indexes)]
-    df = pd.DataFrame(dataset_sub_features, columns=dataset_sub_names)
-    df_err = df.copy()
-    df_err[DIFF] = diff
-    if analyzer.model_task == ModelTask.CLASSIFICATION:
-        df_err = df_err[df_err[DIFF]]
+        chunks = [row_indexes[start:start + chunk_size]
+                  for start in range(0, len(row_indexes), chunk_size)]
+    # fix the bins of each feature up front so that every chunk
+    # is binned into the same integer codes
+    binnings = []
+    for feature in dataset_sub_names:
+        binning = analyzer.get_feature_binning(feature)
+        if binning is None:
+            is_categorical = analyzer.categorical_features is not None and \
+                feature in analyzer.categorical_features
+            values = (analyzer.column_store.take_column(feature, chunk)
+                      for chunk in chunks)
+            binning = FeatureBinning.fit(values, is_categorical,
+                                         analyzer.num_bins)
+        binnings.append(binning)
+    # aggregate the metric statistics of every cell, merging the
+    # statistics of each chunk
+    shape = tuple(len(binning.categories) for binning in binnings)
+    num_cells = int(np.prod(shape))
+    is_median = metric == Metrics.MEDIAN_ABSOLUTE_ERROR
+    stats = None
+    cell_indexes = []
+    abs_errors = []
+    # convert the labels once instead of once per chunk
+    all_true_y = np.asarray(analyzer.true_y)
+    for chunk in chunks:
+        true_y = analyzer.column_store.take(all_true_y, chunk)
+        pred_y = analyzer.get_cohort_pred_y(chunk)
+        codes = [binning.transform(analyzer.column_store.take_column(
+                 feature, chunk))
+                 for feature, binning in zip(dataset_sub_names, binnings)]
+        valid = np.ones(len(chunk), dtype=bool)
+        for feature_codes in codes:
+            valid &= feature_codes >= 0
+        cell_index = np.ravel_multi_index([feature_codes[valid]
+                                           for feature_codes in codes], shape)
+        true_y = true_y[valid]
+        pred_y = pred_y[valid]
+        chunk_stats = compute_metric_statistics(cell_index, num_cells,
+                                                true_y, pred_y,
+                                                analyzer.model_task)
+        stats = chunk_stats if stats is None else stats.add(chunk_stats)
+        if is_median:
+            cell_indexes.append(cell_index)
+            abs_errors.append(np.abs(pred_y - true_y))
+    if stats is None:
+        stats = compute_metric_statistics(np.array([], dtype=int), num_cells,
+                                          np.array([]), np.array([]),
+                                          analyzer.model_task)
+    if is_median and cell_indexes:
+        stats.median_abs_error = group_median(np.concatenate(cell_indexes),
+                                              np.concatenate(abs_errors),
+                                              stats.count)
+    counts = stats.count.reshape(shape)
+    if metric == Metrics.ERROR_RATE:
+        cell_values = stats.error_count.reshape(shape)
     else:
-        df_err[TRUE_Y] = true_y
-        df_err[PRED_Y] = pred_y
-    # construct matrix
-    matrix = []
+        cell_values = np.nan_to_num(stats.metric_value(metric)).reshape(shape)
     if len(dataset_sub_names) == 2:
-        feat1 = dataset_sub_names[0]
-        feat2 = dataset_sub_names[1]
-        unique_count1 = len(df[feat1].unique())
-        unique_count2 = len(df[feat2].unique())
-        f1_is_cat = False
-        f2_is_cat = False
-        if analyzer.categorical_features is not None:
-            f1_is_cat = feat1 in analyzer.categorical_features
-            f2_is_cat = feat2 in analyzer.categorical_features
-        if unique_count1 > BIN_THRESHOLD and not f1_is_cat:
-            tabdf1, bins = pd.cut(df[feat1], BIN_THRESHOLD,
-                                  retbins=True)
-            tabdf1_err = pd.cut(df_err[feat1], bins)
-            categories1 = tabdf1.cat.categories
-        else:
-            tabdf1 = df[feat1]
-            tabdf1_err = df_err[feat1]
-            categories1 = np.unique(tabdf1.to_numpy(),
-                                    return_counts=True)[0]
-        if unique_count2 > BIN_THRESHOLD and not f2_is_cat:
-            tabdf2, bins = pd.cut(df[feat2], BIN_THRESHOLD,
-                                  retbins=True)
-            tabdf2_err = pd.cut(df_err[feat2], bins)
-            categories2 = tabdf2.cat.categories
-        else:
-            tabdf2 = df[feat2]
-            tabdf2_err = df_err[feat2]
-            categories2 = np.unique(tabdf2.to_numpy(),
-                                    return_counts=True)[0]
-        if metric == Metrics.ERROR_RATE:
-            matrix_total = pd.crosstab(tabdf1,
-                                       tabdf2,
-                                       rownames=[feat1],
-                                       colnames=[feat2])
-            matrix_error = pd.crosstab(tabdf1_err,
-                                       tabdf2_err,
-                                       rownames=[feat1],
-                                       colnames=[feat2])
-        else:
-            aggfunc = _AggFunc(metric_to_func[metric])
-            matrix_total = pd.crosstab(tabdf1,
-                                       tabdf2,
-                                       rownames=[feat1],
-                                       colnames=[feat2])
-            matrix_error = pd.crosstab(tabdf1_err,
-                                       tabdf2_err,
-                                       rownames=[feat1],
-                                       colnames=[feat2],
-                                       values=list(zip(df_err[TRUE_Y],
-                                                       df_err[PRED_Y])),
-                                       aggfunc=aggfunc._agg_func_pair)
-            matrix_total = matrix_total.fillna(0)
-            matrix_error = matrix_error.fillna(0)
-        matrix = matrix_2d(categories1, categories2,
-                           matrix_total, matrix_error,
-                           metric)
-    else:
-        feat1 = dataset_sub_names[0]
-        unique_count1 = len(df[feat1].unique())
-        f1_is_cat = False
-        if analyzer.categorical_features is not None:
-            f1_is_cat = feat1 in analyzer.categorical_features
-        if unique_count1 > BIN_THRESHOLD and not f1_is_cat:
-            cutdf, bins = pd.cut(df[feat1], BIN_THRESHOLD,
-                                 retbins=True)
-            bin_range = range(BIN_THRESHOLD)
-            catr = cutdf.cat.rename_categories(bin_range)
-            catn, counts = np.unique(catr.to_numpy(),
-                                     return_counts=True)
-            # fix counts to include skipped categories
-            fix_counts = []
-            counts_idx = 0
-            for idx, catdf in enumerate(cutdf.cat.categories):
-                if idx not in catn:
-                    fix_counts.append(0)
-                else:
-                    fix_counts.append(counts[counts_idx])
-                    counts_idx += 1
-            counts = fix_counts
-            cut_err = pd.cut(df_err[feat1], bins)
-            catr_err = cut_err.cat.rename_categories(bin_range)
-            val_err, counts_err = np.unique(catr_err.to_numpy(),
-                                            return_counts=True)
-            val_err = cut_err.cat.categories[val_err]
-            categories = cutdf.cat.categories
-        else:
-            categories, counts = np.unique(df[feat1].to_numpy(),
-                                           return_counts=True)
-            val_err, counts_err = np.unique(df_err[feat1].to_numpy(),
-                                            return_counts=True)
-            cut_err = df_err
-        # Compute the given metric for each group, if not using error rate
-        if metric != Metrics.ERROR_RATE:
-            aggfunc = _AggFunc(metric_to_func[metric])
-            cutdf_err = pd.DataFrame(cut_err)
-            cutdf_err['metric_values'] = list(zip(df_err[TRUE_Y],
-                                                  df_err[PRED_Y]))
-            grouped = cutdf_err.groupby([feat1])
-            counts_err = grouped.agg(aggfunc._agg_func_triplet)
-            counts_err = counts_err.values.ravel()
-        matrix = matrix_1d(categories, val_err, counts,
-                           counts_err, metric)
-    return matrix
-
-
-class _AggFunc(object):
-    def __init__(self, aggfunc):
-        self.aggfunc = aggfunc
-
-    def _agg_func_pair(self, pair):
-        true_y, pred_y = zip(*pair.values.tolist())
-        return self.aggfunc(true_y, pred_y)
-
-    def _agg_func_triplet(self, pair):
-        if pair.empty:
-            return 0
-        (true_y, pred_y) = zip(*pair.values.tolist())
-        return self.aggfunc(true_y, pred_y)
+        categories1, categories2 = [binning.categories
+                                    for binning in binnings]
+        return matrix_2d(categories1, categories2, counts, cell_values,
+                         metric)
+    return matrix_1d(binnings[0].categories, counts, cell_values, metric)
+
+
+class FeatureBinning(object):
+    """Bins the values of a feature into integer codes.
+
+    Numeric features with more unique values than the number of bins
+    are split into intervals, other features have one category per
+    unique value.
+
+    :param categories: The categories or intervals the codes refer to.
+    :type categories: numpy.ndarray or pandas.IntervalIndex
+    :param bin_edges: The edges of the intervals, or None if the feature
+        has one category per unique value.
+    :type bin_edges: numpy.ndarray
+    """
+
+    def __init__(self, categories, bin_edges=None):
+        self.categories = categories
+        self.bin_edges = bin_edges
+
+    @staticmethod
+    def fit(chunks, is_categorical, num_bins=BIN_THRESHOLD):
+        """Fits equal width bins of a feature from chunks of its values.
+
+        Only the unique values, up to num_bins of them, and the
+        minimum and maximum of each chunk are kept in memory.
+
+        :param chunks: The chunks of values of the feature.
+        :type chunks: iterable[numpy.ndarray]
+        :param is_categorical: Whether the feature is categorical.
+        :type is_categorical: bool
+        :param num_bins: The number of bins of numeric features.
+        :type num_bins: int
+        :return: The fitted binning.
+        :rtype: FeatureBinning
+        """
+        unique_values = None
+        minimum = maximum = None
+        for values in chunks:
+            if len(values) == 0:
+                continue
+            # Note: the first chunk seeds the unique values, so that they
+            # keep the dtype of the feature, for example int or bool
+            if unique_values is None:
+                unique_values = pd.unique(values)
+            elif len(unique_values) <= num_bins or is_categorical:
+                unique_values = pd.unique(np.concatenate(
+                    [unique_values, pd.unique(values)]))
+            if values.dtype.kind in 'biuf':
+                chunk_min = np.nanmin(values)
+                chunk_max = np.nanmax(values)
+                if minimum is None or chunk_min < minimum:
+                    minimum = chunk_min
+                if maximum is None or chunk_max > maximum:
+                    maximum = chunk_max
+        if unique_values is None:
+            unique_values = np.array([])
+        if len(unique_values) > num_bins and not is_categorical:
+            # Note: cutting the extrema gives the same intervals as
+            # cutting all the values, which only depend on the range
+            binned, bin_edges = pd.cut(np.array([minimum, maximum]),
+                                       num_bins, retbins=True)
+            return FeatureBinning(binned.categories, bin_edges)
+        return FeatureBinning._from_unique_values(unique_values)
+
+    @staticmethod
+    def fit_quantiles(values, is_categorical, num_bins=BIN_THRESHOLD):
+        """Fits bins of a feature holding similar numbers of values.
+
+        :param values: The values of the feature.
+        :type values: numpy.ndarray
+        :param is_categorical: Whether the feature is categorical.
+        :type is_categorical: bool
+        :param num_bins: The number of bins of numeric features.
+        :type num_bins: int
+        :return: The fitted binning.
+        :rtype: FeatureBinning
+        """
+        unique_values = pd.unique(values)
+        if len(unique_values) > num_bins and not is_categorical:
+            # Note: duplicate edges of heavily repeated values are dropped,
+            # which can leave fewer bins than requested
+            binned, bin_edges = pd.qcut(values, num_bins, retbins=True,
+                                        duplicates='drop')
+            return FeatureBinning(binned.categories, bin_edges)
+        return FeatureBinning._from_unique_values(unique_values)
+
+    @staticmethod
+    def from_edges(bin_edges):
+        """Creates the binning of a feature from user supplied bin edges.
+
+        Values outside of the edges are left out of the heat map.
+
+        :param bin_edges: The increasing edges of the bins.
+        :type bin_edges: list[float] or numpy.ndarray
+        :return: The binning.
+        :rtype: FeatureBinning
+        """
+        bin_edges = np.asarray(bin_edges, dtype=float)
+        if len(bin_edges) < 2 or np.any(np.diff(bin_edges) <= 0):
+            raise ValueError(
+                "Bin edges must contain at least two increasing values")
+        binned = pd.cut(bin_edges, bin_edges, include_lowest=True)
+        return FeatureBinning(binned.categories, bin_edges)
+
+    @staticmethod
+    def _from_unique_values(unique_values):
+        categories = pd.Categorical(unique_values).categories
+        return FeatureBinning(np.asarray(categories))
+
+    def transform(self, values):
+        """Returns the code of each value, -1 for missing values.
+
+        :param values: The values of the feature.
+        :type values: numpy.ndarray
+        :return: The integer code of each value.
+        :rtype: numpy.ndarray
+        """
+        if self.bin_edges is not None:
+            codes = pd.cut(values, self.bin_edges, labels=False,
+                           include_lowest=True)
+            return np.where(np.isnan(codes), -1, codes).astype(int)
+        categorical = pd.Categorical(values, categories=self.categories)
+        return np.asarray(categorical.codes)
+
+
+def fit_feature_binning(analyzer, feature):
+    """Fits the binning of a feature over the whole dataset.
+
+    :param analyzer: The error analyzer.
+    :type analyzer: BaseAnalyzer
+    :param feature: The name of the feature.
+    :type feature: str
+    :return: The binning of the feature for the analyzer strategy.
+    :rtype: FeatureBinning
+    """
+    if analyzer.bin_edges and feature in analyzer.bin_edges:
+        return FeatureBinning.from_edges(analyzer.bin_edges[feature])
+    is_categorical = analyzer.categorical_features is not None and \
+        feature in analyzer.categorical_features
+    values = analyzer.column_store[feature]
+    if analyzer.bin_strategy == BinningStrategy.QUANTILE:
+        return FeatureBinning.fit_quantiles(values, is_categorical,
+                                            analyzer.num_bins)
+    return FeatureBinning.fit([values], is_categorical, analyzer.num_bins)
 
 
 def matrix_2d(categories1, categories2, matrix_counts,
               matrix_err_counts, metric):
-    matrix = []
-    category1 = []
-    category1_min_interval = []
-    category1_max_interval = []
-    for row_index in range(len(categories1)):
-        matrix_row = []
-        cat1 = categories1[row_index]
-        if isinstance(categories1, pd.IntervalIndex):
-            category1_min_interval.append(cat1.left)
-            category1_max_interval.append(cat1.right)
-            category1.append(str(cat1))
-        else:
-            category1.append(cat1)
-        for col_index in range(len(categories2)):
-            cat2 = categories2[col_index]
-            index_exists_err = cat1 in matrix_err_counts.index
-            col_exists_err = cat2 in matrix_err_counts.columns
-            if metric == Metrics.ERROR_RATE:
-                false_count = 0
-                if index_exists_err and col_exists_err:
-                    false_count = int(matrix_err_counts.loc[cat1, cat2])
-            else:
-                metric_value = 0
-                if index_exists_err and col_exists_err:
-                    metric_value = float(matrix_err_counts.loc[cat1, cat2])
-            index_exists = cat1 in matrix_counts.index
-            col_exists = cat2 in matrix_counts.columns
-            total_count = 0
-            if index_exists and col_exists:
-                total_count = int(matrix_counts.loc[cat1, cat2])
-            if metric == Metrics.ERROR_RATE:
-                matrix_row.append({
-                    FALSE_COUNT: false_count,
-                    COUNT: total_count
-                })
-            else:
-                matrix_row.append({
-                    METRIC_VALUE: metric_value,
-                    METRIC_NAME: metric_to_display_name[metric],
-                    COUNT: total_count
-                })
-        matrix.append(matrix_row)
-
-    category2 = []
-    category2_min_interval = []
-    category2_max_interval = []
-    for cat2 in categories2:
-        if isinstance(categories2, pd.IntervalIndex):
-            category2_min_interval.append(cat2.left)
-            category2_max_interval.append(cat2.right)
-            category2.append(str(cat2))
-        else:
-            category2.append(cat2)
-    category1 = {VALUES: category1,
-                 INTERVAL_MIN: category1_min_interval,
-                 INTERVAL_MAX: category1_max_interval}
-    category2 = {VALUES: category2,
-                 INTERVAL_MIN: category2_min_interval,
-                 INTERVAL_MAX: category2_max_interval}
-    return {MATRIX: matrix, CATEGORY1: category1,
-            CATEGORY2: category2}
-
-
-def matrix_1d(categories, values_err, counts, counts_err,
-              metric):
-    matrix = []
-    matrix_row = []
-    for col_idx in range(len(categories)):
-        cat = categories[col_idx]
-        if metric == Metrics.ERROR_RATE:
-            false_count = 0
-            if cat in values_err:
-                index_err = list(values_err).index(cat)
-                false_count = int(counts_err[index_err])
-            matrix_row.append({
-                FALSE_COUNT: false_count,
-                COUNT: int(counts[col_idx])
-            })
-        else:
-            metric_value = 0
-            if cat in values_err:
-                metric_value = float(counts_err[col_idx])
-                if math.isnan(metric_value):
-                    metric_value = 0.0
-            matrix_row.append({
-                METRIC_VALUE: metric_value,
-                METRIC_NAME: metric_to_display_name[metric],
-                COUNT: int(counts[col_idx])
-            })
-    matrix.append(matrix_row)
-    category = []
-    category_min_interval = []
-    category_max_interval = []
-    for cat in categories:
-        if isinstance(categories, pd.IntervalIndex):
-            category_min_interval.append(cat.left)
-            category_max_interval.append(cat.right)
-            category.append(str(cat))
-        else:
-            category.append(cat)
-    category1 = {VALUES: category,
-                 INTERVAL_MIN: category_min_interval,
-                 INTERVAL_MAX: category_max_interval}
-    return {MATRIX: matrix, CATEGORY1: category1}
+    """Assembles the json representation of a two feature heatmap.
+
+    :param categories1: The categories or intervals of the first feature.
+    :type categories1: numpy.ndarray or pandas.IntervalIndex
+    :param categories2: The categories or intervals of the second feature.
+    :type categories2: numpy.ndarray or pandas.IntervalIndex
+    :param matrix_counts: The number of rows of each cell, aligned with
+        the categories of the first and second feature.
+    :type matrix_counts: numpy.ndarray
+    :param matrix_err_counts: The error count of each cell for the error
+        rate metric, or the metric value of each cell otherwise.
+    :type matrix_err_counts: numpy.ndarray
+    :param metric: The metric of the heatmap.
+    :type metric: str
+    :return: The json representation of the heatmap.
+    :rtype: dict
+    """
+    matrix = [_matrix_row(count_row, value_row, metric)
+              for count_row, value_row
+              in zip(np.asarray(matrix_counts).tolist(),
+                     np.asarray(matrix_err_counts).tolist())]
+    return {MATRIX: matrix,
+            CATEGORY1: _categories_to_json(categories1),
+            CATEGORY2: _categories_to_json(categories2)}
+
+
+def matrix_1d(categories, counts, counts_err, metric):
+    """Assembles the json representation of a single feature heatmap.
+
+    :param categories: The categories or intervals of the feature.
+    :type categories: numpy.ndarray or pandas.IntervalIndex
+    :param counts: The number of rows of each cell, aligned with
+        the categories.
+    :type counts: numpy.ndarray
+    :param counts_err: The error count of each cell for the error
+        rate metric, or the metric value of each cell otherwise.
+    :type counts_err: numpy.ndarray
+    :param metric: The metric of the heatmap.
+    :type metric: str
+    :return: The json representation of the heatmap.
+    :rtype: dict
+    """
+    matrix = [_matrix_row(np.asarray(counts).tolist(),
+                          np.asarray(counts_err).tolist(),
+                          metric)]
+    return {MATRIX: matrix, CATEGORY1: _categories_to_json(categories)}
+
+
+def _matrix_row(counts, values, metric):
+    if metric == Metrics.ERROR_RATE:
+        return [{FALSE_COUNT: int(false_count), COUNT: int(count)}
+                for count, false_count in zip(counts, values)]
+    metric_name = metric_to_display_name[metric]
+    return [{METRIC_VALUE: float(metric_value),
+             METRIC_NAME: metric_name,
+             COUNT: int(count)}
+            for count, metric_value in zip(counts, values)]
+
+
+def _categories_to_json(categories):
+    if isinstance(categories, pd.IntervalIndex):
+        return {VALUES: [str(interval) for interval in categories],
+                INTERVAL_MIN: categories.left.tolist(),
+                INTERVAL_MAX: categories.right.tolist()}
+    return {VALUES: np.asarray(categories).tolist(),
+            INTERVAL_MIN: [],
+            INTERVAL_MAX: []}
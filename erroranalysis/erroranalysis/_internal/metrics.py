@@ -1,6 +1,7 @@
 # Copyright (c) Microsoft Corporation
 # Licensed under the MIT License.
 
+import numpy as np
 from sklearn.metrics import (
     mean_absolute_error, mean_squared_error, median_absolute_error,
     r2_score, f1_score, precision_score, recall_score)
@@ -25,3 +26,288 @@ metric_to_task = {
     Metrics.PRECISION_SCORE: ModelTask.CLASSIFICATION,
     Metrics.RECALL_SCORE: ModelTask.CLASSIFICATION
 }
+
+
+class MetricStatistics(object):
+    """Sufficient statistics of the error metrics for groups of rows.
+
+    All the supported metrics of a group, for example a heatmap cell,
+    can be derived from these statistics without revisiting its rows.
+
+    :param count: The number of rows in each group.
+    :type count: numpy.ndarray
+    :param error_count: The number of rows with a wrong prediction.
+    :type error_count: numpy.ndarray
+    :param sum_abs_error: The sum of the absolute residuals.
+    :type sum_abs_error: numpy.ndarray
+    :param sum_squared_error: The sum of the squared residuals.
+    :type sum_squared_error: numpy.ndarray
+    :param sum_true_y: The sum of the true labels.
+    :type sum_true_y: numpy.ndarray
+    :param squared_deviation_true_y: The sum of the squared deviations
+        of the true labels from their mean in the group.
+    :type squared_deviation_true_y: numpy.ndarray
+    :param true_positives: The number of true positives.
+    :type true_positives: numpy.ndarray
+    :param false_positives: The number of false positives.
+    :type false_positives: numpy.ndarray
+    :param false_negatives: The number of false negatives.
+    :type false_negatives: numpy.ndarray
+    :param median_abs_error: The median absolute residual, if computed.
+    :type median_abs_error: numpy.ndarray
+    :param labels: The sorted unique true and predicted labels of a
+        classification, None for a regression.
+    :type labels: numpy.ndarray
+    """
+
+    def __init__(self, count, error_count, sum_abs_error,
+                 sum_squared_error, sum_true_y, squared_deviation_true_y,
+                 true_positives, false_positives, false_negatives,
+                 median_abs_error=None, labels=None):
+        self.count = count
+        self.error_count = error_count
+        self.sum_abs_error = sum_abs_error
+        self.sum_squared_error = sum_squared_error
+        self.sum_true_y = sum_true_y
+        self.squared_deviation_true_y = squared_deviation_true_y
+        self.true_positives = true_positives
+        self.false_positives = false_positives
+        self.false_negatives = false_negatives
+        self.median_abs_error = median_abs_error
+        self.labels = labels
+
+    def add(self, other):
+        """Merges the statistics of the same groups over other rows.
+
+        The median absolute error cannot be merged and is dropped.  The
+        squared deviations are merged with the parallel variance formula
+        of Chan et al., which does not cancel for large labels.
+
+        :param other: The statistics of the other rows.
+        :type other: MetricStatistics
+        :return: The merged statistics.
+        :rtype: MetricStatistics
+        """
+        count = self.count + other.count
+        delta = _group_mean(other.sum_true_y, other.count) - \
+            _group_mean(self.sum_true_y, self.count)
+        squared_deviation_true_y = self.squared_deviation_true_y + \
+            other.squared_deviation_true_y + \
+            delta ** 2 * self.count * other.count / np.maximum(count, 1)
+        return MetricStatistics(
+            count,
+            self.error_count + other.error_count,
+            self.sum_abs_error + other.sum_abs_error,
+            self.sum_squared_error + other.sum_squared_error,
+            self.sum_true_y + other.sum_true_y,
+            squared_deviation_true_y,
+            self.true_positives + other.true_positives,
+            self.false_positives + other.false_positives,
+            self.false_negatives + other.false_negatives,
+            labels=_merge_labels(self.labels, other.labels))
+
+    def aggregate(self, membership):
+        """Aggregates the statistics of the groups into larger groups.
+
+        The median absolute error cannot be aggregated and is dropped.
+        The squared deviations of a larger group add up the squared
+        deviations of its groups and the spread of their means around
+        its mean, as in the parallel variance formula of Chan et al.
+
+        :param membership: The matrix with a row per larger group and a
+            column per group, set to 1 where the group belongs to the
+            larger group.
+        :type membership: numpy.ndarray
+        :return: The statistics of the larger groups.
+        :rtype: MetricStatistics
+        """
+        count = membership.dot(self.count)
+        sum_true_y = membership.dot(self.sum_true_y)
+        offset = _group_mean(self.sum_true_y, self.count)[None, :] - \
+            _group_mean(sum_true_y, count)[:, None]
+        squared_deviation_true_y = \
+            membership.dot(self.squared_deviation_true_y) + \
+            (membership * self.count * offset ** 2).sum(axis=1)
+        return MetricStatistics(
+            count,
+            membership.dot(self.error_count),
+            membership.dot(self.sum_abs_error),
+            membership.dot(self.sum_squared_error),
+            sum_true_y,
+            squared_deviation_true_y,
+            membership.dot(self.true_positives),
+            membership.dot(self.false_positives),
+            membership.dot(self.false_negatives),
+            labels=self.labels)
+
+    def metric_value(self, metric):
+        """Computes the value of the metric for each group.
+
+        Empty groups, and groups where the metric is undefined,
+        have a metric value of NaN.
+
+        :param metric: The metric to compute.
+        :type metric: str
+        :return: The metric value of each group.
+        :rtype: numpy.ndarray
+        """
+        count = self.count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if metric == Metrics.ERROR_RATE:
+                return self.error_count / count
+            elif metric == Metrics.MEAN_ABSOLUTE_ERROR:
+                return self.sum_abs_error / count
+            elif metric == Metrics.MEAN_SQUARED_ERROR:
+                return self.sum_squared_error / count
+            elif metric == Metrics.MEDIAN_ABSOLUTE_ERROR:
+                if self.median_abs_error is None:
+                    raise ValueError(
+                        "Median absolute error was not computed")
+                return self.median_abs_error
+            elif metric == Metrics.R2_SCORE:
+                total = self.squared_deviation_true_y
+                r2 = 1 - self.sum_squared_error / total
+                # Note: the deviations of constant true labels from their
+                # mean are rounding errors of the mean, bounded relative
+                # to the sum of the squared labels
+                sum_squares = total + self.sum_true_y ** 2 / count
+                is_constant = total <= \
+                    (count * np.finfo(float).eps) ** 2 * sum_squares
+                # Same conventions as sklearn for constant true labels
+                r2 = np.where(is_constant,
+                              np.where(self.sum_squared_error == 0, 1., 0.),
+                              r2)
+                return np.where(count < 2, np.nan, r2)
+            if metric in [Metrics.PRECISION_SCORE, Metrics.RECALL_SCORE,
+                          Metrics.F1_SCORE]:
+                self._check_positive_label(metric)
+            true_positives = self.true_positives
+            if metric == Metrics.PRECISION_SCORE:
+                denominator = true_positives + self.false_positives
+            elif metric == Metrics.RECALL_SCORE:
+                denominator = true_positives + self.false_negatives
+            elif metric == Metrics.F1_SCORE:
+                true_positives = 2 * true_positives
+                denominator = true_positives + self.false_positives + \
+                    self.false_negatives
+            else:
+                raise ValueError("Unsupported metric: {}".format(metric))
+            score = np.where(denominator == 0, 0.,
+                             true_positives / denominator)
+            return np.where(count == 0, np.nan, score)
+
+    def _check_positive_label(self, metric):
+        # Raise the errors of sklearn for the default pos_label of 1
+        labels = self.labels
+        if labels is None:
+            return
+        if len(labels) > 2:
+            raise ValueError("The {} metric requires binary labels, "
+                             "got {} labels".format(metric, len(labels)))
+        if len(labels) == 2 and \
+                not any(label == 1 for label in labels.tolist()):
+            raise ValueError("The positive label 1 of the {} metric is "
+                             "not one of the labels {}".format(
+                                 metric, labels.tolist()))
+
+
+def compute_metric_statistics(group_index, num_groups, true_y, pred_y,
+                              model_task, median=False):
+    """Computes the metric statistics of each group in a single pass.
+
+    :param group_index: The group of each row, between 0 and num_groups.
+    :type group_index: numpy.ndarray
+    :param num_groups: The number of groups.
+    :type num_groups: int
+    :param true_y: The true labels.
+    :type true_y: numpy.ndarray
+    :param pred_y: The predicted labels.
+    :type pred_y: numpy.ndarray
+    :param model_task: The model task, classification or regression.
+    :type model_task: str
+    :param median: Whether to compute the median absolute error,
+        which requires sorting the residuals.
+    :type median: bool
+    :return: The metric statistics of each group.
+    :rtype: MetricStatistics
+    """
+    def group_sum(weights):
+        return np.bincount(group_index, weights=weights,
+                           minlength=num_groups)
+
+    zeros = np.zeros(num_groups)
+    count = np.bincount(group_index, minlength=num_groups)
+    error_count = group_sum(pred_y != true_y)
+    sum_abs_error = sum_squared_error = sum_true_y = zeros
+    squared_deviation_true_y = true_positives = false_positives = zeros
+    false_negatives = zeros
+    median_abs_error = None
+    labels = None
+    if model_task == ModelTask.CLASSIFICATION:
+        labels = np.unique(np.concatenate([np.asarray(true_y),
+                                           np.asarray(pred_y)]))
+        # Note: as in sklearn, the positive label is 1, and the labels
+        # are validated when a metric of the positive label is computed
+        positive = [label for label in labels.tolist() if label == 1]
+        if positive:
+            is_true_positive = np.asarray(true_y) == positive[0]
+            is_pred_positive = np.asarray(pred_y) == positive[0]
+        else:
+            is_true_positive = np.zeros(len(true_y), dtype=bool)
+            is_pred_positive = np.zeros(len(pred_y), dtype=bool)
+        true_positives = group_sum(is_true_positive & is_pred_positive)
+        false_positives = group_sum(~is_true_positive & is_pred_positive)
+        false_negatives = group_sum(is_true_positive & ~is_pred_positive)
+    else:
+        residuals = pred_y - true_y
+        abs_error = np.abs(residuals)
+        sum_abs_error = group_sum(abs_error)
+        sum_squared_error = group_sum(residuals ** 2)
+        sum_true_y = group_sum(true_y)
+        # Note: the deviations from the group means are summed instead
+        # of the squared labels, which cancel for large labels
+        deviation = true_y - _group_mean(sum_true_y, count)[group_index]
+        squared_deviation_true_y = group_sum(deviation ** 2)
+        if median:
+            median_abs_error = group_median(group_index, abs_error, count)
+    return MetricStatistics(count, error_count, sum_abs_error,
+                            sum_squared_error, sum_true_y,
+                            squared_deviation_true_y, true_positives,
+                            false_positives, false_negatives,
+                            median_abs_error=median_abs_error,
+                            labels=labels)
+
+
+def group_median(group_index, values, count):
+    """Computes the median of the values of each group.
+
+    :param group_index: The group of each value.
+    :type group_index: numpy.ndarray
+    :param values: The values.
+    :type values: numpy.ndarray
+    :param count: The number of values in each group.
+    :type count: numpy.ndarray
+    :return: The median of each group, NaN for empty groups.
+    :rtype: numpy.ndarray
+    """
+    median = np.full(len(count), np.nan)
+    non_empty = count > 0
+    if not non_empty.any():
+        return median
+    sorted_values = values[np.lexsort((values, group_index))]
+    starts = np.cumsum(count) - count
+    lower = (starts + (count - 1) // 2)[non_empty]
+    upper = (starts + count // 2)[non_empty]
+    median[non_empty] = (sorted_values[lower] + sorted_values[upper]) / 2
+    return median
+
+
+def _merge_labels(labels, other_labels):
+    if labels is None or other_labels is None:
+        return labels if other_labels is None else other_labels
+    return np.union1d(labels, other_labels)
+
+
+def _group_mean(total, count):
+    # the mean of each group, zero for empty groups
+    return total / np.maximum(count, 1)
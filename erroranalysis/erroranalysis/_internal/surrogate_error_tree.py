@@ -2,27 +2,23 @@
 # Licensed under the MIT License.
 
 import numpy as np
-import pandas as pd
 from lightgbm import LGBMClassifier, LGBMRegressor
 from enum import Enum
-from erroranalysis._internal.cohort_filter import filter_from_cohort
-from erroranalysis._internal.constants import (PRED_Y,
-                                               TRUE_Y,
-                                               ROW_INDEX,
-                                               DIFF,
-                                               SPLIT_INDEX,
-                                               SPLIT_FEATURE,
-                                               LEAF_INDEX,
-                                               METHOD,
+from erroranalysis._internal.constants import (METHOD,
                                                METHOD_EXCLUDES,
                                                METHOD_INCLUDES,
                                                ModelTask,
                                                Metrics,
+                                               TreeBuilder,
                                                metric_to_display_name,
                                                error_metrics)
-from sklearn.metrics import (
-    mean_absolute_error, mean_squared_error, median_absolute_error,
-    r2_score, f1_score, precision_score, recall_score)
+from erroranalysis._internal.cohort_filter import (
+    METHOD_GREATER, METHOD_LESS_AND_EQUAL)
+from erroranalysis._internal.histogram_tree import (build_histogram_tree,
+                                                    iter_histogram_tree)
+from erroranalysis._internal.metrics import (
+    compute_metric_statistics, group_median)
+from erroranalysis._internal.tree_arrays import NO_NODE, flatten_tree
 
 MODEL = 'model'
 DEFAULT_MAX_DEPTH = 3
@@ -64,96 +60,340 @@ def compute_error_tree(analyzer,
                        filters,
                        composite_filters,
                        max_depth=DEFAULT_MAX_DEPTH,
-                       num_leaves=DEFAULT_NUM_LEAVES):
+                       num_leaves=DEFAULT_NUM_LEAVES,
+                       metric=None):
+    if metric is None:
+        metric = analyzer.metric
+    error_tree = fit_error_tree(analyzer,
+                                features,
+                                filters,
+                                composite_filters,
+                                max_depth=max_depth,
+                                num_leaves=num_leaves)
+    return error_tree.to_json(metric)
+
+
+def fit_error_tree(analyzer,
+                   features,
+                   filters,
+                   composite_filters,
+                   max_depth=DEFAULT_MAX_DEPTH,
+                   num_leaves=DEFAULT_NUM_LEAVES):
+    """Fits the surrogate error tree and computes its node statistics.
+
+    :param analyzer: The error analyzer.
+    :type analyzer: BaseAnalyzer
+    :param features: The features to train the surrogate tree on.
+    :type features: list[str]
+    :param filters: The filters from the dashboard.
+    :type filters: list[dict]
+    :param composite_filters: The composite filters from the dashboard.
+    :type composite_filters: list[dict]
+    :param max_depth: The maximum depth of the surrogate tree.
+    :type max_depth: int
+    :param num_leaves: The number of leaves of the surrogate tree.
+    :type num_leaves: int
+    :return: The surrogate error tree.
+    :rtype: ErrorTree
+    """
+    row_indexes = analyzer.compute_cohort_indexes(filters, composite_filters)
+    return fit_cohort_error_tree(analyzer,
+                                 features,
+                                 row_indexes,
+                                 max_depth=max_depth,
+                                 num_leaves=num_leaves)
+
+
+def fit_cohort_error_tree(analyzer,
+                          features,
+                          row_indexes,
+                          max_depth=DEFAULT_MAX_DEPTH,
+                          num_leaves=DEFAULT_NUM_LEAVES,
+                          n_jobs=None):
+    """Fits the surrogate error tree on the rows of a cohort.
+
+    :param analyzer: The error analyzer.
+    :type analyzer: BaseAnalyzer
+    :param features: The features to train the surrogate tree on.
+    :type features: list[str]
+    :param row_indexes: The row indexes of the cohort.
+    :type row_indexes: numpy.ndarray
+    :param max_depth: The maximum depth of the surrogate tree.
+    :type max_depth: int
+    :param num_leaves: The number of leaves of the surrogate tree.
+    :type num_leaves: int
+    :param n_jobs: The number of threads of the lightgbm surrogate, or
+        None for the lightgbm default.
+    :type n_jobs: int
+    :return: The surrogate error tree.
+    :rtype: ErrorTree
+    """
     # Fit a surrogate model on errors
     if max_depth is None:
         max_depth = DEFAULT_MAX_DEPTH
     if num_leaves is None:
         num_leaves = DEFAULT_NUM_LEAVES
-    is_model_analyzer = hasattr(analyzer, MODEL)
-    if is_model_analyzer:
-        filtered_df = filter_from_cohort(analyzer.dataset,
-                                         filters,
-                                         composite_filters,
-                                         analyzer.feature_names,
-                                         analyzer.true_y,
-                                         analyzer.categorical_features,
-                                         analyzer.categories)
-    else:
-        filtered_df = filter_from_cohort(analyzer.dataset,
-                                         filters,
-                                         composite_filters,
-                                         analyzer.feature_names,
-                                         analyzer.true_y,
-                                         analyzer.categorical_features,
-                                         analyzer.categories,
-                                         analyzer.pred_y)
-    row_index = filtered_df[ROW_INDEX]
-    true_y = filtered_df[TRUE_Y]
-    dropped_cols = [TRUE_Y, ROW_INDEX]
-    if not is_model_analyzer:
-        pred_y = filtered_df[PRED_Y]
-        dropped_cols.append(PRED_Y)
-    input_data = filtered_df.drop(columns=dropped_cols)
-    is_pandas = isinstance(analyzer.dataset, pd.DataFrame)
-    if is_pandas:
-        true_y = true_y.to_numpy()
+    true_y, pred_y, diff = get_cohort_errors(analyzer, row_indexes)
+    dataset_sub_names = list(features)
+    categorical_info = get_categorical_info(analyzer,
+                                            dataset_sub_names)
+    cat_ind_reindexed, categories_reindexed = categorical_info
+
+    if analyzer.tree_builder == TreeBuilder.HISTOGRAM:
+        feature_bins = [analyzer.get_tree_bins(feature)
+                        for feature in dataset_sub_names]
+        tree_arrays, leaf_index = build_histogram_tree(feature_bins,
+                                                       row_indexes,
+                                                       diff,
+                                                       max_depth,
+                                                       num_leaves)
     else:
-        input_data = input_data.to_numpy()
-    if is_model_analyzer:
-        pred_y = analyzer.model.predict(input_data)
+        dataset_sub_features = analyzer.column_store.gather(
+            dataset_sub_names, row_indexes, encoded=True)
+        surrogate = create_surrogate_model(analyzer,
+                                           dataset_sub_features,
+                                           diff,
+                                           max_depth,
+                                           num_leaves,
+                                           cat_ind_reindexed,
+                                           n_jobs=n_jobs)
+        leaf_index = get_leaf_index(surrogate, dataset_sub_features)
+        dumped_model = surrogate._Booster.dump_model()
+        tree_structure = dumped_model["tree_info"][0]['tree_structure']
+        tree_arrays = flatten_tree(tree_structure)
+    node_stats = compute_node_statistics(tree_arrays,
+                                         leaf_index,
+                                         true_y,
+                                         pred_y,
+                                         analyzer.model_task)
+    return ErrorTree(tree_arrays,
+                     (categories_reindexed, cat_ind_reindexed),
+                     dataset_sub_names,
+                     node_stats,
+                     analyzer.model_task)
+
+
+def iter_cohort_error_tree(analyzer,
+                           features,
+                           row_indexes,
+                           metric,
+                           max_depth=DEFAULT_MAX_DEPTH,
+                           num_leaves=DEFAULT_NUM_LEAVES,
+                           max_nodes=None):
+    """Fits the surrogate error tree of a cohort and yields it by level.
+
+    With the histogram tree builder the tree is grown level by level,
+    and the json nodes of each depth are yielded as soon as the depth
+    is grown, before the deeper levels are fitted.  The lightgbm
+    surrogate is fitted in one go before the first level is yielded.
+
+    :param analyzer: The error analyzer.
+    :type analyzer: BaseAnalyzer
+    :param features: The features to train the surrogate tree on.
+    :type features: list[str]
+    :param row_indexes: The row indexes of the cohort.
+    :type row_indexes: numpy.ndarray
+    :param metric: The metric to compute at each node.
+    :type metric: str
+    :param max_depth: The maximum depth of the surrogate tree.
+    :type max_depth: int
+    :param num_leaves: The number of leaves of the surrogate tree.
+    :type num_leaves: int
+    :param max_nodes: The maximum number of nodes of a chunk, or None
+        to yield each level in a single chunk.
+    :type max_nodes: int
+    :return: The chunks of json nodes, then the fitted error tree as
+        the return value of the generator.
+    :rtype: Generator[list[dict], None, ErrorTree]
+    """
+    validate_max_nodes(max_nodes)
+    if analyzer.tree_builder != TreeBuilder.HISTOGRAM:
+        error_tree = fit_cohort_error_tree(analyzer,
+                                           features,
+                                           row_indexes,
+                                           max_depth=max_depth,
+                                           num_leaves=num_leaves)
+        yield from error_tree.iter_json(metric, max_nodes=max_nodes)
+        return error_tree
+    if max_depth is None:
+        max_depth = DEFAULT_MAX_DEPTH
+    if num_leaves is None:
+        num_leaves = DEFAULT_NUM_LEAVES
+    true_y, pred_y, diff = get_cohort_errors(analyzer, row_indexes)
+    dataset_sub_names = list(features)
+    cat_ind_reindexed, categories_reindexed = get_categorical_info(
+        analyzer, dataset_sub_names)
+    categories = (categories_reindexed, cat_ind_reindexed)
+    feature_bins = [analyzer.get_tree_bins(feature)
+                    for feature in dataset_sub_names]
+    json_of_node = {}
+    for depth, tree_arrays, leaf_index in iter_histogram_tree(
+            feature_bins, row_indexes, diff, max_depth, num_leaves):
+        positions = np.flatnonzero(tree_arrays.depth == depth)
+        level_stats = compute_node_statistics(tree_arrays,
+                                              leaf_index,
+                                              true_y,
+                                              pred_y,
+                                              analyzer.model_task,
+                                              positions=positions)
+        node_summaries = get_node_summaries(level_stats,
+                                            analyzer.model_task,
+                                            metric)
+        level = tree_to_json(tree_arrays,
+                             categories,
+                             dataset_sub_names,
+                             node_summaries,
+                             metric,
+                             positions=positions)
+        for node_id, node in zip(tree_arrays.node_id[positions], level):
+            json_of_node[node_id] = node
+        yield from iter_chunks([dict(node) for node in level], max_nodes)
+    node_stats = compute_node_statistics(tree_arrays,
+                                         leaf_index,
+                                         true_y,
+                                         pred_y,
+                                         analyzer.model_task)
+    error_tree = ErrorTree(tree_arrays,
+                           categories,
+                           dataset_sub_names,
+                           node_stats,
+                           analyzer.model_task)
+    # the streamed nodes are the json of the final tree
+    error_tree._json[metric] = [json_of_node[node_id]
+                                for node_id in tree_arrays.node_id]
+    return error_tree
+
+
+def get_cohort_errors(analyzer, row_indexes):
+    """Returns the labels of a cohort and the errors to fit a tree on.
+
+    :param analyzer: The error analyzer.
+    :type analyzer: BaseAnalyzer
+    :param row_indexes: The row indexes of the cohort.
+    :type row_indexes: numpy.ndarray
+    :return: The true labels, the predicted labels and the error of
+        each row, whether the prediction is wrong for classification
+        or the residual for regression.
+    :rtype: tuple[numpy.ndarray]
+    """
+    true_y = analyzer.column_store.take(analyzer.true_y, row_indexes)
+    pred_y = analyzer.get_cohort_pred_y(row_indexes)
     if analyzer.model_task == ModelTask.CLASSIFICATION:
         diff = pred_y != true_y
     else:
         diff = pred_y - true_y
-    if not isinstance(diff, np.ndarray):
-        diff = np.array(diff)
-    if not isinstance(pred_y, np.ndarray):
-        pred_y = np.array(pred_y)
-    if not isinstance(true_y, np.ndarray):
-        true_y = np.array(true_y)
-    indexes = []
-    for feature in features:
-        indexes.append(analyzer.feature_names.index(feature))
-    if is_pandas:
-        input_data = input_data.to_numpy()
+    return true_y, pred_y, diff
 
-    if analyzer.categorical_features:
-        # Inplace replacement of columns
-        for idx, c_i in enumerate(analyzer.categorical_indexes):
-            input_data[:, c_i] = analyzer.string_indexed_data[row_index, idx]
-    dataset_sub_features = input_data[:, indexes]
-    dataset_sub_names = np.array(analyzer.feature_names)[np.array(indexes)]
-    dataset_sub_names = list(dataset_sub_names)
 
-    categorical_info = get_categorical_info(analyzer,
-                                            dataset_sub_names)
-    cat_ind_reindexed, categories_reindexed = categorical_info
+def validate_max_nodes(max_nodes):
+    if max_nodes is not None and max_nodes < 1:
+        raise ValueError("max_nodes must be a positive integer")
+
+
+def iter_chunks(nodes, max_nodes):
+    # split the json nodes of a level into chunks of at most max_nodes
+    step = len(nodes) if max_nodes is None else max_nodes
+    for start in range(0, len(nodes), step):
+        yield nodes[start:start + step]
+
+
+class ErrorTree(object):
+    """Surrogate error tree with the metric statistics of its nodes.
 
-    surrogate = create_surrogate_model(analyzer,
-                                       dataset_sub_features,
-                                       diff,
-                                       max_depth,
-                                       num_leaves,
-                                       cat_ind_reindexed)
-
-    filtered_indexed_df = pd.DataFrame(dataset_sub_features,
-                                       columns=dataset_sub_names)
-    filtered_indexed_df[DIFF] = diff
-    filtered_indexed_df[TRUE_Y] = true_y
-    filtered_indexed_df[PRED_Y] = pred_y
-    dumped_model = surrogate._Booster.dump_model()
-    tree_structure = dumped_model["tree_info"][0]['tree_structure']
-    max_split_index = get_max_split_index(tree_structure) + 1
-    tree = traverse(filtered_indexed_df,
-                    tree_structure,
-                    max_split_index,
-                    (categories_reindexed,
-                     cat_ind_reindexed),
-                    [],
-                    dataset_sub_names,
-                    metric=analyzer.metric)
-    return tree
+    The nodes carry the sufficient statistics of every supported metric,
+    so the json tree can be projected onto any metric without fitting
+    the surrogate model or visiting the rows again.  The tree is kept as
+    arrays and only converted to json nodes when requested.
+
+    :param tree_arrays: The nodes of the tree.
+    :type tree_arrays: TreeArrays
+    :param categories: The categories and indexes of the categorical
+        features.
+    :type categories: tuple[list]
+    :param feature_names: The names of the features of the tree.
+    :type feature_names: list[str]
+    :param node_stats: The metric statistics of each node, aligned with
+        the tree arrays.
+    :type node_stats: MetricStatistics
+    :param model_task: The model task, classification or regression.
+    :type model_task: str
+    """
+
+    def __init__(self, tree_arrays, categories, feature_names,
+                 node_stats, model_task):
+        self.tree_arrays = tree_arrays
+        self.categories = categories
+        self.feature_names = feature_names
+        self.node_stats = node_stats
+        self.model_task = model_task
+        self._json = {}
+
+    def to_json(self, metric):
+        """Returns the json nodes of the tree for the given metric.
+
+        The json nodes are memoized per metric, and a copy of the nodes
+        is returned so callers can modify them.
+
+        :param metric: The metric to compute at each node.
+        :type metric: str
+        :return: The json nodes of the tree.
+        :rtype: list[dict]
+        """
+        json = self._json.get(metric)
+        if json is None:
+            node_summaries = get_node_summaries(self.node_stats,
+                                                self.model_task,
+                                                metric)
+            json = tree_to_json(self.tree_arrays,
+                                self.categories,
+                                self.feature_names,
+                                node_summaries,
+                                metric)
+            self._json[metric] = json
+        return [dict(node) for node in json]
+
+    def iter_json(self, metric, max_nodes=None):
+        """Yields the json nodes of the tree level by level.
+
+        The nodes are yielded in chunks of a single depth, from the root
+        down, so a node always comes after its parent and the top of the
+        tree can be rendered before the deeper levels are received.  The
+        nodes of a depth are only serialized when its first chunk is
+        requested.
+
+        :param metric: The metric to compute at each node.
+        :type metric: str
+        :param max_nodes: The maximum number of nodes of a chunk, or None
+            to yield each level in a single chunk.
+        :type max_nodes: int
+        :return: The chunks of json nodes.
+        :rtype: Iterator[list[dict]]
+        """
+        validate_max_nodes(max_nodes)
+        json = self._json.get(metric)
+        node_summaries = None
+        if json is None:
+            json = [None] * len(self.tree_arrays)
+            node_summaries = get_node_summaries(self.node_stats,
+                                                self.model_task,
+                                                metric)
+        depth = self.tree_arrays.depth
+        for level in range(int(depth.max()) + 1):
+            positions = np.flatnonzero(depth == level)
+            if node_summaries is not None:
+                level_json = tree_to_json(
+                    self.tree_arrays,
+                    self.categories,
+                    self.feature_names,
+                    [summary[positions] for summary in node_summaries],
+                    metric,
+                    positions=positions)
+                for position, node in zip(positions, level_json):
+                    json[position] = node
+            nodes = [dict(json[position]) for position in positions]
+            yield from iter_chunks(nodes, max_nodes)
+        if node_summaries is not None:
+            self._json[metric] = json
 
 
 def create_surrogate_model(analyzer,
@@ -161,7 +401,8 @@ def create_surrogate_model(analyzer,
                            diff,
                            max_depth,
                            num_leaves,
-                           cat_ind_reindexed):
+                           cat_ind_reindexed,
+                           n_jobs=None):
     """Creates and fits the surrogate lightgbm model.
 
     :param analyzer: The error analyzer containing the categorical
@@ -180,17 +421,25 @@ def create_surrogate_model(analyzer,
     :type num_leaves: int
     :param cat_ind_reindexed: The list of categorical feature indexes.
     :type cat_ind_reindexed: list[int]
+    :param n_jobs: The number of threads of the surrogate model, or None
+        for the lightgbm default.
+    :type n_jobs: int
     :return: The trained surrogate model.
     :rtype: LGBMClassifier or LGBMRegressor
     """
+    params = {}
+    if n_jobs is not None:
+        params['n_jobs'] = n_jobs
     if analyzer.model_task == ModelTask.CLASSIFICATION:
         surrogate = LGBMClassifier(n_estimators=1,
                                    max_depth=max_depth,
-                                   num_leaves=num_leaves)
+                                   num_leaves=num_leaves,
+                                   **params)
     else:
         surrogate = LGBMRegressor(n_estimators=1,
                                   max_depth=max_depth,
-                                  num_leaves=num_leaves)
+                                  num_leaves=num_leaves,
+                                  **params)
     if cat_ind_reindexed:
         surrogate.fit(dataset_sub_features, diff,
                       categorical_feature=cat_ind_reindexed)
@@ -225,54 +474,8 @@ def get_categorical_info(analyzer, dataset_sub_names):
     return (cat_ind_reindexed, categories_reindexed)
 
 
-def get_max_split_index(tree):
-    if SPLIT_INDEX in tree:
-        max_index = tree[SPLIT_INDEX]
-        index1 = get_max_split_index(tree[TreeSide.LEFT_CHILD])
-        index2 = get_max_split_index(tree[TreeSide.RIGHT_CHILD])
-        return max(max(max_index, index1), index2)
-    else:
-        return 0
-
-
-def traverse(df,
-             tree,
-             max_split_index,
-             categories,
-             dict,
-             feature_names,
-             parent=None,
-             side=TreeSide.UNKNOWN,
-             metric=None):
-    if SPLIT_INDEX in tree:
-        nodeid = tree[SPLIT_INDEX]
-    elif LEAF_INDEX in tree:
-        nodeid = max_split_index + tree[LEAF_INDEX]
-    else:
-        nodeid = 0
-
-    # write current node to a dictionary that can be saved as json
-    dict, df = node_to_dict(df, tree, nodeid, categories, dict,
-                            feature_names, metric, parent, side)
-
-    # write children to a dictionary that can be saved as json
-    if 'leaf_value' not in tree:
-        left_child = tree[TreeSide.LEFT_CHILD]
-        right_child = tree[TreeSide.RIGHT_CHILD]
-        dict = traverse(df, left_child, max_split_index,
-                        categories, dict, feature_names,
-                        tree, TreeSide.LEFT_CHILD, metric)
-        dict = traverse(df, right_child, max_split_index,
-                        categories, dict, feature_names,
-                        tree, TreeSide.RIGHT_CHILD, metric)
-    return dict
-
-
-def create_categorical_arg(parent_threshold):
-    return [float(i) for i in parent_threshold.split('||')]
-
-
-def create_categorical_query(method, arg, p_node_name, parent, categories):
+def create_categorical_condition(method, arg, p_node_name, split_feature,
+                                 categories):
     if method == METHOD_INCLUDES:
         operation = "=="
     else:
@@ -280,7 +483,7 @@ def create_categorical_query(method, arg, p_node_name, parent, categories):
     categorical_values = categories[0]
     categorical_indexes = categories[1]
     thresholds = []
-    catcoli = categorical_indexes.index(parent[SPLIT_FEATURE])
+    catcoli = categorical_indexes.index(split_feature)
     catvals = categorical_values[catcoli]
     for argi in arg:
         encoded_val = catvals[int(argi)]
@@ -288,108 +491,55 @@ def create_categorical_query(method, arg, p_node_name, parent, categories):
             encoded_val = str(encoded_val)
         thresholds.append(encoded_val)
     threshold_str = " | ".join(thresholds)
-    condition = "{} {} {}".format(p_node_name, operation, threshold_str)
-    query = []
-    for argi in arg:
-        query.append("`" + p_node_name + "` " + operation + " " + str(argi))
-    if method == METHOD_INCLUDES:
-        query = " | ".join(query)
-    else:
-        query = " & ".join(query)
-    return query, condition
-
-
-def node_to_dict(df, tree, nodeid, categories, json,
-                 feature_names, metric, parent=None,
-                 side=TreeSide.UNKNOWN):
-    p_node_name = None
-    condition = None
-    arg = None
-    method = None
-    parentid = None
-    if parent is not None:
-        parentid = int(parent[SPLIT_INDEX])
-        p_node_name = feature_names[parent[SPLIT_FEATURE]]
-        parent_threshold = parent['threshold']
-        parent_decision_type = parent['decision_type']
-        if side == TreeSide.LEFT_CHILD:
-            if parent_decision_type == '<=':
-                method = "less and equal"
-                arg = float(parent_threshold)
-                condition = "{} <= {:.2f}".format(p_node_name,
-                                                  parent_threshold)
-                query = "`" + p_node_name + "` <= " + str(parent_threshold)
-                df = df.query(query)
-            elif parent_decision_type == '==':
-                method = METHOD_INCLUDES
-                arg = create_categorical_arg(parent_threshold)
-                query, condition = create_categorical_query(method,
-                                                            arg,
-                                                            p_node_name,
-                                                            parent,
-                                                            categories)
-                df = df.query(query)
-        elif side == TreeSide.RIGHT_CHILD:
-            if parent_decision_type == '<=':
-                method = "greater"
-                arg = float(parent_threshold)
-                condition = "{} > {:.2f}".format(p_node_name,
-                                                 parent_threshold)
-                query = "`" + p_node_name + "` > " + str(parent_threshold)
-                df = df.query(query)
-            elif parent_decision_type == '==':
-                method = METHOD_EXCLUDES
-                arg = create_categorical_arg(parent_threshold)
-                query, condition = create_categorical_query(method,
-                                                            arg,
-                                                            p_node_name,
-                                                            parent,
-                                                            categories)
-                df = df.query(query)
-    success = 0
-    total = df.shape[0]
-    if df.shape[0] == 0 and metric != Metrics.ERROR_RATE:
-        metric_value = 0
-        error = 0
-        success = 0
-    elif metric == Metrics.MEAN_ABSOLUTE_ERROR:
-        pred_y, true_y, error = get_regression_metric_data(df)
-        metric_value = mean_absolute_error(pred_y, true_y)
-    elif metric == Metrics.MEAN_SQUARED_ERROR:
-        pred_y, true_y, error = get_regression_metric_data(df)
-        metric_value = mean_squared_error(pred_y, true_y)
-    elif metric == Metrics.MEDIAN_ABSOLUTE_ERROR:
-        pred_y, true_y, error = get_regression_metric_data(df)
-        metric_value = median_absolute_error(pred_y, true_y)
-    elif metric == Metrics.R2_SCORE:
-        pred_y, true_y, error = get_regression_metric_data(df)
-        metric_value = r2_score(pred_y, true_y)
-    elif metric == Metrics.F1_SCORE:
-        pred_y, true_y, error = get_classification_metric_data(df)
-        metric_value = f1_score(pred_y, true_y)
-        success = total - error
-    elif metric == Metrics.PRECISION_SCORE:
-        pred_y, true_y, error = get_classification_metric_data(df)
-        metric_value = precision_score(pred_y, true_y)
-        success = total - error
-    elif metric == Metrics.RECALL_SCORE:
-        pred_y, true_y, error = get_classification_metric_data(df)
-        metric_value = recall_score(pred_y, true_y)
-        success = total - error
-    else:
-        error = df[DIFF].values.sum()
-        if total == 0:
-            metric_value = 0
+    return "{} {} {}".format(p_node_name, operation, threshold_str)
+
+
+def get_split_condition(tree_arrays, position, categories, feature_names):
+    """Returns the split condition of the parent leading to a node.
+
+    :param tree_arrays: The nodes of the tree.
+    :type tree_arrays: TreeArrays
+    :param position: The position of the node in the tree arrays.
+    :type position: int
+    :param categories: The categories and indexes of the categorical
+        features.
+    :type categories: tuple[list]
+    :param feature_names: The names of the features of the tree.
+    :type feature_names: list[str]
+    :return: The parent id and feature name, the filter method and
+        argument and the display condition of the split.
+    :rtype: tuple
+    """
+    parent = tree_arrays.parent[position]
+    if parent == NO_NODE:
+        return None, None, None, None, None
+    parentid = int(tree_arrays.node_id[parent])
+    split_feature = int(tree_arrays.feature[parent])
+    p_node_name = feature_names[split_feature]
+    is_left = tree_arrays.left[parent] == position
+    left_categories = tree_arrays.left_categories[parent]
+    if left_categories is None:
+        arg = float(tree_arrays.threshold[parent])
+        if is_left:
+            method = METHOD_LESS_AND_EQUAL
+            condition = "{} <= {:.2f}".format(p_node_name, arg)
         else:
-            metric_value = error / total
-        success = total - error
+            method = METHOD_GREATER
+            condition = "{} > {:.2f}".format(p_node_name, arg)
+    else:
+        arg = [float(category) for category in left_categories]
+        method = METHOD_INCLUDES if is_left else METHOD_EXCLUDES
+        condition = create_categorical_condition(method, arg, p_node_name,
+                                                 split_feature, categories)
+    return parentid, p_node_name, method, arg, condition
+
+
+def create_node_json(node_name, nodeid, metric, parent_condition,
+                     total, error, success, metric_value):
+    parentid, p_node_name, method, arg, condition = parent_condition
     metric_name = metric_to_display_name[metric]
     is_error_metric = metric in error_metrics
-    if SPLIT_FEATURE in tree:
-        node_name = feature_names[tree[SPLIT_FEATURE]]
-    else:
-        node_name = None
-    json.append({
+    return {
         "arg": arg,
         "badFeaturesRowCount": 0,  # Note: remove this eventually
         "condition": condition,
@@ -407,20 +557,144 @@ def node_to_dict(df, tree, nodeid, categories, json,
         "metricName": metric_name,
         "metricValue": float(metric_value),
         "isErrorMetric": is_error_metric
-    })
-    return json, df
+    }
 
 
-def get_regression_metric_data(df):
-    pred_y = df[PRED_Y]
-    true_y = df[TRUE_Y]
-    # total abs error at the node
-    error = sum(abs(pred_y - true_y))
-    return pred_y, true_y, error
+def get_leaf_index(surrogate, dataset_sub_features):
+    """Returns the leaf of the surrogate tree each row falls into.
 
-
-def get_classification_metric_data(df):
-    pred_y = df[PRED_Y]
-    true_y = df[TRUE_Y]
-    error = df[DIFF].values.sum()
-    return pred_y, true_y, error
+    :param surrogate: The trained surrogate model.
+    :type surrogate: LGBMClassifier or LGBMRegressor
+    :param dataset_sub_features: The features the surrogate was
+        trained on.
+    :type dataset_sub_features: numpy.ndarray
+    :return: The leaf index of each row.
+    :rtype: numpy.ndarray
+    """
+    leaf_index = surrogate.predict(dataset_sub_features, pred_leaf=True)
+    leaf_index = np.asarray(leaf_index, dtype=int)
+    return leaf_index.reshape(len(dataset_sub_features), -1)[:, 0]
+
+
+def compute_node_statistics(tree_arrays, leaf_index, true_y, pred_y,
+                            model_task, positions=None):
+    """Computes the metric statistics of every node of the tree.
+
+    The statistics are aggregated per leaf in a single pass over the
+    rows and rolled up from the leaves to the internal nodes.  For
+    regression, the median absolute error of each node is computed too,
+    so that every supported metric can be derived from the statistics.
+
+    :param tree_arrays: The nodes of the tree.
+    :type tree_arrays: TreeArrays
+    :param leaf_index: The leaf index of each row.
+    :type leaf_index: numpy.ndarray
+    :param true_y: The true labels of the rows.
+    :type true_y: numpy.ndarray
+    :param pred_y: The predicted labels of the rows.
+    :type pred_y: numpy.ndarray
+    :param model_task: The model task, classification or regression.
+    :type model_task: str
+    :param positions: The positions of the nodes to compute, or None
+        for every node of the tree.
+    :type positions: numpy.ndarray
+    :return: The metric statistics of each node, aligned with the tree
+        arrays or with the given positions.
+    :rtype: MetricStatistics
+    """
+    if positions is None:
+        positions = np.arange(len(tree_arrays))
+    num_leaves = tree_arrays.num_leaves
+    # the leaf indexes of the leaves, ranked in pre-order
+    leaves = tree_arrays.leaf_index[tree_arrays.is_leaf]
+    start, stop = tree_arrays.leaf_ranges()
+    leaf_rank = np.arange(num_leaves)
+    start = start[positions]
+    stop = stop[positions]
+    membership = np.zeros((len(positions), num_leaves), dtype=int)
+    membership[:, leaves] = (leaf_rank >= start[:, None]) & \
+        (leaf_rank < stop[:, None])
+    # Note: the metrics of the tree nodes have always been computed
+    # with the true and predicted labels swapped, keep them unchanged
+    leaf_stats = compute_metric_statistics(leaf_index, num_leaves,
+                                           pred_y, true_y, model_task)
+    node_stats = leaf_stats.aggregate(membership)
+    if model_task != ModelTask.CLASSIFICATION:
+        # the nodes at the same depth hold disjoint ranges of leaves
+        median = np.full(len(positions), np.nan)
+        abs_error = np.abs(pred_y - true_y)
+        rank_of_leaf = np.empty(num_leaves, dtype=int)
+        rank_of_leaf[leaves] = leaf_rank
+        row_rank = rank_of_leaf[leaf_index]
+        node_depth = tree_arrays.depth[positions]
+        for depth in np.unique(node_depth):
+            in_level = np.flatnonzero(node_depth == depth)
+            group = np.searchsorted(start[in_level], row_rank,
+                                    side='right') - 1
+            in_depth = (group >= 0) & \
+                (row_rank < stop[in_level][np.maximum(group, 0)])
+            median[in_level] = group_median(group[in_depth],
+                                            abs_error[in_depth],
+                                            node_stats.count[in_level])
+        node_stats.median_abs_error = median
+    return node_stats
+
+
+def tree_to_json(tree_arrays, categories, feature_names, node_summaries,
+                 metric, positions=None):
+    """Writes the nodes of the tree with precomputed statistics to json.
+
+    :param tree_arrays: The nodes of the tree.
+    :type tree_arrays: TreeArrays
+    :param categories: The categories and indexes of the categorical
+        features.
+    :type categories: tuple[list]
+    :param feature_names: The names of the features of the tree.
+    :type feature_names: list[str]
+    :param node_summaries: The total, error, success and metric value
+        of each node, aligned with the tree arrays or with the given
+        positions.
+    :type node_summaries: tuple[numpy.ndarray]
+    :param metric: The metric of the tree.
+    :type metric: str
+    :param positions: The positions of the nodes to write, or None for
+        every node of the tree.
+    :type positions: numpy.ndarray
+    :return: The json nodes in pre-order, or in the order of the given
+        positions.
+    :rtype: list[dict]
+    """
+    if positions is None:
+        positions = range(len(tree_arrays))
+    node_ids = tree_arrays.node_id
+    json = []
+    for index, position in enumerate(positions):
+        feature = tree_arrays.feature[position]
+        node_name = None if feature == NO_NODE else feature_names[feature]
+        parent_condition = get_split_condition(tree_arrays, position,
+                                               categories, feature_names)
+        json.append(create_node_json(node_name, node_ids[position], metric,
+                                     parent_condition,
+                                     *[summary[index]
+                                       for summary in node_summaries]))
+    return json
+
+
+def get_node_summaries(node_stats, model_task, metric):
+    total = node_stats.count
+    if model_task == ModelTask.CLASSIFICATION:
+        error = node_stats.error_count
+        success = total - error
+    else:
+        error = node_stats.sum_abs_error
+        success = np.zeros(len(total))
+    if metric == Metrics.ERROR_RATE:
+        metric_value = np.where(total == 0, 0, node_stats.error_count /
+                                np.maximum(total, 1))
+    else:
+        metric_value = node_stats.metric_value(metric)
+        is_empty = total == 0
+        metric_value = np.where(is_empty, 0, metric_value)
+        error = np.where(is_empty, 0, error)
+        success = np.where(is_empty, 0, success)
+    return total, error, success, metric_value
@@ -0,0 +1,240 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+import numpy as np
+from erroranalysis._internal.constants import (SPLIT_INDEX,
+                                               SPLIT_FEATURE,
+                                               LEAF_INDEX)
+
+LEFT_CHILD = 'left_child'
+RIGHT_CHILD = 'right_child'
+THRESHOLD = 'threshold'
+DECISION_TYPE = 'decision_type'
+NO_NODE = -1
+
+
+class TreeArrays(object):
+    """Surrogate error tree stored as a structure of arrays.
+
+    The nodes are stored in depth first pre-order, which is the order of
+    the json nodes of the dashboard, and nodes refer to their parent and
+    children by position in the arrays, with -1 for no node.  Since the
+    nodes are in pre-order, the subtree of the node at position i spans
+    the positions i to i + subtree_size[i].
+
+    :param split_index: The index of each split node in the order the
+        splits were made, -1 for leaves.
+    :type split_index: numpy.ndarray
+    :param leaf_index: The leaf index of each leaf, -1 for split nodes.
+    :type leaf_index: numpy.ndarray
+    :param feature: The feature of each split, -1 for leaves.
+    :type feature: numpy.ndarray
+    :param threshold: The threshold of each numeric split, NaN for
+        categorical splits and leaves.
+    :type threshold: numpy.ndarray
+    :param left_categories: The encoded categories going to the left
+        child of each categorical split, None for other nodes.
+    :type left_categories: list[numpy.ndarray]
+    :param parent: The position of the parent of each node.
+    :type parent: numpy.ndarray
+    :param left: The position of the left child of each node.
+    :type left: numpy.ndarray
+    :param right: The position of the right child of each node.
+    :type right: numpy.ndarray
+    :param depth: The depth of each node.
+    :type depth: numpy.ndarray
+    :param node_id: The dashboard id of each node, or None to number
+        the nodes as in the lightgbm tree dump.
+    :type node_id: numpy.ndarray
+    """
+
+    def __init__(self, split_index, leaf_index, feature, threshold,
+                 left_categories, parent, left, right, depth,
+                 node_id=None):
+        self.split_index = split_index
+        self.leaf_index = leaf_index
+        self.feature = feature
+        self.threshold = threshold
+        self.left_categories = left_categories
+        self.parent = parent
+        self.left = left
+        self.right = right
+        self.depth = depth
+        self._node_id = node_id
+        self._subtree_size = None
+
+    def __len__(self):
+        return len(self.parent)
+
+    @property
+    def is_leaf(self):
+        return self.left == NO_NODE
+
+    @property
+    def num_splits(self):
+        return int(np.sum(~self.is_leaf))
+
+    @property
+    def num_leaves(self):
+        return len(self) - self.num_splits
+
+    @property
+    def node_id(self):
+        """The dashboard id of each node.
+
+        Unless given explicitly, the ids are those of the lightgbm tree
+        dump: split nodes are numbered by their split index, followed by
+        the leaves numbered by their leaf index.
+
+        :return: The id of each node.
+        :rtype: numpy.ndarray
+        """
+        if self._node_id is None:
+            self._node_id = np.where(self.is_leaf,
+                                     self.num_splits + self.leaf_index,
+                                     self.split_index)
+        return self._node_id
+
+    @property
+    def subtree_size(self):
+        """The number of nodes of the subtree rooted at each node.
+
+        :return: The subtree size of each node.
+        :rtype: numpy.ndarray
+        """
+        if self._subtree_size is None:
+            size = np.ones(len(self), dtype=int)
+            # children always come after their parent in pre-order
+            for position in range(len(self) - 1, 0, -1):
+                size[self.parent[position]] += size[position]
+            self._subtree_size = size
+        return self._subtree_size
+
+    def leaf_ranges(self):
+        """Returns the range of leaves under each node.
+
+        The leaves are ranked in pre-order, so the leaves under a node
+        are those with a rank from start to stop, excluded.
+
+        :return: The start and stop leaf ranks of each node.
+        :rtype: tuple[numpy.ndarray, numpy.ndarray]
+        """
+        leaf_rank = np.concatenate([[0], np.cumsum(self.is_leaf)])
+        positions = np.arange(len(self))
+        return (leaf_rank[positions],
+                leaf_rank[positions + self.subtree_size])
+
+    def is_left_child(self, position):
+        parent = self.parent[position]
+        return parent != NO_NODE and self.left[parent] == position
+
+
+def create_tree_arrays(split_index, leaf_index, feature, threshold,
+                       left_categories, left, right, node_id=None):
+    """Sorts the nodes of a tree into pre-order tree arrays.
+
+    The nodes may be given in any order as long as the root comes first,
+    with the children referring to the given order.
+
+    :param split_index: The split index of each node, -1 for leaves.
+    :type split_index: list[int]
+    :param leaf_index: The leaf index of each node, -1 for splits.
+    :type leaf_index: list[int]
+    :param feature: The feature of each node, -1 for leaves.
+    :type feature: list[int]
+    :param threshold: The threshold of each node, NaN if not numeric.
+    :type threshold: list[float]
+    :param left_categories: The encoded categories going left at each
+        node, None if not categorical.
+    :type left_categories: list[numpy.ndarray]
+    :param left: The left child of each node, -1 for leaves.
+    :type left: list[int]
+    :param right: The right child of each node, -1 for leaves.
+    :type right: list[int]
+    :param node_id: The dashboard id of each node, or None to number
+        the nodes as in the lightgbm tree dump.
+    :type node_id: list[int]
+    :return: The tree arrays in pre-order.
+    :rtype: TreeArrays
+    """
+    order = []
+    parent = []
+    depth = []
+    stack = [(0, NO_NODE, 0)]
+    while stack:
+        node, parent_position, node_depth = stack.pop()
+        position = len(order)
+        order.append(node)
+        parent.append(parent_position)
+        depth.append(node_depth)
+        if left[node] != NO_NODE:
+            stack.append((right[node], position, node_depth + 1))
+            stack.append((left[node], position, node_depth + 1))
+    order = np.array(order, dtype=int)
+    position_of = np.empty(len(order), dtype=int)
+    position_of[order] = np.arange(len(order))
+    left = np.asarray(left, dtype=int)[order]
+    right = np.asarray(right, dtype=int)[order]
+    is_split = left != NO_NODE
+    left = np.where(is_split, position_of[left], NO_NODE)
+    right = np.where(is_split, position_of[right], NO_NODE)
+    if node_id is not None:
+        node_id = np.asarray(node_id, dtype=int)[order]
+    return TreeArrays(np.asarray(split_index, dtype=int)[order],
+                      np.asarray(leaf_index, dtype=int)[order],
+                      np.asarray(feature, dtype=int)[order],
+                      np.asarray(threshold, dtype=float)[order],
+                      [left_categories[node] for node in order],
+                      np.array(parent, dtype=int),
+                      left,
+                      right,
+                      np.array(depth, dtype=int),
+                      node_id=node_id)
+
+
+def flatten_tree(tree_structure):
+    """Converts the nested lightgbm tree dump into tree arrays.
+
+    :param tree_structure: The root of the dumped lightgbm tree.
+    :type tree_structure: dict
+    :return: The tree arrays.
+    :rtype: TreeArrays
+    """
+    split_index = []
+    leaf_index = []
+    feature = []
+    threshold = []
+    left_categories = []
+    left = []
+    right = []
+    # pairs of the dumped node and the slot of its parent to fill in
+    stack = [(tree_structure, None)]
+    while stack:
+        node, parent_slot = stack.pop()
+        position = len(split_index)
+        if parent_slot is not None:
+            parent_slot[0][parent_slot[1]] = position
+        left.append(NO_NODE)
+        right.append(NO_NODE)
+        if SPLIT_INDEX in node:
+            split_index.append(node[SPLIT_INDEX])
+            leaf_index.append(NO_NODE)
+            feature.append(node[SPLIT_FEATURE])
+            if node[DECISION_TYPE] == '==':
+                threshold.append(np.nan)
+                left_categories.append(np.array(
+                    [int(float(category)) for category in
+                     str(node[THRESHOLD]).split('||')], dtype=int))
+            else:
+                threshold.append(float(node[THRESHOLD]))
+                left_categories.append(None)
+            stack.append((node[RIGHT_CHILD], (right, position)))
+            stack.append((node[LEFT_CHILD], (left, position)))
+        else:
+            split_index.append(NO_NODE)
+            leaf_index.append(node.get(LEAF_INDEX, 0))
+            feature.append(NO_NODE)
+            threshold.append(np.nan)
+            left_categories.append(None)
+    return create_tree_arrays(split_index, leaf_index, feature, threshold,
+                              left_categories, left, right)
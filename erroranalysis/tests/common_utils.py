@@ -152,6 +152,39 @@ def create_simple_titanic_data():
     return X_train, X_test, y_train, y_test, num_features, cat_features
 
 
+def create_synthetic_categorical_data(num_rows=500):
+    rng = np.random.RandomState(777)
+    colors = np.array(['red', 'green', 'blue', 'yellow'])
+    sizes = np.array(['small', 'medium', 'large'])
+    X = pd.DataFrame({
+        'color': colors[rng.randint(0, len(colors), num_rows)],
+        'size': sizes[rng.randint(0, len(sizes), num_rows)],
+        'weight': rng.normal(50, 10, num_rows),
+        'height': rng.normal(170, 20, num_rows)
+    })
+    signal = (X['color'] == 'red').astype(int) + (X['weight'] > 55)
+    y = ((signal + rng.uniform(0, 1.5, num_rows)) > 1.25).astype(int).values
+    categorical_features = ['color', 'size']
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.5, random_state=7)
+    return X_train, X_test, y_train, y_test, categorical_features
+
+
+def create_categorical_pipeline(X_train, y_train, categorical_features):
+    numeric_features = [column for column in X_train.columns
+                        if column not in categorical_features]
+    transformations = ColumnTransformer([
+        ("categorical", OneHotEncoder(handle_unknown='ignore'),
+         categorical_features),
+        ("numeric", StandardScaler(), numeric_features)
+    ])
+    clf = Pipeline(steps=[('preprocessor', transformations),
+                          ('classifier',
+                           LogisticRegression(solver='lbfgs'))])
+    clf.fit(X_train, y_train)
+    return clf
+
+
 def create_boston_data():
     # Import Boston housing dataset
     boston = load_boston()
@@ -0,0 +1,69 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+from common_utils import create_iris_data, create_models_classification
+from erroranalysis._internal.batch_predictor import BatchPredictor
+from erroranalysis._internal.error_analyzer import ModelAnalyzer
+
+
+class TestBatchPredictor(object):
+
+    @pytest.mark.parametrize('num_workers', [1, 3])
+    def test_chunked_predictions_match(self, num_workers):
+        X_train, X_test, y_train, y_test, feature_names, _ = \
+            create_iris_data()
+        model = create_models_classification(X_train, y_train)[1]
+        predictor = BatchPredictor(chunk_size=7, num_workers=num_workers)
+        assert np.array_equal(predictor.predict(model.predict, X_test),
+                              model.predict(X_test))
+        assert np.allclose(predictor.predict(model.predict_proba, X_test),
+                           model.predict_proba(X_test))
+        X_test_df = pd.DataFrame(X_test, columns=feature_names)
+        assert np.array_equal(predictor.predict(model.predict, X_test_df),
+                              model.predict(X_test_df))
+
+    def test_process_pool_predictions_match(self, mocker):
+        X_train, X_test, y_train, y_test, feature_names, _ = \
+            create_iris_data()
+        model = create_models_classification(X_train, y_train)[1]
+        predictor = BatchPredictor(chunk_size=7, num_workers=2,
+                                   use_processes=True)
+        submit_spy = mocker.spy(ProcessPoolExecutor, 'submit')
+        assert np.array_equal(predictor.predict(model.predict, X_test),
+                              model.predict(X_test))
+        # only the row ranges are sent with each chunk
+        for call in submit_spy.call_args_list:
+            assert all(isinstance(arg, int) for arg in call[0][2:])
+        assert submit_spy.call_count == -(-len(X_test) // 7)
+
+    def test_chunk_sizes(self, mocker):
+        X_train, X_test, y_train, y_test, feature_names, _ = \
+            create_iris_data()
+        model = create_models_classification(X_train, y_train)[1]
+        predict_spy = mocker.spy(model, 'predict')
+        predictor = BatchPredictor(chunk_size=8)
+        predictor.predict(model.predict, X_test)
+        chunk_sizes = [len(call[0][0]) for call in
+                       predict_spy.call_args_list]
+        assert max(chunk_sizes) == 8
+        assert sum(chunk_sizes) == len(X_test)
+
+    def test_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            BatchPredictor(chunk_size=0)
+        with pytest.raises(ValueError):
+            BatchPredictor(num_workers=0)
+
+    def test_model_analyzer_predictor(self):
+        X_train, X_test, y_train, y_test, feature_names, _ = \
+            create_iris_data()
+        model = create_models_classification(X_train, y_train)[1]
+        predictor = BatchPredictor(chunk_size=10, num_workers=2)
+        analyzer = ModelAnalyzer(model, X_test, y_test, feature_names, [],
+                                 predictor=predictor)
+        assert np.array_equal(analyzer.pred_y, model.predict(X_test))
@@ -0,0 +1,99 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+import numpy as np
+from common_utils import create_iris_data, create_models_classification
+from erroranalysis._internal.cohort_cache import CohortCache
+from erroranalysis._internal.error_analyzer import ModelAnalyzer
+
+
+class TestCohortCache(object):
+
+    def test_lru_eviction_by_entries(self):
+        cache = CohortCache(max_entries=2)
+        cache.put('a', np.arange(3))
+        cache.put('b', np.arange(4))
+        assert cache.get('a') is not None
+        cache.put('c', np.arange(5))
+        assert 'a' in cache
+        assert 'b' not in cache
+        assert 'c' in cache
+        assert len(cache) == 2
+
+    def test_eviction_by_bytes(self):
+        row_indexes = np.arange(10)
+        cache = CohortCache(max_bytes=2 * row_indexes.nbytes)
+        cache.put('a', np.arange(10))
+        cache.put('b', np.arange(10))
+        cache.put('c', np.arange(10))
+        assert 'a' not in cache
+        assert cache.nbytes == 2 * row_indexes.nbytes
+        cache.put('large', np.arange(100))
+        assert 'large' not in cache
+
+    def test_hit_miss_counters_and_clear(self):
+        cache = CohortCache()
+        assert cache.get('a') is None
+        cache.put('a', np.arange(3))
+        assert cache.get('a').tolist() == [0, 1, 2]
+        assert cache.hits == 1
+        assert cache.misses == 1
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.nbytes == 0
+        assert cache.hits == 0
+        assert cache.misses == 0
+
+    def test_analyzer_reuses_cohort(self):
+        X_train, X_test, y_train, y_test, feature_names, _ = \
+            create_iris_data()
+        model = create_models_classification(X_train, y_train)[1]
+        analyzer = ModelAnalyzer(model, X_test, y_test, feature_names, [])
+        filters = [{'arg': [2.85],
+                    'column': feature_names[1],
+                    'method': 'less and equal'}]
+        reordered = [{'method': 'less and equal',
+                      'column': feature_names[1],
+                      'arg': [2.85]}]
+        analyzer.compute_matrix(feature_names[:2], filters, None)
+        analyzer.compute_error_tree(feature_names, reordered, [])
+        cache = analyzer.cohort_cache
+        assert cache.misses == 1
+        assert cache.hits == 1
+        analyzer.clear_cohort_cache()
+        assert len(analyzer.cohort_cache) == 0
+
+    def test_analyzer_refines_cached_parent_cohort(self, mocker):
+        X_train, X_test, y_train, y_test, feature_names, _ = \
+            create_iris_data()
+        model = create_models_classification(X_train, y_train)[1]
+        analyzer = ModelAnalyzer(model, X_test, y_test, feature_names, [])
+        parent_filters = [{'arg': [3.2],
+                           'column': feature_names[1],
+                           'method': 'less and equal'}]
+        child_filters = parent_filters + [{'arg': [5.5],
+                                           'column': feature_names[0],
+                                           'method': 'greater'}]
+        composite_filters = [{'compositeFilters':
+                              [{'arg': [1.0, 5.0],
+                                'column': feature_names[2],
+                                'method': 'in the range of'}],
+                              'operation': 'and'}]
+        parent_indexes = analyzer.compute_cohort_indexes(parent_filters,
+                                                         None)
+        subset_spy = mocker.spy(analyzer.column_store, 'subset')
+        child_indexes = analyzer.compute_cohort_indexes(child_filters,
+                                                        None)
+        subset_spy.assert_called_once_with(parent_indexes)
+        leaf_indexes = analyzer.compute_cohort_indexes(child_filters,
+                                                       composite_filters)
+        assert subset_spy.call_count == 2
+        assert np.array_equal(subset_spy.call_args[0][0], child_indexes)
+
+        expected = ModelAnalyzer(model, X_test, y_test, feature_names, [])
+        expected_child = expected.compute_cohort_indexes(child_filters,
+                                                         None)
+        expected_leaf = expected.compute_cohort_indexes(child_filters,
+                                                        composite_filters)
+        assert child_indexes.tolist() == expected_child.tolist()
+        assert leaf_indexes.tolist() == expected_leaf.tolist()
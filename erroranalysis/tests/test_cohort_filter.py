@@ -0,0 +1,134 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+import numpy as np
+import pandas as pd
+import pytest
+from common_utils import create_iris_data
+from erroranalysis._internal.cohort_filter import (
+    compile_filters, filter_from_cohort, get_filter_signature)
+from erroranalysis._internal.constants import ROW_INDEX, TRUE_Y
+
+
+def create_categorical_data():
+    colors = ['red', 'green', 'blue', 'red', 'blue', 'blue', 'green', 'red']
+    sizes = [1.5, 2.0, 7.5, 3.25, 9.0, 0.5, 4.0, 6.5]
+    X = pd.DataFrame({'color': colors, 'size': sizes})
+    y = np.array([0, 1, 1, 0, 1, 0, 1, 0])
+    categories = [sorted(set(colors))]
+    return X, y, ['color'], categories
+
+
+class TestCohortFilter(object):
+
+    def test_numeric_filters(self):
+        _, X_test, _, y_test, feature_names, _ = create_iris_data()
+        filters = [{'arg': [2.85],
+                    'column': feature_names[1],
+                    'method': 'less and equal'},
+                   {'arg': [5.0],
+                    'column': feature_names[0],
+                    'method': 'greater'}]
+        filtered = filter_from_cohort(X_test, filters, None,
+                                      feature_names, y_test, [], [])
+        expected = np.flatnonzero((X_test[:, 1] <= 2.85) &
+                                  (X_test[:, 0] > 5.0))
+        assert filtered[ROW_INDEX].tolist() == expected.tolist()
+        assert filtered[TRUE_Y].tolist() == y_test[expected].tolist()
+
+    def test_composite_filters(self):
+        _, X_test, _, y_test, feature_names, _ = create_iris_data()
+        composite_filters = [{'compositeFilters':
+                              [{'compositeFilters':
+                                [{'arg': [4.5, 5.0],
+                                  'column': feature_names[0],
+                                  'method': 'in the range of'}],
+                                'operation': 'and'},
+                               {'compositeFilters':
+                                [{'arg': [6.5, 7.0],
+                                  'column': feature_names[0],
+                                  'method': 'in the range of'}],
+                                'operation': 'and'}],
+                              'operation': 'or'}]
+        filtered = filter_from_cohort(X_test, None, composite_filters,
+                                      feature_names, y_test, [], [])
+        col = X_test[:, 0]
+        expected = np.flatnonzero(((col >= 4.5) & (col <= 5.0)) |
+                                  ((col >= 6.5) & (col <= 7.0)))
+        assert filtered[ROW_INDEX].tolist() == expected.tolist()
+
+    @pytest.mark.parametrize('method', ['includes', 'excludes'])
+    def test_categorical_filters(self, method):
+        X, y, categorical_features, categories = create_categorical_data()
+        filters = [{'arg': [0, 2],
+                    'column': 'color',
+                    'method': method}]
+        filtered = filter_from_cohort(X, filters, None, list(X.columns), y,
+                                      categorical_features, categories)
+        selected = X['color'].isin(['blue', 'red']).to_numpy()
+        if method == 'excludes':
+            selected = ~selected
+        expected = np.flatnonzero(selected)
+        assert filtered[ROW_INDEX].tolist() == expected.tolist()
+
+    def test_categorical_equal_filter(self):
+        X, y, categorical_features, categories = create_categorical_data()
+        filters = [{'arg': [1],
+                    'column': 'color',
+                    'method': 'equal'}]
+        filtered = filter_from_cohort(X, filters, None, list(X.columns), y,
+                                      categorical_features, categories)
+        assert (filtered['color'] == 'green').all()
+        assert len(filtered) == 2
+
+    @pytest.mark.parametrize('method', ['includes', 'excludes'])
+    def test_numeric_includes_filters(self, method):
+        X, y, categorical_features, categories = create_categorical_data()
+        filters = [{'arg': [1.5, 9.0, 4.0],
+                    'column': 'size',
+                    'method': method}]
+        filtered = filter_from_cohort(X, filters, None, list(X.columns), y,
+                                      categorical_features, categories)
+        selected = X['size'].isin([1.5, 9.0, 4.0]).to_numpy()
+        if method == 'excludes':
+            selected = ~selected
+        expected = np.flatnonzero(selected)
+        assert filtered[ROW_INDEX].tolist() == expected.tolist()
+
+    def test_special_character_column_names(self):
+        X = pd.DataFrame({'odd `name` -1': [1.0, 2.0, 3.0]})
+        filters = [{'arg': [1.5],
+                    'column': 'odd `name` -1',
+                    'method': 'greater'}]
+        filtered = filter_from_cohort(X, filters, None, list(X.columns),
+                                      np.zeros(3), [], [])
+        assert filtered[ROW_INDEX].tolist() == [1, 2]
+
+    def test_compiled_filters_memoized(self):
+        filters = [{'arg': [2.85], 'column': 'a', 'method': 'greater'}]
+        reordered = [{'method': 'greater', 'column': 'a', 'arg': [2.85]}]
+        assert get_filter_signature(filters) == \
+            get_filter_signature(reordered)
+        assert compile_filters(filters) is compile_filters(reordered)
+
+    def test_numpy_filter_args(self):
+        X, y, categorical_features, categories = create_categorical_data()
+        filters = [{'arg': [np.float64(2.0)],
+                    'column': 'size',
+                    'method': 'greater'},
+                   {'arg': np.array([1.0, 9.0]),
+                    'column': 'size',
+                    'method': 'in the range of'},
+                   {'arg': [np.int64(0), np.int64(2)],
+                    'column': 'color',
+                    'method': 'includes'}]
+        filtered = filter_from_cohort(X, filters, None, list(X.columns), y,
+                                      categorical_features, categories)
+        expected = np.flatnonzero((X['size'] > 2.0) & (X['size'] <= 9.0) &
+                                  X['color'].isin(['blue', 'red']))
+        assert filtered[ROW_INDEX].tolist() == expected.tolist()
+
+    def test_unsupported_method(self):
+        filters = [{'arg': [1], 'column': 'a', 'method': 'unknown'}]
+        with pytest.raises(ValueError):
+            compile_filters(filters)
@@ -0,0 +1,95 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+import numpy as np
+import pytest
+from common_utils import (
+    create_synthetic_categorical_data, create_categorical_pipeline,
+    create_boston_data, create_models_regression)
+from erroranalysis._internal.cohort_filter import filter_from_cohort
+from erroranalysis._internal.column_index import CategoryIndex, SortedIndex
+from erroranalysis._internal.constants import ROW_INDEX
+from erroranalysis._internal.error_analyzer import ModelAnalyzer
+
+
+class TestCategoryIndex(object):
+
+    def test_rows_per_category(self):
+        codes = np.array([2., 0., 1., 2., 0., 2.])
+        index = CategoryIndex(codes)
+        assert index.num_categories == 3
+        assert index.rows(0).tolist() == [1, 4]
+        assert index.rows(1).tolist() == [2]
+        assert index.rows(2).tolist() == [0, 3, 5]
+        assert index.rows(7).tolist() == []
+
+    def test_mask_union(self):
+        codes = np.array([2, 0, 1, 2, 0, 2])
+        index = CategoryIndex(codes)
+        assert index.mask([0, 1]).tolist() == \
+            np.isin(codes, [0, 1]).tolist()
+
+    def test_missing_codes_not_indexed(self):
+        codes = np.array([1., np.nan, 0.])
+        index = CategoryIndex(codes)
+        assert index.mask([0, 1]).tolist() == [True, False, True]
+
+    def test_negative_codes_not_indexed(self):
+        codes = np.array([1, -1, 0], dtype=np.int32)
+        index = CategoryIndex(codes)
+        assert index.num_categories == 2
+        assert index.mask([0, 1]).tolist() == [True, False, True]
+
+    @pytest.mark.parametrize('method', ['includes', 'excludes', 'equal'])
+    def test_analyzer_categorical_filters(self, method):
+        X_train, X_test, y_train, y_test, categorical_features = \
+            create_synthetic_categorical_data()
+        model = create_categorical_pipeline(X_train, y_train,
+                                            categorical_features)
+        feature_names = list(X_test.columns)
+        analyzer = ModelAnalyzer(model, X_test, y_test, feature_names,
+                                 categorical_features)
+        filters = [{'arg': [1, 3],
+                    'column': 'color',
+                    'method': method},
+                   {'arg': [0],
+                    'column': 'size',
+                    'method': 'excludes'}]
+        row_indexes = analyzer.compute_cohort_indexes(filters, None)
+        expected = filter_from_cohort(X_test, filters, None,
+                                      feature_names, y_test,
+                                      categorical_features,
+                                      analyzer.categories)
+        assert row_indexes.tolist() == expected[ROW_INDEX].tolist()
+
+
+class TestSortedIndex(object):
+
+    def test_range_rows(self):
+        values = np.array([3.0, 1.0, np.nan, 2.0, 5.0, 2.0])
+        index = SortedIndex(values)
+        assert sorted(index.rows(lower=2.0).tolist()) == [0, 3, 4, 5]
+        assert sorted(index.rows(lower=2.0, lower_inclusive=False)
+                      .tolist()) == [0, 4]
+        assert sorted(index.rows(upper=2.0).tolist()) == [1, 3, 5]
+        assert sorted(index.rows(lower=2.0, upper=3.0).tolist()) == \
+            [0, 3, 5]
+        assert index.rows(lower=4.0, upper=3.0).tolist() == []
+        assert not index.mask()[2]
+
+    @pytest.mark.parametrize('filters', [
+        [{'arg': [0.675], 'column': 'NOX', 'method': 'less and equal'},
+         {'arg': [6.2], 'column': 'RM', 'method': 'greater'}],
+        [{'arg': [5.5, 6.5], 'column': 'RM', 'method': 'in the range of'}]])
+    def test_analyzer_range_filters(self, filters):
+        X_train, X_test, y_train, y_test, feature_names = \
+            create_boston_data()
+        model = create_models_regression(X_train, y_train)[0]
+        feature_names = list(feature_names)
+        indexed = ModelAnalyzer(model, X_test, y_test, feature_names, [],
+                                index_numeric_features=True)
+        scanned = ModelAnalyzer(model, X_test, y_test, feature_names, [])
+        indexed_rows = indexed.compute_cohort_indexes(filters, None)
+        scanned_rows = scanned.compute_cohort_indexes(filters, None)
+        assert len(indexed_rows) > 0
+        assert indexed_rows.tolist() == scanned_rows.tolist()
@@ -0,0 +1,141 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pytest
+from common_utils import create_iris_data, create_synthetic_categorical_data
+from erroranalysis._internal.column_store import (
+    COLUMN_FILE, MANIFEST_FILE, ColumnStore, encode_categorical,
+    fingerprint_dataset, is_column_store_saved, load_column_store)
+
+
+class TestColumnStore(object):
+
+    def test_numpy_columns_are_views(self):
+        _, X_test, _, _, feature_names, _ = create_iris_data()
+        store = ColumnStore(X_test, feature_names)
+        assert len(store) == X_test.shape[0]
+        assert np.shares_memory(store[feature_names[0]], X_test)
+        with pytest.raises(ValueError):
+            store[feature_names[0]][0] = 0
+
+    def test_gather_rows_and_columns(self):
+        _, X_test, _, _, feature_names, _ = create_iris_data()
+        store = ColumnStore(X_test, feature_names)
+        row_indexes = np.array([1, 5, 7])
+        names = [feature_names[2], feature_names[0]]
+        gathered = store.gather(names, row_indexes)
+        assert gathered.dtype == X_test.dtype
+        assert np.array_equal(gathered, X_test[row_indexes][:, [2, 0]])
+
+    def test_take_rows_full_cohort_is_not_copied(self):
+        _, X_test, _, _, _ = create_synthetic_categorical_data()
+        store = ColumnStore(X_test, list(X_test.columns))
+        all_rows = np.arange(len(X_test))
+        assert store.take_rows(all_rows) is X_test
+        subset = store.take_rows(np.array([0, 3]))
+        assert isinstance(subset, pd.DataFrame)
+        assert subset.equals(X_test.iloc[[0, 3]])
+
+    def test_gather_encoded_columns(self):
+        _, X_test, _, _, _ = create_synthetic_categorical_data()
+        codes = np.arange(len(X_test)) % 4
+        store = ColumnStore(X_test, list(X_test.columns),
+                            encoded_columns={'color': codes})
+        row_indexes = np.array([2, 4])
+        raw = store.gather(['color', 'weight'], row_indexes)
+        assert raw.dtype == object
+        assert raw[0, 0] == X_test['color'].iloc[2]
+        encoded = store.gather(['color', 'weight'], row_indexes,
+                               encoded=True)
+        assert encoded.dtype == np.float64
+        assert encoded[:, 0].tolist() == [2, 0]
+
+    def test_object_numeric_columns_are_typed(self):
+        dataset = np.array([['a', 1, 0.5],
+                            ['b', 2, 1.5],
+                            ['a', 3, np.nan]], dtype=object)
+        store = ColumnStore(dataset, ['color', 'count', 'weight'])
+        assert store['color'].dtype == object
+        assert store['count'].dtype.kind == 'i'
+        assert store['weight'].dtype == np.float64
+        gathered = store.gather(['count', 'weight'], np.array([0, 2]))
+        assert gathered.dtype == np.float64
+
+    def test_encode_categorical(self):
+        values = np.array(['b', np.nan, 'a', 'b'], dtype=object)
+        codes, categories = encode_categorical(values)
+        assert codes.dtype == np.int32
+        assert codes.tolist() == [1, -1, 0, 1]
+        assert categories[:2] == ['a', 'b']
+        assert len(categories) == 3 and pd.isna(categories[2])
+
+    def test_save_and_load_memory_mapped(self, tmpdir):
+        _, X_test, _, _, categorical_features = \
+            create_synthetic_categorical_data()
+        feature_names = list(X_test.columns)
+        encoded_columns = {}
+        categories = {}
+        for feature in categorical_features:
+            codes, category_values = encode_categorical(
+                X_test[feature].to_numpy())
+            encoded_columns[feature] = codes
+            categories[feature] = category_values
+        store = ColumnStore(X_test, feature_names, encoded_columns)
+        directory = str(tmpdir.join('store'))
+        assert not is_column_store_saved(directory)
+        store.save(directory, categories)
+        assert is_column_store_saved(directory)
+        loaded, loaded_categories = load_column_store(directory, X_test,
+                                                      feature_names)
+        assert loaded_categories == categories
+        for feature in feature_names:
+            assert np.array_equal(loaded[feature], store[feature])
+            assert np.array_equal(loaded.encoded_column(feature),
+                                  store.encoded_column(feature))
+        numeric_feature = [feature for feature in feature_names
+                           if feature not in categorical_features][0]
+        assert isinstance(loaded[numeric_feature].base, np.memmap)
+        codes = loaded.encoded_column(categorical_features[0])
+        assert isinstance(codes.base, np.memmap)
+        rows = np.array([3, 0, 7])
+        for feature in categorical_features:
+            assert list(loaded.take_column(feature, rows)) == \
+                list(X_test[feature].to_numpy()[rows])
+        assert not any(name.endswith('.tmp')
+                       for name in os.listdir(directory))
+        with pytest.raises(ValueError):
+            load_column_store(directory, X_test.iloc[:10], feature_names)
+
+    def test_load_other_data_with_same_shape(self, tmpdir):
+        _, X_test, _, _, feature_names, _ = create_iris_data()
+        directory = str(tmpdir.join('store'))
+        ColumnStore(X_test, feature_names).save(directory)
+        other = X_test[::-1]
+        fingerprint = fingerprint_dataset(other, feature_names)
+        assert fingerprint != fingerprint_dataset(X_test, feature_names)
+        assert is_column_store_saved(directory)
+        assert not is_column_store_saved(directory, fingerprint)
+        with pytest.raises(ValueError):
+            load_column_store(directory, other, feature_names)
+        # saving again from the other data replaces the store
+        ColumnStore(other, feature_names).save(directory)
+        assert is_column_store_saved(directory, fingerprint)
+        loaded, _ = load_column_store(directory, other, feature_names)
+        assert np.array_equal(loaded[feature_names[0]], other[:, 0])
+
+    def test_concurrent_saves(self, tmpdir):
+        _, X_test, _, _, feature_names, _ = create_iris_data()
+        directory = str(tmpdir.join('store'))
+        store = ColumnStore(X_test, feature_names)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(lambda _: store.save(directory), range(8)))
+        assert sorted(os.listdir(directory)) == sorted(
+            [MANIFEST_FILE] + [COLUMN_FILE.format(index)
+                               for index in range(len(feature_names))])
+        loaded, _ = load_column_store(directory, X_test, feature_names)
+        for feature in feature_names:
+            assert np.array_equal(loaded[feature], store[feature])
@@ -0,0 +1,187 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+import numpy as np
+import pytest
+from common_utils import (
+    create_boston_data, create_iris_data, create_models_classification,
+    create_models_regression, create_synthetic_categorical_data,
+    create_categorical_pipeline)
+from erroranalysis._internal import error_analyzer
+from erroranalysis._internal.constants import ModelTask, TreeBuilder
+from erroranalysis._internal.error_analyzer import ModelAnalyzer
+
+
+class TestModelAnalyzer(object):
+
+    def test_predictions_are_cached(self, mocker):
+        X_train, X_test, y_train, y_test, feature_names, _ = \
+            create_iris_data()
+        model = create_models_classification(X_train, y_train)[1]
+        predict_spy = mocker.spy(model, 'predict')
+        analyzer = ModelAnalyzer(model, X_test, y_test, feature_names, [])
+        assert predict_spy.call_count == 0
+        filters = [{'arg': [2.85],
+                    'column': feature_names[1],
+                    'method': 'less and equal'}]
+        analyzer.compute_matrix(feature_names[:2], None, None)
+        analyzer.compute_matrix(feature_names[:2], filters, None)
+        analyzer.compute_error_tree(feature_names, filters, None)
+        analyzer.compute_importances()
+        assert predict_spy.call_count == 1
+        row_indexes = analyzer.compute_cohort_indexes(filters, None)
+        expected = model.predict(X_test[row_indexes])
+        assert np.array_equal(analyzer.get_cohort_pred_y(row_indexes),
+                              expected)
+
+    def test_predictions_invalidated_on_model_change(self):
+        X_train, X_test, y_train, y_test, feature_names, _ = \
+            create_iris_data()
+        models = create_models_classification(X_train, y_train)
+        analyzer = ModelAnalyzer(models[0], X_test, y_test,
+                                 feature_names, [])
+        assert np.array_equal(analyzer.pred_y, models[0].predict(X_test))
+        analyzer.model = models[1]
+        assert np.array_equal(analyzer.pred_y, models[1].predict(X_test))
+        analyzer.clear_predictions()
+        assert np.array_equal(analyzer.pred_y, models[1].predict(X_test))
+
+    def test_categorical_features_encoded_as_int32(self):
+        X_train, X_test, y_train, y_test, categorical_features = \
+            create_synthetic_categorical_data()
+        model = create_categorical_pipeline(X_train, y_train,
+                                            categorical_features)
+        feature_names = list(X_test.columns)
+        analyzer = ModelAnalyzer(model, X_test, y_test, feature_names,
+                                 categorical_features)
+        store = analyzer.column_store
+        for feature, categories in zip(categorical_features,
+                                       analyzer.categories):
+            codes = store.encoded_column(feature)
+            assert codes.dtype == np.int32
+            expected = [categories[code] for code in codes]
+            assert expected == X_test[feature].tolist()
+        numeric_features = [feature for feature in feature_names
+                            if feature not in categorical_features]
+        for feature in numeric_features:
+            assert store[feature].dtype == X_test[feature].dtype
+        string_indexed_data = analyzer.string_indexed_data
+        assert string_indexed_data.dtype == np.int32
+        assert string_indexed_data.shape == (len(X_test),
+                                             len(categorical_features))
+
+    def test_construction_is_lazy(self, mocker):
+        X_train, X_test, y_train, y_test, categorical_features = \
+            create_synthetic_categorical_data()
+        model = create_categorical_pipeline(X_train, y_train,
+                                            categorical_features)
+        copy_spy = mocker.spy(X_test, 'copy')
+        encode_spy = mocker.spy(error_analyzer, 'encode_categorical')
+        predict_spy = mocker.spy(model, 'predict')
+        analyzer = ModelAnalyzer(model, X_test, y_test,
+                                 list(X_test.columns), categorical_features)
+        assert copy_spy.call_count == 0
+        assert encode_spy.call_count == 0
+        assert predict_spy.call_count == 0
+        category_dictionary = analyzer.category_dictionary
+        assert copy_spy.call_count == 1
+        assert encode_spy.call_count == len(categorical_features)
+        assert len(category_dictionary) == len(categorical_features)
+        analyzer.compute_error_tree(list(X_test.columns), None, None)
+        analyzer.compute_importances()
+        assert copy_spy.call_count == 1
+        assert encode_spy.call_count == len(categorical_features)
+        assert predict_spy.call_count == 1
+
+    def test_shared_column_store(self, tmpdir):
+        X_train, X_test, y_train, y_test, categorical_features = \
+            create_synthetic_categorical_data()
+        model = create_categorical_pipeline(X_train, y_train,
+                                            categorical_features)
+        feature_names = list(X_test.columns)
+        directory = str(tmpdir.join('store'))
+        expected_analyzer = ModelAnalyzer(model, X_test, y_test,
+                                          feature_names,
+                                          categorical_features)
+        filters = [{'arg': [1],
+                    'column': categorical_features[0],
+                    'method': 'includes'}]
+        expected_tree = expected_analyzer.compute_error_tree(
+            feature_names, filters, None)
+        # the first analyzer saves the store and the next one loads it
+        for _ in range(2):
+            analyzer = ModelAnalyzer(model, X_test, y_test, feature_names,
+                                     categorical_features,
+                                     column_store_path=directory)
+            assert analyzer.categories == expected_analyzer.categories
+            assert analyzer.category_dictionary == \
+                expected_analyzer.category_dictionary
+            assert analyzer.dataset is X_test
+            codes = analyzer.column_store.encoded_column(
+                categorical_features[0])
+            assert isinstance(codes.base, np.memmap)
+            tree = analyzer.compute_error_tree(feature_names, filters, None)
+            assert tree == expected_tree
+
+    def test_shared_column_store_of_other_data(self, tmpdir):
+        X_train, X_test, y_train, y_test, categorical_features = \
+            create_synthetic_categorical_data()
+        model = create_categorical_pipeline(X_train, y_train,
+                                            categorical_features)
+        feature_names = list(X_test.columns)
+        directory = str(tmpdir.join('store'))
+        ModelAnalyzer(model, X_test, y_test, feature_names,
+                      categorical_features,
+                      column_store_path=directory).column_store
+        # other rows of the same shape must not reuse the saved store
+        X_other = X_train.iloc[:len(X_test)]
+        y_other = y_train[:len(y_test)]
+        filters = [{'arg': [1],
+                    'column': categorical_features[0],
+                    'method': 'includes'}]
+        expected_analyzer = ModelAnalyzer(model, X_other, y_other,
+                                          feature_names,
+                                          categorical_features)
+        analyzer = ModelAnalyzer(model, X_other, y_other, feature_names,
+                                 categorical_features,
+                                 column_store_path=directory)
+        assert analyzer.categories == expected_analyzer.categories
+        assert analyzer.compute_error_tree(feature_names, filters, None) == \
+            expected_analyzer.compute_error_tree(feature_names, filters,
+                                                 None)
+
+    @pytest.mark.parametrize('num_workers', [1, 3])
+    @pytest.mark.parametrize('tree_builder', list(TreeBuilder))
+    def test_compute_error_trees(self, mocker, num_workers, tree_builder):
+        X_train, X_test, y_train, y_test, feature_names = create_boston_data()
+        feature_names = list(feature_names)
+        model = create_models_regression(X_train, y_train)[0]
+        predict_spy = mocker.spy(model, 'predict')
+        analyzer = ModelAnalyzer(model, X_test, y_test, feature_names, [],
+                                 model_task=ModelTask.REGRESSION,
+                                 tree_builder=tree_builder)
+        cohorts = [{'filters': [], 'compositeFilters': []}]
+        for threshold in [5.5, 6, 6.5, 7]:
+            cohorts.append({'filters': [{'arg': [threshold],
+                                         'column': 'RM',
+                                         'method': 'less and equal'}],
+                            'compositeFilters': []})
+        cohorts.append(cohorts[2])
+        trees = analyzer.compute_error_trees(cohorts, feature_names,
+                                             num_workers=num_workers)
+        assert predict_spy.call_count == 1
+        assert len(analyzer.error_tree_cache) == len(cohorts) - 1
+        assert trees[2] == trees[-1]
+        expected_analyzer = ModelAnalyzer(model, X_test, y_test,
+                                          feature_names, [],
+                                          model_task=ModelTask.REGRESSION,
+                                          tree_builder=tree_builder)
+        for cohort, tree in zip(cohorts, trees):
+            expected = expected_analyzer.compute_error_tree(
+                feature_names, cohort['filters'],
+                cohort['compositeFilters'])
+            assert tree == expected
+        # the trees are served from the cache on the next batch
+        put_spy = mocker.spy(analyzer.error_tree_cache, 'put')
+        assert analyzer.compute_error_trees(cohorts, feature_names) == trees
+        assert put_spy.call_count == 0
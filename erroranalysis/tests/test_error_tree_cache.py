@@ -0,0 +1,46 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+from common_utils import create_boston_data, create_models_regression
+from erroranalysis._internal.constants import ModelTask, Metrics
+from erroranalysis._internal.error_analyzer import ModelAnalyzer
+from erroranalysis._internal.error_tree_cache import ErrorTreeCache
+
+
+class TestErrorTreeCache(object):
+
+    def test_lru_eviction(self):
+        cache = ErrorTreeCache(max_entries=2)
+        cache.put('a', object())
+        cache.put('b', object())
+        assert cache.get('a') is not None
+        cache.put('c', object())
+        assert 'a' in cache
+        assert 'b' not in cache
+        assert len(cache) == 2
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.hits == 0
+
+    def test_analyzer_reuses_fitted_tree(self, mocker):
+        X_train, X_test, y_train, y_test, feature_names = create_boston_data()
+        feature_names = list(feature_names)
+        model = create_models_regression(X_train, y_train)[0]
+        analyzer = ModelAnalyzer(model, X_test, y_test, feature_names, [],
+                                 model_task=ModelTask.REGRESSION)
+        fit_spy = mocker.spy(analyzer.error_tree_cache, 'put')
+        tree = analyzer.compute_error_tree(feature_names, None, None)
+        assert analyzer.compute_error_tree(feature_names, None, None) == tree
+        # switching the metric reprojects the cached tree
+        analyzer.compute_error_tree(feature_names, None, None,
+                                    metric=Metrics.R2_SCORE)
+        assert fit_spy.call_count == 1
+        # other hyperparameters fit another tree
+        analyzer.compute_error_tree(feature_names, None, None, max_depth=2)
+        assert fit_spy.call_count == 2
+        # the returned json can be modified by the caller
+        tree[0]['size'] = -1
+        assert analyzer.compute_error_tree(feature_names, None,
+                                           None)[0]['size'] == len(y_test)
+        analyzer.model = model
+        assert len(analyzer.error_tree_cache) == 0
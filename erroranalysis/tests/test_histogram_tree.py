@@ -0,0 +1,144 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+import numpy as np
+from common_utils import (
+    create_boston_data, create_models_regression,
+    create_synthetic_categorical_data, create_categorical_pipeline)
+from erroranalysis._internal.constants import ModelTask, TreeBuilder
+from erroranalysis._internal.error_analyzer import (ModelAnalyzer,
+                                                    PredictionsAnalyzer)
+from erroranalysis._internal import histogram_tree
+from erroranalysis._internal.histogram_tree import (build_histogram_tree,
+                                                    fit_feature_bins,
+                                                    iter_histogram_tree)
+
+SIZE = 'size'
+PARENTID = 'parentId'
+CONDITION = 'condition'
+
+
+class TestHistogramTree(object):
+
+    def test_fit_feature_bins(self):
+        values = np.array([3., 1., np.nan, 2., 1.])
+        bins = fit_feature_bins(values, False)
+        assert bins.num_bins == 3
+        assert list(bins.codes) == [2, 0, 3, 1, 0]
+        bins = fit_feature_bins(np.arange(1000.), False, max_bins=10)
+        assert bins.num_bins == 10
+        assert np.all(np.bincount(bins.codes) == 100)
+        bins = fit_feature_bins(np.array([1., 0., np.nan]), True)
+        assert list(bins.codes) == [1, 0, 2]
+
+    def test_planted_error_region(self):
+        rng = np.random.RandomState(777)
+        X = np.round(rng.uniform(size=(2000, 3)), 2)
+        target = (X[:, 1] > 0.5).astype(float)
+        feature_bins = [fit_feature_bins(X[:, i], False) for i in range(3)]
+        tree, leaf_index = build_histogram_tree(
+            feature_bins, np.arange(len(X)), target, max_depth=3,
+            num_leaves=4)
+        assert tree.feature[0] == 1
+        assert tree.threshold[0] == 0.5
+        # the error region is pure, so it is not split any further
+        assert np.array_equal(np.unique(leaf_index[target == 1]), [1])
+        assert tree.leaf_index[tree.right[0]] == 1
+
+    def test_max_depth_and_num_leaves(self):
+        rng = np.random.RandomState(777)
+        X = rng.uniform(size=(5000, 4))
+        target = (rng.uniform(size=5000) < X[:, 0] * X[:, 2]).astype(float)
+        feature_bins = [fit_feature_bins(X[:, i], False) for i in range(4)]
+        for max_depth, num_leaves in [(1, 31), (2, 31), (10, 5)]:
+            tree, leaf_index = build_histogram_tree(
+                feature_bins, np.arange(len(X)), target, max_depth,
+                num_leaves)
+            num_tree_leaves = len(np.unique(leaf_index))
+            assert num_tree_leaves <= min(num_leaves, 2 ** max_depth)
+            assert tree.num_leaves == num_tree_leaves
+            assert np.max(tree.depth) <= max_depth
+
+    def test_tree_grown_level_by_level(self):
+        rng = np.random.RandomState(777)
+        X = rng.uniform(size=(5000, 4))
+        target = (rng.uniform(size=5000) < X[:, 0] * X[:, 2]).astype(float)
+        feature_bins = [fit_feature_bins(X[:, i], False) for i in range(4)]
+        levels = [(depth, tree.node_id[tree.depth == depth].tolist())
+                  for depth, tree, _ in iter_histogram_tree(
+                      feature_bins, np.arange(len(X)), target, 3, 31)]
+        assert [depth for depth, _ in levels] == [0, 1, 2, 3]
+        tree, _ = build_histogram_tree(feature_bins, np.arange(len(X)),
+                                       target, 3, 31)
+        # the ids of the yielded nodes are those of the final tree
+        for depth, node_ids in levels:
+            assert node_ids == tree.node_id[tree.depth == depth].tolist()
+
+    def test_levels_streamed_before_deeper_levels_are_grown(self, mocker):
+        X_train, X_test, y_train, y_test, feature_names = create_boston_data()
+        model = create_models_regression(X_train, y_train)[0]
+        analyzer = ModelAnalyzer(model, X_test, y_test, feature_names, [],
+                                 model_task=ModelTask.REGRESSION,
+                                 tree_builder=TreeBuilder.HISTOGRAM)
+        split_spy = mocker.spy(histogram_tree, '_find_best_split')
+        levels = analyzer.compute_error_tree_levels(feature_names, None,
+                                                    None)
+        root = next(levels)
+        assert len(root) == 1
+        assert split_spy.call_count == 1
+        tree = root + [node for chunk in levels for node in chunk]
+        assert split_spy.call_count > 1
+        validate_tree(tree, len(y_test))
+
+    def test_histogram_tree_boston(self):
+        X_train, X_test, y_train, y_test, feature_names = create_boston_data()
+        model = create_models_regression(X_train, y_train)[0]
+        analyzer = ModelAnalyzer(model, X_test, y_test, feature_names, [],
+                                 model_task=ModelTask.REGRESSION,
+                                 tree_builder=TreeBuilder.HISTOGRAM)
+        tree = analyzer.compute_error_tree(feature_names, None, None)
+        validate_tree(tree, len(y_test))
+        filters = [{'arg': [6.5], 'column': 'RM',
+                    'method': 'less and equal'}]
+        tree = analyzer.compute_error_tree(feature_names, filters, None)
+        validate_tree(tree, int(np.sum(X_test[:, 5] <= 6.5)))
+
+    def test_histogram_tree_string_categorical(self):
+        X_train, X_test, y_train, y_test, categorical_features = \
+            create_synthetic_categorical_data()
+        model = create_categorical_pipeline(X_train, y_train,
+                                            categorical_features)
+        feature_names = list(X_train.columns)
+        analyzer = ModelAnalyzer(model, X_test, y_test, feature_names,
+                                 categorical_features,
+                                 tree_builder=TreeBuilder.HISTOGRAM)
+        tree = analyzer.compute_error_tree(feature_names, None, None)
+        validate_tree(tree, len(y_test))
+        categorical_conditions = [
+            node[CONDITION] for node in tree
+            if node[CONDITION] is not None and
+            node[CONDITION].split(' ')[0] in categorical_features]
+        for condition in categorical_conditions:
+            assert ' == ' in condition or ' != ' in condition
+
+    def test_single_leaf(self):
+        X = np.zeros((30, 2))
+        y = np.zeros(30)
+        analyzer = PredictionsAnalyzer(y, X, y, ['a', 'b'], [],
+                                       tree_builder=TreeBuilder.HISTOGRAM)
+        tree = analyzer.compute_error_tree(['a', 'b'], None, None)
+        assert len(tree) == 1
+        assert tree[0][SIZE] == 30
+
+
+def validate_tree(tree, num_rows):
+    nodes = {node['id']: node for node in tree}
+    assert tree[0][PARENTID] is None
+    assert tree[0][SIZE] == num_rows
+    children = {}
+    for node in tree[1:]:
+        children.setdefault(node[PARENTID], []).append(node)
+    for parent_id, nodes_children in children.items():
+        assert len(nodes_children) == 2
+        assert sum(child[SIZE] for child in nodes_children) == \
+            nodes[parent_id][SIZE]
@@ -6,8 +6,12 @@ from common_utils import (
     create_binary_classification_dataset,
     create_models_classification, create_models_regression,
     create_simple_titanic_data, create_titanic_pipeline)
+import numpy as np
+import pytest
 from erroranalysis._internal.error_analyzer import ModelAnalyzer
 from erroranalysis._internal.constants import ModelTask
+from erroranalysis._internal.importances import (ImportancesEstimator,
+                                                 stratified_sample)
 
 TOL = 1e-10
 
@@ -65,6 +69,70 @@ class TestImportances(object):
             run_error_analyzer(model, X_test, y_test, feature_names,
                                categorical_features)
 
+    def test_stratified_sample(self):
+        strata = np.array([0] * 900 + [1] * 90 + [2] * 10)
+        sample = stratified_sample(strata, 100, random_state=7)
+        assert len(sample) == 100
+        assert len(np.unique(sample)) == 100
+        assert np.array_equal(np.bincount(strata[sample]), [90, 9, 1])
+        assert np.array_equal(sample,
+                              stratified_sample(strata, 100, random_state=7))
+        assert len(stratified_sample(strata, 2000)) == len(strata)
+
+    @pytest.mark.parametrize('use_processes', [False, True])
+    def test_parallel_importances(self, use_processes):
+        X_train, X_test, y_train, y_test, feature_names, _ = \
+            create_cancer_data()
+        model = create_models_classification(X_train, y_train)[0]
+        serial = ModelAnalyzer(
+            model, X_test, y_test, feature_names, [],
+            importances_estimator=ImportancesEstimator(random_state=3))
+        estimator = ImportancesEstimator(random_state=3, num_workers=3,
+                                         use_processes=use_processes)
+        parallel = ModelAnalyzer(model, X_test, y_test, feature_names, [],
+                                 importances_estimator=estimator)
+        assert np.allclose(serial.compute_importances(),
+                           parallel.compute_importances())
+
+    def test_subsampled_importances_are_cached(self, mocker):
+        X_train, X_test, y_train, y_test, feature_names = \
+            create_boston_data()
+        model = create_models_regression(X_train, y_train)[0]
+        estimator = ImportancesEstimator(sample_size=50, random_state=5)
+        analyzer = ModelAnalyzer(model, X_test, y_test, feature_names, [],
+                                 model_task=ModelTask.REGRESSION,
+                                 importances_estimator=estimator)
+        estimate_spy = mocker.spy(estimator, 'iter_estimate')
+        importances = analyzer.compute_importances()
+        assert len(importances) == len(feature_names)
+        assert analyzer.compute_importances() == importances
+        assert estimate_spy.call_count == 1
+        analyzer.model = model
+        analyzer.compute_importances()
+        assert estimate_spy.call_count == 2
+
+    def test_cohort_importances(self):
+        X_train, X_test, y_train, y_test, feature_names, _ = \
+            create_cancer_data()
+        model = create_models_classification(X_train, y_train)[0]
+        estimator = ImportancesEstimator(random_state=11, num_workers=2)
+        analyzer = ModelAnalyzer(model, X_test, y_test, feature_names, [],
+                                 importances_estimator=estimator)
+        filters = [{'arg': [0.1],
+                    'column': feature_names[4],
+                    'method': 'greater'}]
+        importances = analyzer.compute_importances(filters, None)
+        rows = X_test[:, 4] > 0.1
+        diff = model.predict(X_test[rows]) != y_test[rows]
+        expected = estimator.estimate(X_test[rows], diff,
+                                      ModelTask.CLASSIFICATION)
+        assert np.allclose(importances, expected)
+        assert not np.allclose(importances, analyzer.compute_importances())
+        # the incremental importances are served from the cache
+        streamed = dict(analyzer.iter_importances(filters, None))
+        assert [streamed[i] for i in range(len(feature_names))] == \
+            importances
+
 
 def run_error_analyzer(model, X_test, y_test, feature_names,
                        categorical_features):
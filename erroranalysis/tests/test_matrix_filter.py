@@ -1,20 +1,26 @@
 # Copyright (c) Microsoft Corporation
 # Licensed under the MIT License.
 
+import numpy as np
 import pandas as pd
-from erroranalysis._internal.error_analyzer import ModelAnalyzer
+import pytest
+from erroranalysis._internal.error_analyzer import (
+    ModelAnalyzer, PredictionsAnalyzer)
 from erroranalysis._internal.matrix_filter import (
     CATEGORY1, CATEGORY2, COUNT, FALSE_COUNT, MATRIX,
-    VALUES, METRIC_NAME, METRIC_VALUE)
+    VALUES, METRIC_NAME, METRIC_VALUE, INTERVAL_MIN, INTERVAL_MAX,
+    matrix_1d, matrix_2d)
 from erroranalysis._internal.cohort_filter import filter_from_cohort
 from common_utils import (
     create_boston_data, create_iris_data, create_cancer_data,
     create_simple_titanic_data, create_titanic_pipeline,
     create_binary_classification_dataset,
+    create_synthetic_categorical_data, create_categorical_pipeline,
     create_models_classification,
     create_models_regression)
 from erroranalysis._internal.constants import (
-    ModelTask, TRUE_Y, ROW_INDEX, Metrics, metric_to_display_name)
+    BinningStrategy, ModelTask, TRUE_Y, ROW_INDEX, Metrics,
+    metric_to_display_name)
 from erroranalysis._internal.metrics import metric_to_func
 
 TOLERANCE = 1e-5
@@ -121,6 +127,24 @@ class TestMatrixFilter(object):
                            categorical_features,
                            model_task=ModelTask.CLASSIFICATION)
 
+    def test_matrix_filter_string_categorical(self):
+        X_train, X_test, y_train, y_test, categorical_features = \
+            create_synthetic_categorical_data()
+        feature_names = list(X_train.columns)
+        clf = create_categorical_pipeline(X_train, y_train,
+                                          categorical_features)
+        run_error_analyzer(clf, X_test, y_test, feature_names,
+                           categorical_features,
+                           model_task=ModelTask.CLASSIFICATION)
+        filters = [{'arg': [0, 2],
+                    'column': 'color',
+                    'method': 'includes'}]
+        run_error_analyzer(clf, X_test, y_test, feature_names,
+                           categorical_features,
+                           model_task=ModelTask.CLASSIFICATION,
+                           filters=filters,
+                           matrix_features=['size', 'weight'])
+
     def test_matrix_filter_boston(self):
         X_train, X_test, y_train, y_test, feature_names = create_boston_data()
 
@@ -139,6 +163,197 @@ class TestMatrixFilter(object):
                                      y_test, feature_names, model_task,
                                      matrix_features=[feature_names[3]])
 
+    @pytest.mark.parametrize('metric', [Metrics.MEAN_ABSOLUTE_ERROR,
+                                        Metrics.MEDIAN_ABSOLUTE_ERROR,
+                                        Metrics.R2_SCORE])
+    def test_matrix_filter_boston_metrics(self, metric):
+        X_train, X_test, y_train, y_test, feature_names = create_boston_data()
+        model = create_models_regression(X_train, y_train)[0]
+        error_analyzer = ModelAnalyzer(model, X_test, y_test,
+                                       feature_names, [],
+                                       model_task=ModelTask.REGRESSION,
+                                       metric=metric)
+        # Note: CHAS has two unique values, one cell per value
+        feature_index = list(feature_names).index('CHAS')
+        matrix = error_analyzer.compute_matrix(['CHAS', None], None, None)
+        pred_y = model.predict(X_test)
+        for cell, value in zip(matrix[MATRIX][0],
+                               matrix[CATEGORY1][VALUES]):
+            in_cell = X_test[:, feature_index] == value
+            expected = metric_to_func[metric](y_test[in_cell],
+                                              pred_y[in_cell])
+            assert cell[COUNT] == in_cell.sum()
+            assert abs(cell[METRIC_VALUE] - expected) < TOLERANCE
+
+    def test_matrix_filter_binary_classification_f1(self):
+        X_train, y_train, X_test, y_test, _ = \
+            create_binary_classification_dataset()
+        feature_names = list(X_train.columns)
+        model = create_models_classification(X_train, y_train)[1]
+        error_analyzer = ModelAnalyzer(model, X_test, y_test,
+                                       feature_names, [],
+                                       model_task=ModelTask.CLASSIFICATION,
+                                       metric=Metrics.F1_SCORE)
+        matrix = error_analyzer.compute_matrix(feature_names[:2],
+                                               None, None)
+        total_count = sum(cell[COUNT] for row in matrix[MATRIX]
+                          for cell in row)
+        assert total_count == len(y_test)
+        for row in matrix[MATRIX]:
+            for cell in row:
+                assert 0 <= cell[METRIC_VALUE] <= 1
+                assert cell[METRIC_NAME] == \
+                    metric_to_display_name[Metrics.F1_SCORE]
+
+    @pytest.mark.parametrize('metric', [Metrics.MEAN_SQUARED_ERROR,
+                                        Metrics.MEDIAN_ABSOLUTE_ERROR,
+                                        Metrics.R2_SCORE])
+    def test_matrix_filter_boston_chunked(self, metric, tmpdir):
+        X_train, X_test, y_train, y_test, feature_names = create_boston_data()
+        model = create_models_regression(X_train, y_train)[0]
+        # stream the dataset from a memory-mapped file
+        path = str(tmpdir.join('boston.npy'))
+        np.save(path, X_test)
+        X_mmap = np.load(path, mmap_mode='r')
+        error_analyzer = ModelAnalyzer(model, X_mmap, y_test,
+                                       feature_names, [],
+                                       model_task=ModelTask.REGRESSION,
+                                       metric=metric)
+        filters = [{'arg': [0.675],
+                    'column': 'NOX',
+                    'method': 'less and equal'}]
+        for features in [['CRIM', 'RM'], ['CHAS', None]]:
+            expected = error_analyzer.compute_matrix(features, filters, None)
+            chunked = error_analyzer.compute_matrix(features, filters, None,
+                                                    chunk_size=17)
+            assert chunked[CATEGORY1] == expected[CATEGORY1]
+            assert chunked.get(CATEGORY2) == expected.get(CATEGORY2)
+            for row, expected_row in zip(chunked[MATRIX], expected[MATRIX]):
+                for cell, expected_cell in zip(row, expected_row):
+                    assert cell[COUNT] == expected_cell[COUNT]
+                    assert abs(cell[METRIC_VALUE] -
+                               expected_cell[METRIC_VALUE]) < TOLERANCE
+
+    def test_matrix_filter_iris_chunked(self):
+        X_train, X_test, y_train, y_test, feature_names, _ = create_iris_data()
+        model = create_models_classification(X_train, y_train)[1]
+        error_analyzer = ModelAnalyzer(model, X_test, y_test,
+                                       feature_names, [])
+        expected = error_analyzer.compute_matrix(feature_names[:2],
+                                                 None, None)
+        chunked = error_analyzer.compute_matrix(feature_names[:2],
+                                                None, None, chunk_size=7)
+        assert chunked == expected
+
+    def test_matrix_filter_more_than_two_features(self, mocker):
+        X_train, X_test, y_train, y_test, feature_names, _ = create_iris_data()
+        model = create_models_classification(X_train, y_train)[1]
+        error_analyzer = ModelAnalyzer(model, X_test, y_test,
+                                       feature_names, [])
+        binning_spy = mocker.spy(error_analyzer, 'get_feature_binning')
+        matrix = error_analyzer.compute_matrix(feature_names, None, None)
+        # only the first feature is binned and mapped
+        assert binning_spy.call_count == 1
+        expected = error_analyzer.compute_matrix([feature_names[0], None],
+                                                 None, None)
+        assert matrix == expected
+        assert CATEGORY2 not in matrix
+        assert len(matrix[MATRIX]) == 1
+
+    @pytest.mark.parametrize('chunk_size', [None, 7])
+    def test_matrix_filter_int_and_bool_categorical(self, chunk_size):
+        rng = np.random.RandomState(7)
+        num_rows = 50
+        X = pd.DataFrame({'count': rng.randint(0, 2, num_rows),
+                          'flag': rng.rand(num_rows) > 0.5})
+        true_y = rng.randint(0, 2, num_rows).tolist()
+        pred_y = rng.randint(0, 2, num_rows)
+        error_analyzer = PredictionsAnalyzer(pred_y, X, true_y,
+                                             list(X.columns),
+                                             ['count', 'flag'])
+        matrix = error_analyzer.compute_matrix(['count', 'flag'], None, None,
+                                               chunk_size=chunk_size)
+        assert matrix[CATEGORY1][VALUES] == [0, 1]
+        assert all(isinstance(value, int) and not isinstance(value, bool)
+                   for value in matrix[CATEGORY1][VALUES])
+        assert matrix[CATEGORY2][VALUES] == [False, True]
+        assert all(isinstance(value, bool)
+                   for value in matrix[CATEGORY2][VALUES])
+        expected = pd.crosstab(X['count'], X['flag']).to_numpy()
+        counts = [[cell[COUNT] for cell in row] for row in matrix[MATRIX]]
+        assert counts == expected.tolist()
+
+    @pytest.mark.parametrize('bin_strategy', [BinningStrategy.EQUAL_WIDTH,
+                                              BinningStrategy.QUANTILE])
+    def test_matrix_filter_global_bins(self, bin_strategy):
+        X_train, X_test, y_train, y_test, feature_names = create_boston_data()
+        model = create_models_regression(X_train, y_train)[0]
+        error_analyzer = ModelAnalyzer(model, X_test, y_test,
+                                       feature_names, [],
+                                       model_task=ModelTask.REGRESSION,
+                                       bin_strategy=bin_strategy,
+                                       num_bins=5)
+        filters = [{'arg': [0.675],
+                    'column': 'NOX',
+                    'method': 'less and equal'}]
+        matrix = error_analyzer.compute_matrix(['CRIM', 'RM'], None, None)
+        cohort_matrix = error_analyzer.compute_matrix(['CRIM', 'RM'],
+                                                      filters, None)
+        # every cohort is binned with the edges of the whole dataset
+        assert cohort_matrix[CATEGORY1] == matrix[CATEGORY1]
+        assert cohort_matrix[CATEGORY2] == matrix[CATEGORY2]
+        assert len(matrix[CATEGORY1][VALUES]) == 5
+        counts = [sum(cell[COUNT] for cell in row) for row in matrix[MATRIX]]
+        assert sum(counts) == len(y_test)
+        if bin_strategy == BinningStrategy.QUANTILE:
+            assert max(counts) - min(counts) <= 1
+        binning = error_analyzer.get_feature_binning('CRIM')
+        assert error_analyzer.get_feature_binning('CRIM') is binning
+
+    def test_matrix_filter_user_bin_edges(self):
+        X_train, X_test, y_train, y_test, feature_names = create_boston_data()
+        model = create_models_regression(X_train, y_train)[0]
+        bin_edges = {'RM': [3, 5, 7, 9]}
+        error_analyzer = ModelAnalyzer(model, X_test, y_test,
+                                       feature_names, [],
+                                       model_task=ModelTask.REGRESSION,
+                                       bin_edges=bin_edges)
+        matrix = error_analyzer.compute_matrix(['RM', None], None, None)
+        assert matrix[CATEGORY1][INTERVAL_MAX] == [5, 7, 9]
+        feature_index = list(feature_names).index('RM')
+        expected_counts = np.histogram(X_test[:, feature_index],
+                                       bins=bin_edges['RM'])[0]
+        assert [cell[COUNT] for cell in matrix[MATRIX][0]] == \
+            expected_counts.tolist()
+        # features without edges keep the binning of each cohort
+        assert error_analyzer.get_feature_binning('CRIM') is None
+
+    def test_matrix_2d_assembly(self):
+        categories1 = np.array(['a', 'b', 'c'])
+        categories2 = pd.interval_range(0, 2)
+        counts = np.array([[3, 0], [1, 2], [4, 5]])
+        false_counts = np.array([[1, 0], [0, 2], [3, 1]])
+        matrix = matrix_2d(categories1, categories2, counts,
+                           false_counts, Metrics.ERROR_RATE)
+        assert matrix[CATEGORY1][VALUES] == ['a', 'b', 'c']
+        assert matrix[CATEGORY2][VALUES] == ['(0, 1]', '(1, 2]']
+        assert matrix[CATEGORY2][INTERVAL_MIN] == [0, 1]
+        assert matrix[CATEGORY2][INTERVAL_MAX] == [1, 2]
+        assert matrix[MATRIX][2][0] == {FALSE_COUNT: 3, COUNT: 4}
+        assert matrix[MATRIX][1][1] == {FALSE_COUNT: 2, COUNT: 2}
+
+    def test_matrix_1d_assembly(self):
+        categories = np.array([0.0, 1.0])
+        matrix = matrix_1d(categories, np.array([2, 6]),
+                           np.array([0.5, 1.25]),
+                           Metrics.MEAN_SQUARED_ERROR)
+        assert len(matrix[MATRIX]) == 1
+        assert matrix[CATEGORY1][VALUES] == [0.0, 1.0]
+        assert matrix[MATRIX][0][1] == {
+            METRIC_VALUE: 1.25,
+            METRIC_NAME: metric_to_display_name[Metrics.MEAN_SQUARED_ERROR],
+            COUNT: 6}
+
     def test_matrix_filter_boston_filters(self):
         X_train, X_test, y_train, y_test, feature_names = create_boston_data()
 
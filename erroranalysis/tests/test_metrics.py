@@ -0,0 +1,162 @@
+# Copyright (c) Microsoft Corporation
+# Licensed under the MIT License.
+
+import numpy as np
+import pytest
+from sklearn.metrics import r2_score
+from erroranalysis._internal.constants import ModelTask, Metrics
+from erroranalysis._internal.metrics import (
+    compute_metric_statistics, metric_to_func)
+
+TOLERANCE = 1e-8
+NUM_GROUPS = 4
+
+
+def create_groups(num_rows=200):
+    rng = np.random.RandomState(777)
+    return rng.randint(0, NUM_GROUPS - 1, num_rows), rng
+
+
+class TestMetricStatistics(object):
+
+    @pytest.mark.parametrize('metric', [Metrics.MEAN_ABSOLUTE_ERROR,
+                                        Metrics.MEAN_SQUARED_ERROR,
+                                        Metrics.MEDIAN_ABSOLUTE_ERROR,
+                                        Metrics.R2_SCORE])
+    def test_regression_metrics(self, metric):
+        group_index, rng = create_groups()
+        true_y = rng.normal(size=len(group_index))
+        pred_y = true_y + rng.normal(scale=0.5, size=len(group_index))
+        stats = compute_metric_statistics(group_index, NUM_GROUPS,
+                                          true_y, pred_y,
+                                          ModelTask.REGRESSION,
+                                          median=True)
+        values = stats.metric_value(metric)
+        for group in range(NUM_GROUPS - 1):
+            in_group = group_index == group
+            expected = metric_to_func[metric](true_y[in_group],
+                                              pred_y[in_group])
+            assert abs(values[group] - expected) < TOLERANCE
+        # the last group is empty
+        assert stats.count[-1] == 0
+        assert np.isnan(values[-1])
+
+    @pytest.mark.parametrize('metric', [Metrics.F1_SCORE,
+                                        Metrics.PRECISION_SCORE,
+                                        Metrics.RECALL_SCORE])
+    def test_classification_metrics(self, metric):
+        group_index, rng = create_groups()
+        true_y = rng.randint(0, 2, len(group_index))
+        pred_y = rng.randint(0, 2, len(group_index))
+        stats = compute_metric_statistics(group_index, NUM_GROUPS,
+                                          true_y, pred_y,
+                                          ModelTask.CLASSIFICATION)
+        values = stats.metric_value(metric)
+        error_rate = stats.metric_value(Metrics.ERROR_RATE)
+        for group in range(NUM_GROUPS - 1):
+            in_group = group_index == group
+            expected = metric_to_func[metric](true_y[in_group],
+                                              pred_y[in_group])
+            assert abs(values[group] - expected) < TOLERANCE
+            expected_error_rate = np.mean(true_y[in_group] !=
+                                          pred_y[in_group])
+            assert abs(error_rate[group] - expected_error_rate) < TOLERANCE
+
+    def test_constant_true_labels_r2(self):
+        group_index = np.array([0, 0, 1, 1])
+        true_y = np.array([1.0, 1.0, 2.0, 2.0])
+        pred_y = np.array([1.0, 1.0, 2.0, 3.0])
+        stats = compute_metric_statistics(group_index, 2, true_y, pred_y,
+                                          ModelTask.REGRESSION)
+        r2 = stats.metric_value(Metrics.R2_SCORE)
+        assert r2.tolist() == [1.0, 0.0]
+
+    def test_add_merges_chunks(self):
+        group_index, rng = create_groups()
+        true_y = rng.normal(size=len(group_index))
+        pred_y = true_y + rng.normal(scale=0.5, size=len(group_index))
+        expected = compute_metric_statistics(group_index, NUM_GROUPS,
+                                             true_y, pred_y,
+                                             ModelTask.REGRESSION)
+        half = len(group_index) // 2
+        stats = compute_metric_statistics(group_index[:half], NUM_GROUPS,
+                                          true_y[:half], pred_y[:half],
+                                          ModelTask.REGRESSION)
+        stats = stats.add(compute_metric_statistics(
+            group_index[half:], NUM_GROUPS, true_y[half:], pred_y[half:],
+            ModelTask.REGRESSION))
+        assert stats.count.tolist() == expected.count.tolist()
+        for metric in [Metrics.MEAN_SQUARED_ERROR, Metrics.R2_SCORE]:
+            assert np.allclose(stats.metric_value(metric),
+                               expected.metric_value(metric),
+                               equal_nan=True)
+
+    @pytest.mark.parametrize('offset', [1e6, 1e8])
+    def test_r2_large_labels(self, offset):
+        group_index, rng = create_groups(num_rows=2000)
+        true_y = rng.normal(size=len(group_index)) + offset
+        pred_y = true_y + rng.normal(scale=0.5, size=len(group_index))
+        half = len(group_index) // 2
+        stats = compute_metric_statistics(group_index[:half], NUM_GROUPS,
+                                          true_y[:half], pred_y[:half],
+                                          ModelTask.REGRESSION)
+        stats = stats.add(compute_metric_statistics(
+            group_index[half:], NUM_GROUPS, true_y[half:], pred_y[half:],
+            ModelTask.REGRESSION))
+        r2 = stats.metric_value(Metrics.R2_SCORE)
+        for group in range(NUM_GROUPS - 1):
+            in_group = group_index == group
+            expected = r2_score(true_y[in_group], pred_y[in_group])
+            assert abs(r2[group] - expected) < 1e-6
+        # all the groups but the empty one, aggregated into a single one
+        membership = np.array([[1] * (NUM_GROUPS - 1) + [0]])
+        r2 = stats.aggregate(membership).metric_value(Metrics.R2_SCORE)
+        assert abs(r2[0] - r2_score(true_y, pred_y)) < 1e-6
+
+    def test_string_labels(self):
+        group_index = np.array([0, 0, 1, 1])
+        true_y = np.array(['no', 'yes', 'yes', 'no'])
+        pred_y = np.array(['no', 'no', 'yes', 'yes'])
+        stats = compute_metric_statistics(group_index, 2, true_y, pred_y,
+                                          ModelTask.CLASSIFICATION)
+        assert stats.metric_value(Metrics.ERROR_RATE).tolist() == [0.5, 0.5]
+        for metric in [Metrics.F1_SCORE, Metrics.PRECISION_SCORE,
+                       Metrics.RECALL_SCORE]:
+            with pytest.raises(ValueError):
+                metric_to_func[metric](true_y, pred_y)
+            with pytest.raises(ValueError):
+                stats.metric_value(metric)
+        # each chunk has a single label, the merged chunks have two
+        stats = compute_metric_statistics(
+            group_index[:1], 2, true_y[:1], pred_y[:1],
+            ModelTask.CLASSIFICATION).add(compute_metric_statistics(
+                group_index[2:3], 2, true_y[2:3], pred_y[2:3],
+                ModelTask.CLASSIFICATION))
+        with pytest.raises(ValueError):
+            stats.metric_value(Metrics.F1_SCORE)
+
+    def test_multiclass_labels(self):
+        group_index = np.zeros(4, dtype=int)
+        true_y = np.array([0, 1, 2, 1])
+        pred_y = np.array([0, 1, 1, 2])
+        stats = compute_metric_statistics(group_index, 1, true_y, pred_y,
+                                          ModelTask.CLASSIFICATION)
+        assert stats.metric_value(Metrics.ERROR_RATE).tolist() == [0.5]
+        with pytest.raises(ValueError):
+            stats.metric_value(Metrics.PRECISION_SCORE)
+
+    def test_positive_label_of_other_binary_labels(self):
+        group_index = np.zeros(4, dtype=int)
+        for true_y, pred_y in [([-1, 1, 1, -1], [1, 1, -1, -1]),
+                               ([True, True, False, False],
+                                [True, False, True, False])]:
+            true_y = np.array(true_y)
+            pred_y = np.array(pred_y)
+            stats = compute_metric_statistics(group_index, 1, true_y,
+                                              pred_y,
+                                              ModelTask.CLASSIFICATION)
+            for metric in [Metrics.F1_SCORE, Metrics.PRECISION_SCORE,
+                           Metrics.RECALL_SCORE]:
+                expected = metric_to_func[metric](true_y, pred_y)
+                assert abs(stats.metric_value(metric)[0] - expected) < \
+                    TOLERANCE
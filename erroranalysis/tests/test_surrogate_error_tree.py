@@ -1,19 +1,36 @@
 # Copyright (c) Microsoft Corporation
 # Licensed under the MIT License.
 
+import numpy as np
+import pytest
+from sklearn.datasets import make_classification
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
 from common_utils import (
     create_iris_data, create_models_classification,
-    create_adult_census_data, create_kneighbors_classifier)
-from erroranalysis._internal.error_analyzer import ModelAnalyzer
+    create_boston_data, create_models_regression,
+    create_adult_census_data, create_kneighbors_classifier,
+    create_synthetic_categorical_data, create_categorical_pipeline)
+from erroranalysis._internal import surrogate_error_tree
+from erroranalysis._internal.error_analyzer import (ModelAnalyzer,
+                                                    PredictionsAnalyzer)
 from erroranalysis._internal.surrogate_error_tree import (
-    create_surrogate_model, get_categorical_info, get_max_split_index,
-    traverse, TreeSide)
-from erroranalysis._internal.constants import (PRED_Y,
-                                               TRUE_Y,
-                                               DIFF,
-                                               SPLIT_INDEX,
+    compute_node_statistics, create_categorical_condition, create_node_json,
+    create_surrogate_model, fit_error_tree, get_categorical_info,
+    get_leaf_index, get_node_summaries, tree_to_json, TreeSide)
+from erroranalysis._internal.tree_arrays import flatten_tree
+from erroranalysis._internal.cohort_filter import (
+    METHOD_GREATER, METHOD_LESS_AND_EQUAL)
+from erroranalysis._internal.constants import (SPLIT_INDEX,
                                                SPLIT_FEATURE,
-                                               LEAF_INDEX)
+                                               LEAF_INDEX,
+                                               METHOD_EXCLUDES,
+                                               METHOD_INCLUDES,
+                                               ModelTask,
+                                               Metrics,
+                                               TreeBuilder)
+from erroranalysis._internal.metrics import (
+    compute_metric_statistics, metric_to_func)
 
 SIZE = 'size'
 PARENTID = 'parentId'
@@ -42,6 +59,16 @@ class TestSurrogateErrorTree(object):
         run_error_analyzer(model, X_test, y_test, list(X_train.columns),
                            categorical_features)
 
+    def test_surrogate_error_tree_string_categorical(self):
+        X_train, X_test, y_train, y_test, categorical_features = \
+            create_synthetic_categorical_data()
+
+        model = create_categorical_pipeline(X_train, y_train,
+                                            categorical_features)
+
+        run_error_analyzer(model, X_test, y_test, list(X_train.columns),
+                           categorical_features)
+
     def test_traverse_tree(self):
         X_train, X_test, y_train, y_test, categorical_features = \
             create_adult_census_data()
@@ -50,40 +77,266 @@ class TestSurrogateErrorTree(object):
         error_analyzer = ModelAnalyzer(model, X_test, y_test,
                                        feature_names,
                                        categorical_features)
-        categorical_info = get_categorical_info(error_analyzer,
-                                                feature_names)
-        cat_ind_reindexed, categories_reindexed = categorical_info
-        pred_y = model.predict(X_test)
-        diff = pred_y != y_test
-        max_depth = 3
-        num_leaves = 31
-        surrogate = create_surrogate_model(error_analyzer,
-                                           X_test,
-                                           diff,
-                                           max_depth,
-                                           num_leaves,
-                                           cat_ind_reindexed)
-        model_json = surrogate._Booster.dump_model()
-        tree_structure = model_json["tree_info"][0]['tree_structure']
-        max_split_index = get_max_split_index(tree_structure) + 1
-        filtered_indexed_df = X_test
-        filtered_indexed_df[DIFF] = diff
-        filtered_indexed_df[TRUE_Y] = y_test
-        filtered_indexed_df[PRED_Y] = pred_y
-        tree = traverse(filtered_indexed_df,
-                        tree_structure,
-                        max_split_index,
-                        (categories_reindexed,
-                         cat_ind_reindexed),
-                        [],
-                        feature_names,
-                        metric=error_analyzer.metric)
+        tree, tree_structure, values, categories = fit_tree_and_oracle(
+            error_analyzer, feature_names, y_test, model.predict(X_test))
+        num_splits = count_splits(tree_structure)
         # create dictionary from json tree id to values
         tree_dict = {}
         for entry in tree:
             tree_dict[entry['id']] = entry
         validate_traversed_tree(tree_structure, tree_dict,
-                                max_split_index, feature_names)
+                                num_splits, feature_names)
+
+    def test_traverse_categorical_tree(self):
+        X_train, X_test, y_train, y_test, categorical_features = \
+            create_synthetic_categorical_data()
+        model = create_categorical_pipeline(X_train, y_train,
+                                            categorical_features)
+        feature_names = list(X_train.columns)
+        error_analyzer = ModelAnalyzer(model, X_test, y_test,
+                                       feature_names,
+                                       categorical_features)
+        pred_y = model.predict(X_test)
+        tree, tree_structure, values, categories = fit_tree_and_oracle(
+            error_analyzer, feature_names, y_test, pred_y)
+        expected = oracle_tree_json(values, tree_structure, categories,
+                                    feature_names, y_test, pred_y,
+                                    error_analyzer.metric)
+        methods = [node['method'] for node in tree]
+        assert METHOD_INCLUDES in methods
+        assert tree == expected
+
+    @pytest.mark.parametrize('metric', [Metrics.MEAN_SQUARED_ERROR,
+                                        Metrics.MEDIAN_ABSOLUTE_ERROR,
+                                        Metrics.R2_SCORE])
+    def test_leaf_statistics_match_oracle(self, metric):
+        X_train, X_test, y_train, y_test, feature_names = create_boston_data()
+        feature_names = list(feature_names)
+        model = create_models_regression(X_train, y_train)[0]
+        error_analyzer = ModelAnalyzer(model, X_test, y_test,
+                                       feature_names, [],
+                                       model_task=ModelTask.REGRESSION,
+                                       metric=metric)
+        pred_y = model.predict(X_test)
+        diff = pred_y - y_test
+        surrogate = create_surrogate_model(error_analyzer, X_test, diff,
+                                           3, 31, [])
+        model_json = surrogate._Booster.dump_model()
+        tree_structure = model_json["tree_info"][0]['tree_structure']
+        leaf_index = get_leaf_index(surrogate, X_test)
+        tree_arrays = flatten_tree(tree_structure)
+        node_stats = compute_node_statistics(tree_arrays, leaf_index,
+                                             y_test, pred_y,
+                                             ModelTask.REGRESSION)
+        node_summaries = get_node_summaries(node_stats,
+                                            ModelTask.REGRESSION, metric)
+        tree = tree_to_json(tree_arrays, ([], []), feature_names,
+                            node_summaries, metric)
+        expected = oracle_tree_json(X_test, tree_structure, ([], []),
+                                    feature_names, y_test, pred_y, metric)
+        assert len(tree) == len(expected)
+        for node, expected_node in zip(tree, expected):
+            assert node[ID] == expected_node[ID]
+            assert node[PARENTID] == expected_node[PARENTID]
+            assert node[SIZE] == expected_node[SIZE]
+            assert np.isclose(node[ERROR], expected_node[ERROR])
+            assert np.isclose(node['metricValue'],
+                              expected_node['metricValue'])
+
+    def test_constant_label_leaf_r2(self):
+        # the rows below 0.5 have constant labels and predictions, with
+        # a constant error that isolates them in the tree
+        rng = np.random.RandomState(777)
+        X = rng.uniform(size=(1000, 2))
+        feature_names = ['a', 'b']
+        is_constant = X[:, 0] < 0.5
+        true_y = np.where(is_constant, 0.1, rng.normal(size=len(X)))
+        pred_y = np.where(is_constant, 5.1,
+                          true_y + rng.normal(scale=0.1, size=len(X)))
+        error_analyzer = PredictionsAnalyzer(pred_y, X, true_y,
+                                             feature_names, [],
+                                             model_task=ModelTask.REGRESSION,
+                                             metric=Metrics.R2_SCORE)
+        surrogate = create_surrogate_model(error_analyzer, X,
+                                           pred_y - true_y, 3, 31, [])
+        tree_structure = surrogate._Booster.dump_model()[
+            'tree_info'][0]['tree_structure']
+        tree = error_analyzer.compute_error_tree(feature_names, None, None)
+        expected = oracle_tree_json(X, tree_structure, ([], []),
+                                    feature_names, true_y, pred_y,
+                                    Metrics.R2_SCORE)
+        assert len(tree) == len(expected)
+        for node, expected_node in zip(tree, expected):
+            assert node[ID] == expected_node[ID]
+            assert np.isclose(node['metricValue'],
+                              expected_node['metricValue'])
+        assert tree[1]['condition'] == 'a <= 0.50'
+        assert tree[1]['metricValue'] == 0
+
+    @pytest.mark.parametrize('model_task', [ModelTask.CLASSIFICATION,
+                                            ModelTask.REGRESSION])
+    def test_node_statistics_match_metric_statistics(self, model_task):
+        if model_task == ModelTask.CLASSIFICATION:
+            X, y = make_classification(n_samples=600, n_features=5,
+                                       flip_y=0.2, random_state=7)
+            X_train, X_test, y_train, y_test = train_test_split(
+                X, y, test_size=0.5, random_state=7)
+            feature_names = ['f{}'.format(i) for i in range(X.shape[1])]
+            model = LogisticRegression().fit(X_train, y_train)
+            pred_y = model.predict(X_test)
+            diff = pred_y != y_test
+            metrics = [Metrics.ERROR_RATE, Metrics.F1_SCORE,
+                       Metrics.PRECISION_SCORE, Metrics.RECALL_SCORE]
+        else:
+            X_train, X_test, y_train, y_test, feature_names = \
+                create_boston_data()
+            model = create_models_regression(X_train, y_train)[0]
+            pred_y = model.predict(X_test)
+            diff = pred_y - y_test
+            metrics = [Metrics.MEAN_ABSOLUTE_ERROR,
+                       Metrics.MEAN_SQUARED_ERROR,
+                       Metrics.MEDIAN_ABSOLUTE_ERROR, Metrics.R2_SCORE]
+        error_analyzer = ModelAnalyzer(model, X_test, y_test,
+                                       list(feature_names), [],
+                                       model_task=model_task)
+        surrogate = create_surrogate_model(error_analyzer, X_test, diff,
+                                           4, 31, [])
+        model_json = surrogate._Booster.dump_model()
+        tree_arrays = flatten_tree(
+            model_json["tree_info"][0]['tree_structure'])
+        leaf_index = get_leaf_index(surrogate, X_test)
+        node_stats = compute_node_statistics(tree_arrays, leaf_index,
+                                             y_test, pred_y, model_task)
+        assert tree_arrays.num_splits > 1
+        start, stop = tree_arrays.leaf_ranges()
+        leaf_rank = np.empty(tree_arrays.num_leaves, dtype=int)
+        leaf_rank[tree_arrays.leaf_index[tree_arrays.is_leaf]] = \
+            np.arange(tree_arrays.num_leaves)
+        row_rank = leaf_rank[leaf_index]
+        for position in range(len(tree_arrays)):
+            rows = (row_rank >= start[position]) & \
+                (row_rank < stop[position])
+            # the node statistics swap the true and predicted labels
+            expected = compute_metric_statistics(
+                np.zeros(np.sum(rows), dtype=int), 1, pred_y[rows],
+                y_test[rows], model_task,
+                median=model_task == ModelTask.REGRESSION)
+            assert node_stats.count[position] == expected.count[0]
+            assert node_stats.error_count[position] == \
+                expected.error_count[0]
+            assert np.isclose(node_stats.sum_abs_error[position],
+                              expected.sum_abs_error[0])
+            for metric in metrics:
+                assert np.isclose(node_stats.metric_value(metric)[position],
+                                  expected.metric_value(metric)[0],
+                                  equal_nan=True)
+
+    def test_flatten_tree(self):
+        X_train, X_test, y_train, y_test, feature_names = create_boston_data()
+        model = create_models_regression(X_train, y_train)[0]
+        error_analyzer = ModelAnalyzer(model, X_test, y_test,
+                                       feature_names, [],
+                                       model_task=ModelTask.REGRESSION)
+        diff = model.predict(X_test) - y_test
+        surrogate = create_surrogate_model(error_analyzer, X_test, diff,
+                                           4, 31, [])
+        model_json = surrogate._Booster.dump_model()
+        tree_structure = model_json["tree_info"][0]['tree_structure']
+        num_splits = count_splits(tree_structure)
+        tree_arrays = flatten_tree(tree_structure)
+        expected_ids = []
+        expected_parents = []
+        nodes = [(tree_structure, None)]
+        while nodes:
+            node, parent = nodes.pop()
+            expected_ids.append(get_node_id(node, num_splits))
+            expected_parents.append(parent)
+            if SPLIT_INDEX in node:
+                nodes.append((node[TreeSide.RIGHT_CHILD],
+                              node[SPLIT_INDEX]))
+                nodes.append((node[TreeSide.LEFT_CHILD],
+                              node[SPLIT_INDEX]))
+        assert list(tree_arrays.node_id) == expected_ids
+        parents = [None if parent < 0 else
+                   tree_arrays.split_index[parent]
+                   for parent in tree_arrays.parent]
+        assert parents == expected_parents
+        assert tree_arrays.num_splits == num_splits
+        assert tree_arrays.subtree_size[0] == len(tree_arrays)
+        assert np.all(tree_arrays.depth <= 4)
+
+    @pytest.mark.parametrize('max_nodes', [None, 2])
+    @pytest.mark.parametrize('tree_builder', [TreeBuilder.LIGHTGBM,
+                                              TreeBuilder.HISTOGRAM])
+    def test_error_tree_levels(self, max_nodes, tree_builder):
+        X_train, X_test, y_train, y_test, feature_names = create_boston_data()
+        feature_names = list(feature_names)
+        model = create_models_regression(X_train, y_train)[0]
+
+        def create_analyzer():
+            return ModelAnalyzer(model, X_test, y_test,
+                                 feature_names, [],
+                                 model_task=ModelTask.REGRESSION,
+                                 tree_builder=tree_builder)
+        error_analyzer = create_analyzer()
+        tree = create_analyzer().compute_error_tree(feature_names, None,
+                                                    None, max_depth=4)
+        chunks = list(error_analyzer.compute_error_tree_levels(
+            feature_names, None, None, max_depth=4, max_nodes=max_nodes))
+        assert_nodes_close(chunks[0], tree[:1])
+        streamed = [node for chunk in chunks for node in chunk]
+        assert_nodes_close(sorted(streamed, key=lambda node: node[ID]),
+                           sorted(tree, key=lambda node: node[ID]))
+        # the streamed tree is cached with its json
+        assert_nodes_close(error_analyzer.compute_error_tree(
+            feature_names, None, None, max_depth=4), tree)
+        seen = set()
+        for chunk in chunks:
+            if max_nodes is not None:
+                assert len(chunk) <= max_nodes
+            for node in chunk:
+                assert node[PARENTID] is None or node[PARENTID] in seen
+            seen.update(node[ID] for node in chunk)
+
+    def test_iter_json_serializes_levels_lazily(self, mocker):
+        X_train, X_test, y_train, y_test, feature_names = create_boston_data()
+        feature_names = list(feature_names)
+        model = create_models_regression(X_train, y_train)[0]
+        error_analyzer = ModelAnalyzer(model, X_test, y_test,
+                                       feature_names, [],
+                                       model_task=ModelTask.REGRESSION)
+        error_tree = fit_error_tree(error_analyzer, feature_names,
+                                    None, None)
+        node_json_spy = mocker.spy(surrogate_error_tree, 'create_node_json')
+        levels = error_tree.iter_json(error_analyzer.metric)
+        assert len(next(levels)) == 1
+        assert node_json_spy.call_count == 1
+        list(levels)
+        assert node_json_spy.call_count == len(error_tree.tree_arrays)
+        error_tree.to_json(error_analyzer.metric)
+        assert node_json_spy.call_count == len(error_tree.tree_arrays)
+
+    def test_error_tree_metric_projection(self):
+        X_train, X_test, y_train, y_test, feature_names = create_boston_data()
+        feature_names = list(feature_names)
+        model = create_models_regression(X_train, y_train)[0]
+        error_analyzer = ModelAnalyzer(model, X_test, y_test,
+                                       feature_names, [],
+                                       model_task=ModelTask.REGRESSION)
+        error_tree = fit_error_tree(error_analyzer, feature_names,
+                                    None, None)
+        for metric in [Metrics.MEAN_ABSOLUTE_ERROR,
+                       Metrics.MEAN_SQUARED_ERROR,
+                       Metrics.MEDIAN_ABSOLUTE_ERROR,
+                       Metrics.R2_SCORE]:
+            expected = ModelAnalyzer(model, X_test, y_test,
+                                     feature_names, [],
+                                     model_task=ModelTask.REGRESSION,
+                                     metric=metric).compute_error_tree(
+                feature_names, None, None)
+            assert error_tree.to_json(metric) == expected
+            assert error_analyzer.compute_error_tree(
+                feature_names, None, None, metric=metric) == expected
 
 
 def run_error_analyzer(model, X_test, y_test, feature_names,
@@ -110,12 +363,7 @@ def run_error_analyzer(model, X_test, y_test, feature_names,
 
 def validate_traversed_tree(tree, tree_dict, max_split_index,
                             feature_names, parent_id=None):
-    if SPLIT_INDEX in tree:
-        nodeid = tree[SPLIT_INDEX]
-    elif LEAF_INDEX in tree:
-        nodeid = max_split_index + tree[LEAF_INDEX]
-    else:
-        nodeid = 0
+    nodeid = get_node_id(tree, max_split_index)
 
     assert tree_dict[nodeid]['id'] == nodeid
     assert tree_dict[nodeid]['parentId'] == parent_id
@@ -139,3 +387,138 @@ def validate_traversed_tree(tree, tree_dict, max_split_index,
                                 max_split_index,
                                 feature_names,
                                 nodeid)
+
+
+def fit_tree_and_oracle(error_analyzer, feature_names, true_y, pred_y):
+    """Fits the error tree of the analyzer and its lightgbm surrogate.
+
+    :return: The json tree of the analyzer, the dumped surrogate tree,
+        the encoded features and the categorical info of the tree.
+    :rtype: tuple
+    """
+    tree = error_analyzer.compute_error_tree(feature_names, None, None)
+    cat_ind_reindexed, categories_reindexed = get_categorical_info(
+        error_analyzer, feature_names)
+    values = error_analyzer.column_store.gather(
+        feature_names, np.arange(len(true_y)), encoded=True)
+    diff = pred_y != true_y
+    surrogate = create_surrogate_model(error_analyzer, values, diff,
+                                       3, 31, cat_ind_reindexed)
+    model_json = surrogate._Booster.dump_model()
+    tree_structure = model_json["tree_info"][0]['tree_structure']
+    return (tree, tree_structure, values,
+            (categories_reindexed, cat_ind_reindexed))
+
+
+def count_splits(tree_structure):
+    num_splits = 0
+    nodes = [tree_structure]
+    while nodes:
+        node = nodes.pop()
+        if SPLIT_INDEX in node:
+            num_splits += 1
+            nodes.append(node[TreeSide.LEFT_CHILD])
+            nodes.append(node[TreeSide.RIGHT_CHILD])
+    return num_splits
+
+
+def assert_nodes_close(nodes, expected_nodes):
+    # the statistics of a level streamed by the histogram builder are
+    # summed over fewer leaves than in the full tree
+    assert len(nodes) == len(expected_nodes)
+    for node, expected in zip(nodes, expected_nodes):
+        assert node.keys() == expected.keys()
+        for key, value in node.items():
+            if isinstance(value, float):
+                assert value == pytest.approx(expected[key])
+            else:
+                assert value == expected[key]
+
+
+def get_node_id(node, num_splits):
+    if SPLIT_INDEX in node:
+        return node[SPLIT_INDEX]
+    elif LEAF_INDEX in node:
+        return num_splits + node[LEAF_INDEX]
+    return 0
+
+
+def oracle_tree_json(values, tree_structure, categories, feature_names,
+                     true_y, pred_y, metric):
+    """Reference json tree computed by filtering the rows of every node.
+
+    The rows of each node are selected with masks along the path from
+    the root of the dumped lightgbm tree, and the metrics are computed by
+    scikit-learn on the selected rows, independently of the statistics
+    aggregated by the analyzer.
+    """
+    values = np.asarray(values)
+    true_y = np.asarray(true_y)
+    pred_y = np.asarray(pred_y)
+    num_splits = count_splits(tree_structure)
+    json = []
+    nodes = [(tree_structure, None, np.ones(len(true_y), dtype=bool))]
+    while nodes:
+        node, parent_condition, mask = nodes.pop()
+        if parent_condition is None:
+            parent_condition = (None, None, None, None, None)
+        node_name = None
+        if SPLIT_FEATURE in node:
+            node_name = feature_names[node[SPLIT_FEATURE]]
+        total, error, success, metric_value = oracle_node_metric(
+            true_y[mask], pred_y[mask], metric)
+        json.append(create_node_json(node_name,
+                                     get_node_id(node, num_splits),
+                                     metric, parent_condition, total,
+                                     error, success, metric_value))
+        if SPLIT_INDEX not in node:
+            continue
+        split_feature = node[SPLIT_FEATURE]
+        column = values[:, split_feature]
+        sides = []
+        if node['decision_type'] == '==':
+            arg = [float(category)
+                   for category in str(node['threshold']).split('||')]
+            left_mask = np.isin(column, arg)
+            for method in [METHOD_INCLUDES, METHOD_EXCLUDES]:
+                sides.append((method, arg, create_categorical_condition(
+                    method, arg, node_name, split_feature, categories)))
+        else:
+            arg = float(node['threshold'])
+            left_mask = column <= arg
+            sides.append((METHOD_LESS_AND_EQUAL, arg,
+                          "{} <= {:.2f}".format(node_name, arg)))
+            sides.append((METHOD_GREATER, arg,
+                          "{} > {:.2f}".format(node_name, arg)))
+        children = [(node[TreeSide.LEFT_CHILD], mask & left_mask),
+                    (node[TreeSide.RIGHT_CHILD], mask & ~left_mask)]
+        # push the right child first so the left child is visited first
+        for (child, child_mask), (method, arg, condition) in \
+                reversed(list(zip(children, sides))):
+            child_condition = (node[SPLIT_INDEX], node_name, method, arg,
+                               condition)
+            nodes.append((child, child_condition, child_mask))
+    return json
+
+
+def oracle_node_metric(true_y, pred_y, metric):
+    total = len(true_y)
+    if total == 0 and metric != Metrics.ERROR_RATE:
+        return total, 0, 0, 0
+    if metric == Metrics.ERROR_RATE:
+        error = np.sum(pred_y != true_y)
+        metric_value = 0 if total == 0 else error / total
+        return total, error, total - error, metric_value
+    # Note: the metrics of the tree nodes are computed with the true and
+    # predicted labels swapped
+    if metric == Metrics.R2_SCORE and total > 1 and np.ptp(pred_y) == 0:
+        # the convention of sklearn for constant labels, which sklearn
+        # itself may miss when the mean of the labels is rounded
+        metric_value = float(np.array_equal(pred_y, true_y))
+    else:
+        metric_value = metric_to_func[metric](pred_y, true_y)
+    if metric in [Metrics.F1_SCORE, Metrics.PRECISION_SCORE,
+                  Metrics.RECALL_SCORE]:
+        error = np.sum(pred_y != true_y)
+        return total, error, total - error, metric_value
+    return total, np.sum(np.abs(pred_y - true_y)), 0, metric_value
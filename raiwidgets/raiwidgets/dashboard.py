@@ -8,6 +8,7 @@ import os
 import uuid
 
 from html.parser import HTMLParser
+from flask import Response, stream_with_context
 from rai_core_flask import FlaskHelper  # , environment_detector
 
 from responsibleai.serialization_utilities import serialize_json_safe
@@ -115,6 +116,24 @@ class Dashboard(object):
                            default=serialize_json_safe))
             return content
 
+    @staticmethod
+    def stream_json_lines(chunks):
+        """Streams the chunks as newline delimited json.
+
+        Each chunk is serialized and flushed to the client as soon as it
+        is produced, one json document per line.
+
+        :param chunks: The chunks to stream.
+        :type chunks: Iterator
+        :return: The streaming response.
+        :rtype: flask.Response
+        """
+        def generate():
+            for chunk in chunks:
+                yield json.dumps(chunk, default=serialize_json_safe) + '\n'
+        return Response(stream_with_context(generate()),
+                        mimetype='application/x-ndjson')
+
     def add_url_rule(self, func, route, methods):
         """To enable multiple dashboards to run in the same notebook we need to
         prevent them from using the same method names (in addition to using
@@ -81,7 +81,7 @@ class ErrorAnalysisDashboard(Dashboard):
                  categorical_features=None, true_y_dataset=None,
                  pred_y=None, model_task=ModelTask.UNKNOWN,
                  metric=None, max_depth=DEFAULT_MAX_DEPTH,
-                 num_leaves=DEFAULT_NUM_LEAVES):
+                 num_leaves=DEFAULT_NUM_LEAVES, predictor=None):
         """ErrorAnalysis Dashboard Class.
 
         :param explanation: An object that represents an explanation.
@@ -141,12 +141,16 @@ class ErrorAnalysisDashboard(Dashboard):
         :param num_leaves: The number of leaves of the surrogate tree
             trained on errors.
         :type num_leaves: int
+        :param predictor: The predictor calling the model on chunks of
+            the dataset, optionally in parallel, by default the whole
+            dataset is predicted at once.
+        :type predictor: erroranalysis._internal.batch_predictor.BatchPredictor
         """
         self.input = ErrorAnalysisDashboardInput(
             explanation, model, dataset, true_y, classes,
             features, categorical_features,
             true_y_dataset, pred_y, model_task, metric,
-            max_depth, num_leaves)
+            max_depth, num_leaves, predictor=predictor)
         super(ErrorAnalysisDashboard, self).__init__(
             dashboard_type="ErrorAnalysis",
             model_data=self.input.dashboard_input,
@@ -163,6 +167,9 @@ class ErrorAnalysisDashboard(Dashboard):
 
         def tree():
             data = request.get_json(force=True)
+            if request.args.get('stream') == 'true':
+                return self.stream_json_lines(self.input.debug_ml_levels(
+                    data[0], data[1], data[2]))
             return jsonify(self.input.debug_ml(data[0], data[1], data[2]))
 
         self.add_url_rule(tree, '/tree', methods=["POST"])
@@ -174,6 +181,11 @@ class ErrorAnalysisDashboard(Dashboard):
         self.add_url_rule(matrix, '/matrix', methods=["POST"])
 
         def importances():
-            return jsonify(self.input.importances())
+            # Note: older clients post no cohort, for the whole dataset
+            data = request.get_json(force=True, silent=True) or [None, None]
+            if request.args.get('stream') == 'true':
+                return self.stream_json_lines(
+                    self.input.importances_incremental(data[0], data[1]))
+            return jsonify(self.input.importances(data[0], data[1]))
 
         self.add_url_rule(importances, '/importances', methods=["POST"])
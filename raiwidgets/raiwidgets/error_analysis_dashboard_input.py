@@ -11,6 +11,7 @@ import traceback
 from .constants import ModelTask, SKLearn
 from .error_handling import _format_exception
 from responsibleai.serialization_utilities import serialize_json_safe
+from erroranalysis._internal.batch_predictor import BatchPredictor
 from erroranalysis._internal.error_analyzer import (
     ModelAnalyzer, PredictionsAnalyzer)
 from erroranalysis._internal.metrics import metric_to_func
@@ -37,7 +38,8 @@ class ErrorAnalysisDashboardInput:
             model_task,
             metric,
             max_depth,
-            num_leaves):
+            num_leaves,
+            predictor=None):
         """Initialize the ErrorAnalysis Dashboard Input.
 
         :param explanation: An object that represents an explanation.
@@ -93,8 +95,14 @@ class ErrorAnalysisDashboardInput:
         :param num_leaves: The number of leaves of the surrogate tree
             trained on errors.
         :type num_leaves: int
+        :param predictor: The predictor calling the model on chunks of
+            the dataset, by default the whole dataset is predicted at once.
+        :type predictor: erroranalysis._internal.batch_predictor.BatchPredictor
         """
         self._model = model
+        if predictor is None:
+            predictor = BatchPredictor()
+        self._predictor = predictor
         full_dataset = dataset
         if true_y_dataset is None:
             full_true_y = true_y
@@ -159,8 +167,37 @@ class ErrorAnalysisDashboardInput:
 
         self.dashboard_input[ENABLE_PREDICT] = model_available
 
+        # Note: the analyzer is lazy, the model is only called when the
+        # predictions are first needed
         if model_available:
-            predicted_y = self.compute_predicted_y(model, dataset)
+            self._error_analyzer = ModelAnalyzer(model,
+                                                 full_dataset,
+                                                 full_true_y,
+                                                 features,
+                                                 categorical_features,
+                                                 model_task,
+                                                 metric,
+                                                 predictor=predictor)
+        else:
+            # Model task cannot be unknown when passing predictions
+            # Assume classification for backwards compatibility
+            if model_task == ModelTask.UNKNOWN:
+                model_task = ModelTask.CLASSIFICATION
+            self._error_analyzer = PredictionsAnalyzer(pred_y,
+                                                       full_dataset,
+                                                       full_true_y,
+                                                       features,
+                                                       categorical_features,
+                                                       model_task,
+                                                       metric)
+
+        if model_available:
+            # the full dataset is only predicted once, by the analyzer
+            error_analyzer = None
+            if dataset is full_dataset:
+                error_analyzer = self._error_analyzer
+            predicted_y = self.compute_predicted_y(model, dataset,
+                                                   error_analyzer)
         else:
             predicted_y = self.predicted_y_to_list(pred_y)
 
@@ -209,7 +246,8 @@ class ErrorAnalysisDashboardInput:
         if model_available and hasattr(model, SKLearn.PREDICT_PROBA) \
                 and model.predict_proba is not None and dataset is not None:
             try:
-                probability_y = model.predict_proba(dataset)
+                probability_y = self._predictor.predict(model.predict_proba,
+                                                        dataset)
             except Exception as ex:
                 ex_str = _format_exception(ex)
                 raise ValueError("Model does not support predict_proba method"
@@ -225,26 +263,6 @@ class ErrorAnalysisDashboardInput:
             self.dashboard_input[
                 ExplanationDashboardInterface.PROBABILITY_Y
             ] = probability_y
-        if model_available:
-            self._error_analyzer = ModelAnalyzer(model,
-                                                 full_dataset,
-                                                 full_true_y,
-                                                 features,
-                                                 categorical_features,
-                                                 model_task,
-                                                 metric)
-        else:
-            # Model task cannot be unknown when passing predictions
-            # Assume classification for backwards compatibility
-            if model_task == ModelTask.UNKNOWN:
-                model_task = ModelTask.CLASSIFICATION
-            self._error_analyzer = PredictionsAnalyzer(pred_y,
-                                                       full_dataset,
-                                                       full_true_y,
-                                                       features,
-                                                       categorical_features,
-                                                       model_task,
-                                                       metric)
         if self._categorical_features:
             self.dashboard_input[
                 ExplanationDashboardInterface.CATEGORICAL_MAP
@@ -261,7 +279,9 @@ class ErrorAnalysisDashboardInput:
             else:
                 metric = self._error_analyzer.metric
         if model_available and true_y_dataset is not None:
-            full_predicted_y = self.compute_predicted_y(model, full_dataset)
+            # reuse the predictions cached by the error analyzer
+            full_predicted_y = self.predicted_y_to_list(
+                self._error_analyzer.pred_y)
         else:
             full_predicted_y = predicted_y
         self.set_root_metric(full_predicted_y, full_true_y, metric)
@@ -294,11 +314,16 @@ class ErrorAnalysisDashboardInput:
             ExplanationDashboardInterface.ROOT_STATS
         ] = root_stats
 
-    def compute_predicted_y(self, model, dataset):
+    def compute_predicted_y(self, model, dataset, error_analyzer=None):
         predicted_y = None
         if dataset is not None and model is not None:
             try:
-                predicted_y = model.predict(dataset)
+                if error_analyzer is None:
+                    predicted_y = self._predictor.predict(model.predict,
+                                                          dataset)
+                else:
+                    # reuse the predictions cached by the error analyzer
+                    predicted_y = error_analyzer.pred_y
             except Exception as ex:
                 ex_str = _format_exception(ex)
                 msg = "Model does not support predict method for given"
@@ -433,6 +458,25 @@ class ErrorAnalysisDashboardInput:
                 WidgetRequestResponseConstants.DATA: []
             }
 
+    def debug_ml_levels(self, features, filters, composite_filters):
+        try:
+            levels = self._error_analyzer.compute_error_tree_levels(
+                features, filters, composite_filters,
+                max_depth=self._max_depth,
+                num_leaves=self._num_leaves)
+            for level in levels:
+                yield {
+                    WidgetRequestResponseConstants.DATA: level
+                }
+        except Exception as e:
+            print(e)
+            traceback.print_exc()
+            yield {
+                WidgetRequestResponseConstants.ERROR:
+                    "Failed to generate json tree representation",
+                WidgetRequestResponseConstants.DATA: []
+            }
+
     def matrix(self, features, filters, composite_filters):
         try:
             if features[0] is None and features[1] is None:
@@ -451,9 +495,10 @@ class ErrorAnalysisDashboardInput:
                 WidgetRequestResponseConstants.DATA: []
             }
 
-    def importances(self):
+    def importances(self, filters=None, composite_filters=None):
         try:
-            scores = self._error_analyzer.compute_importances()
+            scores = self._error_analyzer.compute_importances(
+                filters, composite_filters)
             return {
                 WidgetRequestResponseConstants.DATA: scores
             }
@@ -466,6 +511,23 @@ class ErrorAnalysisDashboardInput:
                 WidgetRequestResponseConstants.DATA: []
             }
 
+    def importances_incremental(self, filters=None, composite_filters=None):
+        try:
+            scores = self._error_analyzer.iter_importances(
+                filters, composite_filters)
+            for feature, score in scores:
+                yield {
+                    WidgetRequestResponseConstants.DATA: [feature, score]
+                }
+        except Exception as e:
+            print(e)
+            traceback.print_exc()
+            yield {
+                WidgetRequestResponseConstants.ERROR:
+                    "Failed to generate feature importances",
+                WidgetRequestResponseConstants.DATA: []
+            }
+
     def on_predict(self, data):
         try:
             if self._dataframeColumns is not None:
@@ -43,6 +43,9 @@ class ModelAnalysisDashboard(Dashboard):
 
         def tree():
             data = request.get_json(force=True)
+            if request.args.get('stream') == 'true':
+                return self.stream_json_lines(
+                    self.input.debug_ml_levels(data))
             return jsonify(self.input.debug_ml(data))
 
         self.add_url_rule(tree, '/tree', methods=["POST"])
@@ -60,6 +63,11 @@ class ModelAnalysisDashboard(Dashboard):
         self.add_url_rule(causal_whatif, '/causal_whatif', methods=["POST"])
 
         def importances():
-            return jsonify(self.input.importances())
+            # Note: older clients post no cohort, for the whole dataset
+            data = request.get_json(force=True, silent=True) or [None, None]
+            if request.args.get('stream') == 'true':
+                return self.stream_json_lines(
+                    self.input.importances_incremental(data[0], data[1]))
+            return jsonify(self.input.importances(data[0], data[1]))
 
         self.add_url_rule(importances, '/importances', methods=["POST"])
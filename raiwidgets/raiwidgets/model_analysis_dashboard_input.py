@@ -71,6 +71,25 @@ class ModelAnalysisDashboardInput:
                 WidgetRequestResponseConstants.data: []
             }
 
+    def debug_ml_levels(self, data):
+        try:
+            features, filters, composite_filters, max_depth, num_leaves = data
+            levels = self._error_analyzer.compute_error_tree_levels(
+                features, filters, composite_filters,
+                max_depth, num_leaves)
+            for level in levels:
+                yield {
+                    WidgetRequestResponseConstants.data: level
+                }
+        except Exception as e:
+            print(e)
+            traceback.print_exc()
+            yield {
+                WidgetRequestResponseConstants.error:
+                    f"Failed to generate json tree representation:{str(e)}",
+                WidgetRequestResponseConstants.data: []
+            }
+
     def matrix(self, data):
         try:
             features, filters, composite_filters = data
@@ -90,9 +109,10 @@ class ModelAnalysisDashboardInput:
                 WidgetRequestResponseConstants.data: []
             }
 
-    def importances(self):
+    def importances(self, filters=None, composite_filters=None):
         try:
-            scores = self._error_analyzer.compute_importances()
+            scores = self._error_analyzer.compute_importances(
+                filters, composite_filters)
             return {
                 WidgetRequestResponseConstants.data: scores
             }
@@ -105,6 +125,23 @@ class ModelAnalysisDashboardInput:
                 WidgetRequestResponseConstants.data: []
             }
 
+    def importances_incremental(self, filters=None, composite_filters=None):
+        try:
+            scores = self._error_analyzer.iter_importances(
+                filters, composite_filters)
+            for feature, score in scores:
+                yield {
+                    WidgetRequestResponseConstants.data: [feature, score]
+                }
+        except Exception as e:
+            print(e)
+            traceback.print_exc()
+            yield {
+                WidgetRequestResponseConstants.error:
+                    "Failed to generate feature importances",
+                WidgetRequestResponseConstants.data: []
+            }
+
     def causal_whatif(self, post_data):
         try:
             id, features, feature_name, new_value, target = post_data
@@ -152,10 +152,13 @@ class ErrorAnalysisManager(BaseManager):
     :type dataset: pandas.DataFrame
     :param target_column: The name of the label column.
     :type target_column: str
+    :param predictor: The predictor calling the model on chunks of the
+        dataset, or None to predict the whole dataset at once.
+    :type predictor: erroranalysis._internal.batch_predictor.BatchPredictor
     """
 
     def __init__(self, model, dataset, target_column,
-                 categorical_features=None):
+                 categorical_features=None, predictor=None):
         """Defines the ErrorAnalysisManager for discovering errors in a model.
 
         :param model: The model to analyze errors on.
@@ -166,6 +169,10 @@ class ErrorAnalysisManager(BaseManager):
         :type dataset: pandas.DataFrame
         :param target_column: The name of the label column.
         :type target_column: str
+        :param predictor: The predictor calling the model on chunks of the
+            dataset, or None to predict the whole dataset at once.
+        :type predictor:
+            erroranalysis._internal.batch_predictor.BatchPredictor
         """
         self._true_y = dataset[target_column]
         self._dataset = dataset.drop(columns=[target_column])
@@ -177,7 +184,8 @@ class ErrorAnalysisManager(BaseManager):
                                        self._dataset,
                                        self._true_y,
                                        self._feature_names,
-                                       self._categorical_features)
+                                       self._categorical_features,
+                                       predictor=predictor)
 
     def add(self, max_depth=3, num_leaves=31, filter_features=None):
         """Add an error analyzer to be computed later.
@@ -10,7 +10,7 @@ from pathlib import Path
 import pickle
 import warnings
 
-
+from erroranalysis._internal.batch_predictor import BatchPredictor
 from responsibleai._input_processing import _convert_to_list
 from responsibleai._interfaces import ModelAnalysisData, Dataset
 from responsibleai._internal.constants import\
@@ -68,11 +68,15 @@ class ModelAnalysis(object):
         The load method returns the deserialized model from the same
         parent directory.
     :type serializer: object
+    :param predictor: The predictor calling the model on chunks of the
+        test dataset, optionally in parallel.  By default the whole test
+        dataset is predicted at once.  The predictor is not saved.
+    :type predictor: erroranalysis._internal.batch_predictor.BatchPredictor
     """
 
     def __init__(self, model, train, test, target_column,
                  task_type, categorical_features=None, train_labels=None,
-                 serializer=None):
+                 serializer=None, predictor=None):
         """Defines the top-level Model Analysis API.
         Use ModelAnalysis to analyze errors, explain the most important
         features, compute counterfactuals and run causal analysis in a
@@ -99,6 +103,10 @@ class ModelAnalysis(object):
             method returns a dictionary state and load method returns the
             model.
         :type serializer: object
+        :param predictor: The predictor calling the model on chunks of the
+            test dataset, optionally in parallel.
+        :type predictor:
+            erroranalysis._internal.batch_predictor.BatchPredictor
         """
         self._validate_model_analysis_input_parameters(
             model=model, train=train, test=test,
@@ -113,6 +121,7 @@ class ModelAnalysis(object):
         self.task_type = task_type
         self.categorical_features = categorical_features
         self._serializer = serializer
+        self._predictor = predictor
         self._train_labels = train_labels
         self._classes = ModelAnalysis._get_classes(
             task_type=self.task_type,
@@ -131,7 +140,8 @@ class ModelAnalysis(object):
 
         self._error_analysis_manager = ErrorAnalysisManager(
             model, test, target_column,
-            categorical_features)
+            categorical_features,
+            predictor=predictor)
 
         self._explainer_manager = ExplainerManager(
             model, train, test,
@@ -386,7 +396,10 @@ class ModelAnalysis(object):
                 "Unsupported dataset type") from ex
         if dataset is not None and self.model is not None:
             try:
-                predicted_y = self.model.predict(dataset)
+                predictor = self._predictor
+                if predictor is None:
+                    predictor = BatchPredictor()
+                predicted_y = predictor.predict(self.model.predict, dataset)
             except Exception as ex:
                 msg = "Model does not support predict method for given"
                 "dataset type"
@@ -536,6 +549,7 @@ class ModelAnalysis(object):
         inst.__dict__[_TASK_TYPE] = meta[_TASK_TYPE]
         inst.__dict__[_CATEGORICAL_FEATURES] = meta[_CATEGORICAL_FEATURES]
         inst.__dict__['_' + _TRAN_LABELS] = meta[_TRAN_LABELS]
+        inst.__dict__['_predictor'] = None
         inst.__dict__['_' + _CLASSES] = ModelAnalysis._get_classes(
             task_type=meta[_TASK_TYPE],
             train=train,